@@ -1,26 +1,39 @@
 # Import Flask, render_template, and database functions
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from database import get_all_posts, get_post_by_id, create_post, update_post, delete_post, get_posts_by_tag, get_all_tags, get_comments_for_post, create_comment, delete_comment, get_posts_count
-from validation import validate_post_data, validate_comment_data, validate_image_url, validate_pagination_params, sanitize_tags
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify, abort
+from markupsafe import Markup, escape
+from database import get_post_summaries, get_post_by_id, create_post, update_post, delete_post, get_all_tags, get_comments_page, create_comment, delete_comment, get_posts_count, init_app, get_posts_page, encode_cursor, decode_cursor, encode_comment_cursor, decode_comment_cursor, search_posts, store_upload, SORT_ORDERS, add_write_listener, get_site_version, get_post_version, HIGHLIGHT_START, HIGHLIGHT_END
+from validation import validate_post_data, validate_comment_data, validate_image_url, validate_pagination_params, validate_search_query, sanitize_tags
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash
-import uuid
+from werkzeug.http import is_resource_modified
+from urllib.parse import urlencode
+import hashlib
+import re
+import tempfile
+import cache
+import images
+import prerender
+import rendering
 
 # =============================================================================
 # Table of Contents
 # 1. Configuration and Setup
 # 2. Template Filters
 # 3. File Upload Helpers
-# 4. Authentication Configuration
-# 5. Public Routes
-# 6. Authentication Routes
-# 7. Post Management Routes
-# 8. Comment Management Routes
-# 9. Tag Filtering Routes
-# 10. Application Entry Point
+# 4. Pagination Helpers
+# 5. Conditional GET
+# 6. Page Cache
+# 7. Pre-rendered Pages
+# 8. Authentication Configuration
+# 9. Public Routes
+# 10. Authentication Routes
+# 11. Post Management Routes
+# 12. Comment Management Routes
+# 13. Tag Filtering Routes
+# 14. Application Entry Point
 # =============================================================================
 
 # -----------------------------------------------------------------------------
@@ -39,50 +52,64 @@ app.secret_key = os.getenv('SECRET_KEY')
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB in bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read (and hashed) at a time while saving an upload
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
+# Uploads still work without Pillow, but every page then sends the full-size originals
+if not images.available():
+    print("Warning: Pillow is not installed, so uploads get no resized copies "
+          "(pip install -r requirements.txt)")
+
+# Set by freeze.py while exporting the site as static files: links between
+# listing pages then point at the exported files instead of query strings
+app.config['STATIC_LINKS'] = False
+
+# Share one pooled database connection per request
+init_app(app)
+
 # -----------------------------------------------------------------------------
 # 2. Template Filters
 # -----------------------------------------------------------------------------
 
-# Custom Jinja2 filter for Norwegian date format
+# Custom Jinja2 filters for Norwegian date format. Posts store their dates
+# already formatted (created_display, see rendering.py); these format the rest
 @app.template_filter('norwegian_date')
 def norwegian_date_filter(date_string):
     """Convert date from YYYY-MM-DD to DD mon YYYY (Norwegian style)"""
-    try:
-        # Parse the date string
-        date_obj = datetime.strptime(date_string, '%Y-%m-%d')
-
-        # Norwegian month abbreviations
-        norwegian_months = {
-            1: 'jan', 2: 'feb', 3: 'mar', 4: 'apr', 5: 'mai', 6: 'jun',
-            7: 'jul', 8: 'aug', 9: 'sep', 10: 'okt', 11: 'nov', 12: 'des'
-        }
-
-        # Format as DD mon YYYY
-        day = date_obj.day
-        month = norwegian_months[date_obj.month]
-        year = date_obj.year
-
-        return f"{day:02d} {month} {year}"
-    except:
-        # If parsing fails, return original string
-        return date_string
+    return rendering.norwegian_date(date_string)
 
 @app.template_filter('norwegian_datetime')
 def norwegian_datetime_filter(datetime_string):
     """Convert datetime to DD mon YYYY - HH:MM format (e.g., 17 des 2025 - 14:30)"""
-    try:
-        dt_obj = datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S')
-        norwegian_months = {
-            1: 'jan', 2: 'feb', 3: 'mar', 4: 'apr', 5: 'mai', 6: 'jun',
-            7: 'jul', 8: 'aug', 9: 'sep', 10: 'okt', 11: 'nov', 12: 'des'
-        }
-        return f"{dt_obj.day:02d} {norwegian_months[dt_obj.month]} {dt_obj.year} - {dt_obj.hour:02d}:{dt_obj.minute:02d}"
-    except:
-        return datetime_string
+    return rendering.norwegian_datetime(datetime_string)
+
+@app.template_filter('highlight')
+def highlight_filter(snippet):
+    """Escape a search snippet and turn SQLite's match markers into <mark> tags"""
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+# Rendered post cards, shared by every listing, sort order and page
+card_cache = cache.FragmentCache()
+
+@app.template_global('post_card')
+def post_card(post, template_name='post_card.html', snippet=None):
+    """Render a post card for a listing, reusing an earlier rendering if nothing changed
+
+    The key holds every field the card shows (id, updated_at and comment
+    count among them) and the loaded template, which is reloaded (a new key)
+    when the file changes in debug mode. Search results pass the snippet of
+    matching text, which the card shows instead of the excerpt.
+    """
+    template = app.jinja_env.get_template(template_name)
+    # The image's resized copies are one of the post's fields, so they are part of the key too
+    image = image_variants(post)
+    return card_cache.get_or_render(
+        (template, post.values(), snippet),
+        lambda: Markup(template.render(post=post, image=image, snippet=snippet))
+    )
 
 # -----------------------------------------------------------------------------
 # 3. File Upload Helpers
@@ -93,39 +120,348 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_uploaded_file(file):
-    """Save uploaded file and return the URL path"""
+    """Save uploaded file and return the URL path
+
+    The file is named after the SHA-256 of its content, so uploading the same
+    image again reuses the stored copy instead of saving another one.
+    """
     if file and allowed_file(file.filename):
-        # Generate unique filename to avoid collisions
         ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        folder = app.config['UPLOAD_FOLDER']
 
         # Ensure upload directory exists
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        os.makedirs(folder, exist_ok=True)
+
+        # Stream the upload to a temporary file, hashing it on the way
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+
+            sha256 = digest.hexdigest()
+            image_url, stored = store_upload(
+                sha256, f"/static/uploads/{sha256}.{ext}", size,
+                lambda url: os.replace(tmp_path, os.path.join(folder, url.split('/')[-1]))
+            )
+        finally:
+            # Left over if the same content was already stored (or saving failed)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if stored:
+            # Make the resized copies in the background (see images.py)
+            images.schedule(os.path.join(folder, image_url.split('/')[-1]), image_url)
+        return image_url
+    return None
+
+def delete_unused_uploads():
+    """Delete uploaded images (and their resized copies) that no post uses any more"""
+    images.collect_unused(app.config['UPLOAD_FOLDER'])
+
+# Uploads are named by their content (see save_uploaded_file()), and so are
+# their resized copies, so a URL never changes what it points at
+IMMUTABLE_UPLOAD = re.compile(r'^uploads/[0-9a-f]{64}(-\d+)?\.\w+$')
+
+@app.after_request
+def cache_uploads_forever(response):
+    """Let browsers and CDNs keep content-addressed uploads without revalidating"""
+    if request.endpoint == 'static' and response.status_code in (200, 304) \
+            and IMMUTABLE_UPLOAD.match(request.view_args.get('filename', '')):
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+@app.template_global('image_variants')
+def image_variants(post):
+    """The resized copies of a post's image for the responsive_image macro, or None
+
+    They come with the post record, so rendering never waits on the database.
+    """
+    return images.parse_variants(post.image_variants)
+
+# -----------------------------------------------------------------------------
+# 4. Pagination Helpers
+# -----------------------------------------------------------------------------
+
+def static_listing_path(path, page, sort=None):
+    """Where a page of a listing is saved by freeze.py, e.g. /blog/title_asc/2/ or /tag/python/3/"""
+    if sort:
+        return f'{path}/{sort}/{page}/'
+    return f'{path}/' if page == 1 else f'{path}/{page}/'
+
+@app.template_global('listing_url')
+def listing_url(path, page, sort=None, **cursor):
+    """Link to a page of a listing, e.g. listing_url('/blog', 2, sort='date_desc', after=cursor)
+
+    path must already be URL-encoded - for tag pages, build it with
+    url_for('filter_by_tag', tag_name=tag).
+    """
+    if app.config['STATIC_LINKS']:
+        return static_listing_path(path, page, sort)
+    args = {'sort': sort, 'page': page, **cursor}
+    return path + '?' + urlencode({name: value for name, value in args.items() if value is not None})
+
+def get_paginated_posts(sort_by, page, per_page, tag=None):
+    """Get a page of posts for a listing using the ?after= / ?before= cursors
+
+    Links without a cursor (old ?page=N links) fall back to OFFSET paging.
+
+    Returns:
+        tuple: (posts, pagination) where pagination holds has_prev, has_next,
+        prev_cursor and next_cursor for the template
+    """
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = after or before
+
+    position = decode_cursor(cursor, sort_by) if cursor else None
+    if cursor and position is None:
+        flash('Invalid page link', 'error')
+
+    if position is not None and after:
+        posts, has_next = get_posts_page(sort_by, per_page, after=position, tag=tag)
+        has_prev = True
+    elif position is not None:
+        posts, has_prev = get_posts_page(sort_by, per_page, before=position, tag=tag)
+        has_next = True
+    elif page > 1:
+        posts, has_next = get_posts_page(sort_by, per_page, tag=tag, offset=(page - 1) * per_page)
+        has_prev = True
+    else:
+        posts, has_next = get_posts_page(sort_by, per_page, tag=tag)
+        has_prev = False
+
+    pagination = {
+        'has_prev': has_prev and bool(posts),
+        'has_next': has_next and bool(posts),
+        'prev_cursor': encode_cursor(posts[0], sort_by) if posts else None,
+        'next_cursor': encode_cursor(posts[-1], sort_by) if posts else None,
+    }
+    return posts, pagination
+
+# Posts on a page of /blog, on a tag page, and featured on the home page
+POSTS_PER_PAGE = 6
+TAG_POSTS_PER_PAGE = 12
+FEATURED_POSTS = 3
+
+# Comments shown on a post page, and added by each "load more"
+COMMENTS_PER_PAGE = 20
+
+def get_comment_page(post_id, cursor=None):
+    """Get a page of a post's comments, starting after the comment a cursor points at
+
+    Returns:
+        tuple: (comments, next_cursor) - next_cursor is None on the last page
+    """
+    position = decode_comment_cursor(cursor) if cursor else None
+    comments, has_more = get_comments_page(post_id, COMMENTS_PER_PAGE, after=position)
+    next_cursor = encode_comment_cursor(comments[-1]) if has_more else None
+    return comments, next_cursor
 
-        # Save the file
-        file.save(filepath)
+# -----------------------------------------------------------------------------
+# 5. Conditional GET
+# -----------------------------------------------------------------------------
+# Pages get a weak ETag and Last-Modified built from the change watermarks in
+# the database, so browsers and CDNs can revalidate with If-None-Match /
+# If-Modified-Since and get a 304 before any template is rendered.
+# (Static files, uploads included, already get the same from Flask.)
+
+# Endpoints whose content depends on all posts / on one post and its comments
+SITE_PAGES = {'home', 'blog', 'filter_by_tag'}
+POST_PAGES = {'blog_post', 'post_comments'}
+
+# Part of every ETag, so a deploy with changed templates doesn't get 304s
+TEMPLATE_VERSION = max(
+    (int(entry.stat().st_mtime) for entry in os.scandir(os.path.join(app.root_path, app.template_folder))),
+    default=0
+)
+
+def page_version_source():
+    """The read that gives this page's version, as (function, args), or None
+
+    Pages showing flash messages, and anything but GET/HEAD, get no validators.
+    """
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return None
+    if request.endpoint in SITE_PAGES:
+        return get_site_version, ()
+    if request.endpoint in POST_PAGES:
+        return get_post_version, (request.view_args['post_id'],)
+    return None
 
-        # Return URL path relative to static folder
-        return f"/static/uploads/{unique_filename}"
+def page_validators(version):
+    """Turn a (version, changed_at) pair into (etag, last_modified) for this request"""
+    number, changed_at = version
+    scope = f"post-{request.view_args['post_id']}" if request.endpoint in POST_PAGES else 'site'
+    # Logged-in pages show admin buttons, so they are a different representation
+    viewer = 'admin' if session.get('logged_in') else 'guest'
+    etag = f'{scope}-{number}-{changed_at}-{viewer}-{TEMPLATE_VERSION}'
+    return etag, datetime.fromtimestamp(changed_at, timezone.utc)
+
+@app.before_request
+def check_conditional_get():
+    """Answer 304 Not Modified if the client's copy of the page is current"""
+    if 'page_version' in g:
+        version = g.page_version   # Already read by asgi.py
+    else:
+        source = page_version_source()
+        version = source[0](*source[1]) if source else None
+    if version is None:
+        return None
+    etag, last_modified = g.page_validators = page_validators(version)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        return response
     return None
 
+@app.after_request
+def add_validators(response):
+    """Send the page's ETag and Last-Modified with full responses"""
+    validators = g.get('page_validators')
+    # A flash message raised by the view itself (e.g. for a bad page link) is for this visitor only.
+    # The template pops it while rendering, which leaves the session modified
+    if validators is None or response.status_code != 200 or session.get('_flashes') or session.modified:
+        return response
+    response.set_etag(validators[0], weak=True)
+    response.last_modified = validators[1]
+    return response
+
 # -----------------------------------------------------------------------------
-# 4. Authentication Configuration
+# 6. Page Cache
+# -----------------------------------------------------------------------------
+# Rendered public pages, shared by every request in this process (BLOG_PAGE_CACHE=1).
+# Writes drop the pages built from what they changed
+page_cache = cache.PageCache()
+add_write_listener(page_cache.invalidate)
+
+# Endpoints whose anonymous GET responses may be cached
+CACHED_ENDPOINTS = {'home', 'blog', 'blog_post', 'post_comments', 'filter_by_tag', 'about'}
+
+# Query parameters that change what those pages show (others are ignored)
+CACHED_ARGS = ('sort', 'page', 'after', 'before', 'comments')
+
+def page_cache_url():
+    """The page cache key for this request, or None if it can't be cached"""
+    if not cache.ENABLED or request.method not in ('GET', 'HEAD') or request.endpoint not in CACHED_ENDPOINTS:
+        return None
+    # Logged-in pages show admin buttons, and flash messages are for one visitor only
+    if session.get('logged_in') or session.get('_flashes'):
+        return None
+    # Encoded like the pre-rendered pages' URLs, so a value holding & or = can't pass for another page's
+    return prerender.page_url(request.path, request.args, CACHED_ARGS)
+
+def cache_depends_on(*keys):
+    """Record the database keys the page being rendered was built from
+
+    See database.add_write_listener() for the keys, e.g. 'posts' or 'post:42'.
+    """
+    g.setdefault('page_cache_keys', set()).update(keys)
+
+def card_keys(posts):
+    """Keys for a listing's post cards (each card shows its post's comment count)"""
+    return [f'post:{post.id}' for post in posts]
+
+@app.before_request
+def serve_cached_page():
+    """Answer from the page cache, or claim the page so only this request renders it"""
+    url = page_cache_url()
+    if url is None:
+        return None
+    page, ticket = page_cache.get_or_claim(url)
+    if page is not None:
+        response = app.response_class(page.body, status=page.status, headers=page.headers)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+    g.page_cache_ticket = ticket
+    return None
+
+@app.after_request
+def store_cached_page(response):
+    """Put a freshly rendered page in the cache"""
+    ticket = g.get('page_cache_ticket')
+    if ticket is None:
+        return response
+    response.headers['X-Cache'] = 'MISS'
+    # Pages that flashed a message (e.g. a bad page link) are for this visitor only
+    if response.status_code == 200 and not session.modified and not response.direct_passthrough:
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in ('set-cookie', 'x-cache')]
+        page_cache.store(ticket, cache.CachedPage(200, headers, response.get_data(), g.get('page_cache_keys', ())))
+    return response
+
+@app.teardown_request
+def release_cached_page(exception=None):
+    """Let requests waiting for this page go ahead, even if rendering failed"""
+    ticket = g.pop('page_cache_ticket', None)
+    if ticket is not None:
+        page_cache.release(ticket)
+
+# Page cache and pre-rendered page counters (hit ratio, memory used) for the admin
+@app.route('/admin/cache')
+def cache_stats():
+    if not session.get('logged_in'):
+        return redirect(url_for('login'))
+    return jsonify({**page_cache.stats(), 'prerendered': prerendered.stats()})
+
+# -----------------------------------------------------------------------------
+# 7. Pre-rendered Pages
+# -----------------------------------------------------------------------------
+# The same public pages, also written to disk (BLOG_PRERENDER=1, see
+# prerender.py). The middleware sends them before Flask routes the request;
+# writes mark the pages built from what they changed as stale, and a
+# background thread renders those again
+prerendered = prerender.PrerenderStore(CACHED_ARGS, app.config['SESSION_COOKIE_NAME'])
+add_write_listener(prerendered.invalidate)
+app.wsgi_app = prerender.PrerenderMiddleware(app.wsgi_app, prerendered)
+
+def refresh_prerendered_page(url):
+    """Render a stale page again; the middleware saves the result (runs on the refresh thread)"""
+    result = app.wsgi_app(prerender.refresh_environ(url), lambda status, headers, exc_info=None: None)
+    if hasattr(result, 'close'):
+        result.close()
+
+prerendered.render = refresh_prerendered_page
+
+@app.after_request
+def mark_prerendered_page(response):
+    """Let the middleware save this page to disk if every visitor would get the same one"""
+    if not prerender.ENABLED or request.method != 'GET' or request.endpoint not in CACHED_ENDPOINTS:
+        return response
+    if session.get('logged_in') or session.get('_flashes') or session.modified:
+        return response
+    # A page cache hit doesn't know which database keys the page was built from
+    if response.status_code == 200 and not response.direct_passthrough and response.headers.get('X-Cache') != 'HIT':
+        request.environ[prerender.SAVE] = frozenset(g.get('page_cache_keys', ()))
+    return response
+
+# -----------------------------------------------------------------------------
+# 8. Authentication Configuration
 # -----------------------------------------------------------------------------
 # Get admin credentials from environment
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME')
 ADMIN_PASSWORD_HASH = os.getenv('ADMIN_PASSWORD_HASH')  # Store hashed password in .env
 
 # -----------------------------------------------------------------------------
-# 5. Public Routes
+# 9. Public Routes
 # -----------------------------------------------------------------------------
 # Landing page route
 @app.route('/')
 def home():
     """Landing page with hero section and featured posts"""
     # Get the 3 most recent posts for featured section
-    featured_posts = get_all_posts(sort_by='date_desc', limit=3)
+    featured_posts = get_post_summaries(sort_by='date_desc', limit=FEATURED_POSTS)
+    cache_depends_on('posts')
     return render_template('home.html', featured_posts=featured_posts)
 
 # Blog listing page route
@@ -134,6 +470,9 @@ def blog():
     """Blog listing page with pagination, sorting, and filtering"""
     # Get sort parameter from query string, default to 'date_desc'
     sort_by = request.args.get('sort', 'date_desc')
+    # Unknown sorts would show the default order under yet another URL (and cache entry)
+    if sort_by not in SORT_ORDERS:
+        abort(404)
 
     # Get page parameter from query string, default to 1
     page = request.args.get('page', 1, type=int)
@@ -144,25 +483,45 @@ def blog():
         flash(error_msg, 'error')
 
     # Set posts per page
-    per_page = 6
-
-    # Calculate offset
-    offset = (page - 1) * per_page
+    per_page = POSTS_PER_PAGE
 
-    # Get paginated posts
-    posts = get_all_posts(sort_by, limit=per_page, offset=offset)
+    # Get paginated posts - by cursor if the link has one, otherwise by page number
+    posts, pagination = get_paginated_posts(sort_by, page, per_page)
 
     # Get total count for pagination
     total_posts = get_posts_count()
     total_pages = (total_posts + per_page - 1) // per_page  # Ceiling division
 
     tags = get_all_tags()
+    cache_depends_on('posts', 'tags', *card_keys(posts))
     return render_template('blog.html',
                          posts=posts,
                          tags=tags,
                          current_sort=sort_by,
                          page=page,
-                         total_pages=total_pages)
+                         total_pages=total_pages,
+                         **pagination)
+
+# Search page route
+@app.route('/search')
+def search():
+    """Full-text search over posts, best matches first"""
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    is_valid, error_msg, page = validate_pagination_params(page)
+    if not is_valid:
+        flash(error_msg, 'error')
+
+    per_page = POSTS_PER_PAGE
+    posts, has_next = [], False
+    if query:
+        is_valid, error_msg = validate_search_query(query)
+        if is_valid:
+            posts, has_next = search_posts(query, limit=per_page, offset=(page - 1) * per_page)
+        else:
+            flash(error_msg, 'error')
+
+    return render_template('search.html', posts=posts, query=query, page=page, has_next=has_next)
 
 # About page route
 @app.route('/about')
@@ -175,7 +534,7 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 # -----------------------------------------------------------------------------
-# 6. Authentication Routes
+# 10. Authentication Routes
 # -----------------------------------------------------------------------------
 
 # Individual blog post route
@@ -202,10 +561,19 @@ def blog_post(post_id):
         else:
             flash(error_msg, 'error')
 
-    # Get comments for this post
-    comments = get_comments_for_post(post_id)
+    # Get the first page of comments (or a later one for ?comments= links)
+    comments, next_cursor = get_comment_page(post_id, request.args.get('comments'))
+    cache_depends_on(f'post:{post_id}')
+
+    return render_template('post.html', post=post, comments=comments, next_cursor=next_cursor)
 
-    return render_template('post.html', post=post, comments=comments)
+# "Load more" comments route
+@app.route('/blog/<int:post_id>/comments')
+def post_comments(post_id):
+    """Render the next page of a post's comments as an HTML fragment"""
+    comments, next_cursor = get_comment_page(post_id, request.args.get('after'))
+    cache_depends_on(f'post:{post_id}')
+    return render_template('comments.html', post_id=post_id, comments=comments, next_cursor=next_cursor)
 
 # Login page route
 @app.route('/login', methods=['GET', 'POST'])
@@ -237,7 +605,7 @@ def logout():
     return redirect(url_for('home'))
 
 # -----------------------------------------------------------------------------
-# 7. Post Management Routes
+# 11. Post Management Routes
 # -----------------------------------------------------------------------------
 
 # Create new post route (GET shows form, POST saves post)
@@ -344,15 +712,6 @@ def edit_post(post_id):
                     new_image_url = save_uploaded_file(file)
                     if new_image_url:
                         image_url = new_image_url
-                        # Delete old uploaded image if it exists
-                        if old_image_url and old_image_url.startswith('/static/uploads/'):
-                            old_filename = old_image_url.split('/')[-1]
-                            old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                            if os.path.exists(old_filepath):
-                                try:
-                                    os.remove(old_filepath)
-                                except Exception as e:
-                                    print(f"Error deleting old image: {e}")
                     else:
                         flash('Invalid file type. Please upload a valid image (PNG, JPG, GIF, WebP).', 'error')
                         return render_template('edit_post.html', post=post, existing_tags=get_all_tags())
@@ -365,26 +724,8 @@ def edit_post(post_id):
                 if not is_valid_url:
                     flash(url_error_msg, 'error')
                     return render_template('edit_post.html', post=post, existing_tags=get_all_tags())
-                # Delete old uploaded image if switching to URL
-                if image_url != old_image_url and old_image_url and old_image_url.startswith('/static/uploads/'):
-                    old_filename = old_image_url.split('/')[-1]
-                    old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                    if os.path.exists(old_filepath):
-                        try:
-                            os.remove(old_filepath)
-                        except Exception as e:
-                            print(f"Error deleting old image: {e}")
             else:
                 image_url = None
-                # Delete old uploaded image if removing image
-                if old_image_url and old_image_url.startswith('/static/uploads/'):
-                    old_filename = old_image_url.split('/')[-1]
-                    old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                    if os.path.exists(old_filepath):
-                        try:
-                            os.remove(old_filepath)
-                        except Exception as e:
-                            print(f"Error deleting old image: {e}")
         # If image_option == 'keep', image_url stays as post['image_url']
 
         # Keep the original date
@@ -393,6 +734,10 @@ def edit_post(post_id):
         # Update in database
         update_post(post_id, title, date, content, excerpt, image_url, tags)
 
+        # Delete the old uploaded image if no other post uses it
+        if image_url != old_image_url:
+            delete_unused_uploads()
+
         flash('Post updated successfully!', 'success')
         return redirect(url_for('blog_post', post_id=post_id))
 
@@ -409,29 +754,17 @@ def delete_post_route(post_id):
         flash('Please log in to delete posts', 'error')
         return redirect(url_for('login'))
 
-    # Get the post to check for uploaded image
-    post = get_post_by_id(post_id)
-    if post and post['image_url']:
-        # Check if it's an uploaded file (starts with /static/uploads/)
-        if post['image_url'].startswith('/static/uploads/'):
-            # Extract filename and delete the file
-            filename = post['image_url'].split('/')[-1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception as e:
-                    # Log error but continue with post deletion
-                    print(f"Error deleting image file: {e}")
-
     # Delete the post
     delete_post(post_id)
 
+    # Then its uploaded image, unless another post uses it (linked images are left alone)
+    delete_unused_uploads()
+
     flash('Post deleted successfully!', 'success')
     return redirect(url_for('blog'))
 
 # -----------------------------------------------------------------------------
-# 8. Comment Management Routes
+# 12. Comment Management Routes
 # -----------------------------------------------------------------------------
 
 # Delete comment route
@@ -450,17 +783,26 @@ def delete_comment_route(comment_id):
     return redirect(request.referrer or url_for('home'))
 
 # -----------------------------------------------------------------------------
-# 9. Tag Filtering Routes
+# 13. Tag Filtering Routes
 # -----------------------------------------------------------------------------
 
 # Tag filter route
 @app.route('/tag/<tag_name>')
 def filter_by_tag(tag_name):
-    posts = get_posts_by_tag(tag_name)
-    return render_template('tag_filter.html', posts=posts, tag=tag_name)
+    # The posts come from the cursor; the page number is for links (and old links without a cursor)
+    page = request.args.get('page', 1, type=int)
+    is_valid, error_msg, page = validate_pagination_params(page)
+    if not is_valid:
+        flash(error_msg, 'error')
+    posts, pagination = get_paginated_posts('date_desc', page, per_page=TAG_POSTS_PER_PAGE, tag=tag_name)
+    # No such tag (or past its last page): not a page worth rendering or saving
+    if not posts:
+        abort(404)
+    cache_depends_on(f'tag:{tag_name.lower()}', *card_keys(posts))
+    return render_template('tag_filter.html', posts=posts, tag=tag_name, page=page, **pagination)
 
 # -----------------------------------------------------------------------------
-# 10. Application Entry Point
+# 14. Application Entry Point
 # -----------------------------------------------------------------------------
 # Run the application
 if __name__ == '__main__':
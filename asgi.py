@@ -0,0 +1,318 @@
+"""
+ASGI entry point for the blog
+Run with an ASGI server, e.g.: uvicorn asgi:application
+
+The public read pages (home, blog listing, single post, tag pages) are served
+by async views that await their database reads, so a slow client never ties
+up a thread. Everything else (forms, admin pages, static files) is passed to
+the normal Flask app, which runs on a small thread pool.
+
+With BLOG_PRERENDER=1 those pages are sent from their pre-rendered copies
+on disk when there is one (see prerender.py), without running a view.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import render_template, request, flash, g, abort
+from werkzeug.exceptions import HTTPException
+
+import database
+import prerender
+from app import app, prerendered, COMMENTS_PER_PAGE, POSTS_PER_PAGE, TAG_POSTS_PER_PAGE, FEATURED_POSTS, POST_PAGES, page_cache, page_cache_url, cache_depends_on, card_keys, page_version_source
+from database import encode_cursor, decode_cursor, encode_comment_cursor, decode_comment_cursor
+from validation import validate_pagination_params
+
+# Threads that run requests the async views don't handle
+WSGI_WORKERS = int(os.getenv('BLOG_WSGI_WORKERS', '8'))
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix='blog-wsgi')
+
+# -----------------------------------------------------------------------------
+# Async views
+# -----------------------------------------------------------------------------
+
+async def get_paginated_posts(sort_by, page, per_page, tag=None):
+    """Async version of app.get_paginated_posts()"""
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = after or before
+
+    position = decode_cursor(cursor, sort_by) if cursor else None
+    if cursor and position is None:
+        flash('Invalid page link', 'error')
+
+    if position is not None and after:
+        posts, has_next = await database.get_posts_page_async(sort_by, per_page, after=position, tag=tag)
+        has_prev = True
+    elif position is not None:
+        posts, has_prev = await database.get_posts_page_async(sort_by, per_page, before=position, tag=tag)
+        has_next = True
+    elif page > 1:
+        posts, has_next = await database.get_posts_page_async(sort_by, per_page, tag=tag, offset=(page - 1) * per_page)
+        has_prev = True
+    else:
+        posts, has_next = await database.get_posts_page_async(sort_by, per_page, tag=tag)
+        has_prev = False
+
+    pagination = {
+        'has_prev': has_prev and bool(posts),
+        'has_next': has_next and bool(posts),
+        'prev_cursor': encode_cursor(posts[0], sort_by) if posts else None,
+        'next_cursor': encode_cursor(posts[-1], sort_by) if posts else None,
+    }
+    return posts, pagination
+
+async def get_comment_page(post_id, cursor=None):
+    """Async version of app.get_comment_page()"""
+    position = decode_comment_cursor(cursor) if cursor else None
+    comments, has_more = await database.get_comments_page_async(post_id, COMMENTS_PER_PAGE, after=position)
+    next_cursor = encode_comment_cursor(comments[-1]) if has_more else None
+    return comments, next_cursor
+
+async def home():
+    """Landing page with hero section and featured posts"""
+    featured_posts = await database.get_post_summaries_async(sort_by='date_desc', limit=FEATURED_POSTS)
+    cache_depends_on('posts')
+    return render_template('home.html', featured_posts=featured_posts)
+
+async def blog():
+    """Blog listing page with pagination, sorting, and filtering"""
+    sort_by = request.args.get('sort', 'date_desc')
+    if sort_by not in database.SORT_ORDERS:
+        abort(404)
+    page = request.args.get('page', 1, type=int)
+    is_valid, error_msg, page = validate_pagination_params(page)
+    if not is_valid:
+        flash(error_msg, 'error')
+
+    per_page = POSTS_PER_PAGE
+
+    # The three reads don't depend on each other, so run them at the same time
+    (posts, pagination), total_posts, tags = await asyncio.gather(
+        get_paginated_posts(sort_by, page, per_page),
+        database.get_posts_count_async(),
+        database.get_all_tags_async(),
+    )
+    total_pages = (total_posts + per_page - 1) // per_page
+    cache_depends_on('posts', 'tags', *card_keys(posts))
+
+    return render_template('blog.html',
+                         posts=posts,
+                         tags=tags,
+                         current_sort=sort_by,
+                         page=page,
+                         total_pages=total_pages,
+                         **pagination)
+
+async def blog_post(post_id):
+    """Display individual blog post with comments (comment POSTs go to app.py)"""
+    post, (comments, next_cursor) = await asyncio.gather(
+        database.get_post_by_id_async(post_id),
+        get_comment_page(post_id, request.args.get('comments')),
+    )
+    if post is None:
+        return "Post not found!", 404
+    cache_depends_on(f'post:{post_id}')
+    return render_template('post.html', post=post, comments=comments, next_cursor=next_cursor)
+
+async def post_comments(post_id):
+    """Render the next page of a post's comments as an HTML fragment"""
+    comments, next_cursor = await get_comment_page(post_id, request.args.get('after'))
+    cache_depends_on(f'post:{post_id}')
+    return render_template('comments.html', post_id=post_id, comments=comments, next_cursor=next_cursor)
+
+async def filter_by_tag(tag_name):
+    page = request.args.get('page', 1, type=int)
+    is_valid, error_msg, page = validate_pagination_params(page)
+    if not is_valid:
+        flash(error_msg, 'error')
+    posts, pagination = await get_paginated_posts('date_desc', page, per_page=TAG_POSTS_PER_PAGE, tag=tag_name)
+    if not posts:
+        abort(404)
+    cache_depends_on(f'tag:{tag_name.lower()}', *card_keys(posts))
+    return render_template('tag_filter.html', posts=posts, tag=tag_name, page=page, **pagination)
+
+# Flask endpoint name -> async view for GET and HEAD requests
+ASYNC_VIEWS = {
+    'home': home,
+    'blog': blog,
+    'blog_post': blog_post,
+    'post_comments': post_comments,
+    'filter_by_tag': filter_by_tag,
+}
+
+# -----------------------------------------------------------------------------
+# ASGI <-> Flask glue
+# -----------------------------------------------------------------------------
+
+def _environ(scope, body):
+    """Build a WSGI environ for Flask from an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        # WSGI paths are bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        # The body has already been read in full (and de-chunked)
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name == 'CONTENT_TYPE':
+            key = name
+        else:
+            key = f'HTTP_{name}'
+        # Repeated headers are joined with commas, as a WSGI server would
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def _read_body(receive):
+    """Read the whole request body"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+    return body
+
+async def _send_response(send, status, headers, chunks):
+    """Send a status, headers and body chunks to the client"""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    for chunk in chunks:
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def _run_async_view(environ, view):
+    """Dispatch a request to an async view the way Flask would for a sync one
+
+    Returns:
+        Response: The finished response (session saved, after_request run)
+    """
+    with app.request_context(environ):
+        # Read the page's version here so the conditional GET check doesn't
+        # query the database on the event loop
+        if page_version_source() is not None:
+            if request.endpoint in POST_PAGES:
+                g.page_version = await database.get_post_version_async(request.view_args['post_id'])
+            else:
+                g.page_version = await database.get_site_version_async()
+        # If another request is rendering this page, wait for it here rather
+        # than in the page cache's before_request hook, which would block the
+        # loop. Nothing awaits between this check and that hook's lookup
+        url = page_cache_url()
+        while url is not None and page_cache.rendering(url):
+            await asyncio.get_running_loop().run_in_executor(None, page_cache.wait, url)
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**request.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return app.finalize_request(rv)
+        except Exception as e:
+            return app.handle_exception(e)
+
+def _run_wsgi(environ):
+    """Run the Flask WSGI app (on a worker thread) and collect its response"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = app(environ, start_response)
+    try:
+        chunks = list(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], chunks
+
+def _read_file(f):
+    """Read and close a pre-rendered page (on a worker thread)"""
+    with f:
+        return f.read()
+
+def _async_view_for(environ):
+    """Find the async view for a request, or None if app.py should handle it"""
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return None
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        # 404s, redirects etc. are left to Flask
+        return None
+    return ASYNC_VIEWS.get(endpoint)
+
+async def _lifespan(receive, send):
+    """Handle server startup and shutdown"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            database.reset_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = await _read_body(receive)
+    environ = _environ(scope, body)
+    view = _async_view_for(environ)
+
+    if view is not None:
+        loop = asyncio.get_running_loop()
+        # Other requests reach the pre-rendered pages through app.wsgi_app
+        found = prerendered.find(environ)
+        saved = prerendered.response(environ, *found) if found is not None else None
+        if saved is not None:
+            status, headers, f = saved
+            chunks = [] if f is None else [await loop.run_in_executor(None, _read_file, f)]
+            await _send_response(send, status, headers, chunks)
+            return
+
+        response = await _run_async_view(environ, view)
+        chunks = [] if scope['method'] == 'HEAD' else response.iter_encoded()
+        if prerender.SAVE in environ:
+            chunks = [b''.join(chunks)]
+            await loop.run_in_executor(None, prerendered.save, environ, response.status_code,
+                                       list(response.headers.items()), chunks[0])
+        await _send_response(send, response.status_code, response.headers.items(), chunks)
+    else:
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(_wsgi_executor, _run_wsgi, environ)
+        await _send_response(send, status, headers, chunks)
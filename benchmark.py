@@ -0,0 +1,505 @@
+"""
+Performance benchmarks for the blog database layer
+Run with: python benchmark.py <name> (see BENCHMARKS at the bottom)
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from flask import Flask
+
+import database
+
+# Stand-in app so benchmark threads get the same per-request connection handling
+bench_app = Flask(__name__)
+database.init_app(bench_app)
+
+def _fresh_database(mode='default'):
+    """Point the database module at a new, empty database file"""
+    database.reset_pool()
+    database.STORAGE_MODE = mode
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    return database.DATABASE
+
+def _seed_posts(count, content_size=2000):
+    """Insert count posts with content_size characters of body text"""
+    content = ('Lorem ipsum dolor sit amet. ' * (content_size // 28 + 1))[:content_size]
+    for i in range(count):
+        database.create_post(f'Post {i}', content, f'Excerpt for post {i}', None, 'python, flask')
+
+def _run_threads(workers, seconds, operation):
+    """Call operation(worker, i) from several threads for a while, return ops/sec"""
+    stop = time.perf_counter() + seconds
+    counts = [0] * workers
+
+    def work(worker):
+        i = 0
+        while time.perf_counter() < stop:
+            with bench_app.app_context():
+                operation(worker, i)
+            i += 1
+        counts[worker] = i
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds
+
+def bench_mixed_load(seconds=2.0):
+    """Mixed read/write load (1 comment per 10 operations) in both storage modes"""
+    for mode in ('default', 'wal'):
+        _fresh_database(mode)
+        _seed_posts(200)
+
+        def operation(worker, i):
+            post_id = (worker * 31 + i) % 200 + 1
+            if i % 10 == 0:
+                database.create_comment(post_id, 'Bench', 'A comment', '2025-01-01 12:00')
+            else:
+                database.get_all_posts(limit=6)
+                database.get_post_by_id(post_id)
+                database.get_comments_for_post(post_id)
+
+        for workers in (1, 2, 4, 8):
+            try:
+                rate = _run_threads(workers, seconds, operation)
+                print(f'{mode:8} workers={workers}: {rate:8.0f} ops/sec')
+            except Exception as e:
+                print(f'{mode:8} workers={workers}: failed ({e})')
+        database.reset_pool()
+
+def bench_search(posts=50000, queries=200):
+    """Full-text search latency over a large corpus"""
+    import random
+
+    _fresh_database()
+    rng = random.Random(1)
+    # Zipf-like vocabulary so word frequencies look like real text
+    vocabulary = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 9))) for _ in range(20000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    def text(k):
+        return ' '.join(rng.choices(vocabulary, weights, k=k))
+
+    conn = database._connect(database.DATABASE)
+    start = time.perf_counter()
+    conn.executemany(
+        'INSERT INTO posts (title, date, content, excerpt, tags) VALUES (?, ?, ?, ?, ?)',
+        (
+            (text(4).title(), '2025-01-01', text(600), text(20), ', '.join(rng.sample(vocabulary[:200], 3)))
+            for _ in range(posts)
+        )
+    )
+    conn.commit()
+    conn.close()
+    print(f'indexed {posts} posts in {time.perf_counter() - start:.1f}s')
+
+    timings = []
+    for _ in range(queries):
+        # Two words of middling frequency, as a reader might type
+        query = ' '.join(rng.sample(vocabulary[100:3000], 2))
+        start = time.perf_counter()
+        database.search_posts(query, limit=6)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f'search: median {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms')
+
+def bench_listing(posts=2000, pages=200):
+    """Listing page cost: full rows (SELECT *) vs post summaries"""
+    import tracemalloc
+
+    _fresh_database()
+    _seed_posts(posts, content_size=50000)
+
+    for name, fetch in (
+        ('SELECT *', lambda offset: database.get_all_posts(limit=6, offset=offset)),
+        ('summaries', lambda offset: database.get_post_summaries(limit=6, offset=offset)),
+    ):
+        start = time.perf_counter()
+        for page in range(pages):
+            fetch(page % 50 * 6)
+        elapsed = (time.perf_counter() - start) / pages * 1000
+
+        tracemalloc.start()
+        fetch(0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:10} {elapsed:6.2f} ms/page, peak {peak / 1024:7.1f} KB per page')
+
+def bench_comments(seconds=2.0, workers=32):
+    """Comment submissions per second, one commit each vs group-committed batches"""
+    for mode in ('default', 'wal'):
+        for batching in (False, True):
+            _fresh_database(mode)
+            _seed_posts(20, content_size=200)
+            database.COMMENT_BATCHING = batching
+
+            def operation(worker, i):
+                database.create_comment(i % 20 + 1, f'User {worker}', 'A comment', '2025-01-01 12:00')
+
+            try:
+                rate = _run_threads(workers, seconds, operation)
+                label = 'batched' if batching else 'per-row'
+                print(f'{mode:8} {label:8} workers={workers}: {rate:8.0f} comments/sec')
+            except Exception as e:
+                print(f'{mode:8} workers={workers}: failed ({e})')
+            database.reset_pool()
+    database.COMMENT_BATCHING = False
+
+def bench_snapshot(posts=2000, reads=20000):
+    """Read latency from blog.db vs the in-memory read snapshot"""
+    _fresh_database()
+    _seed_posts(posts, content_size=5000)
+
+    for snapshot in (False, True):
+        database.READ_SNAPSHOT = snapshot
+        start = time.perf_counter()
+        with bench_app.app_context():
+            for i in range(reads):
+                database.get_post_by_id(i % posts + 1)
+                database.get_post_summaries(limit=6, offset=i % 50 * 6)
+        elapsed = (time.perf_counter() - start) / reads * 1e6
+        print(f"{'snapshot' if snapshot else 'disk':8} {elapsed:7.1f} us per post + listing read")
+
+    stats = database.get_snapshot().stats()
+    print(f"snapshot: {stats['memory_bytes'] / 1024 / 1024:.1f} MB, "
+          f"loaded in {stats['last_refresh_seconds'] * 1000:.0f} ms")
+    database.READ_SNAPSHOT = False
+    database.reset_pool()
+
+def bench_compression(posts=3000, reads=20000):
+    """Database size and read latency with and without compressed post bodies"""
+    import random
+    import compression
+
+    # Random words compress like real prose, unlike one repeated sentence
+    rng = random.Random(1)
+    words = [''.join(rng.choice('etaoinshrdlucmfw') for _ in range(rng.randint(2, 9))) for _ in range(3000)]
+    bodies = [' '.join(rng.choices(words, k=1000)) for _ in range(50)]
+
+    min_size = compression.MIN_SIZE
+    for compressed in (False, True):
+        compression.MIN_SIZE = min_size if compressed else float('inf')
+        path = _fresh_database()
+        for i in range(posts):
+            database.create_post(f'Post {i}', bodies[i % len(bodies)], f'Excerpt {i}', None, 'python')
+        conn = database.get_db_connection()
+        conn.execute('VACUUM')
+        conn.close()
+        size = os.path.getsize(path) / 1024 / 1024
+
+        with bench_app.app_context():
+            start = time.perf_counter()
+            for i in range(reads):
+                database.get_post_by_id(i % posts + 1)
+            post_us = (time.perf_counter() - start) / reads * 1e6
+            start = time.perf_counter()
+            for i in range(reads):
+                database.get_post_summaries(limit=6, offset=i % 50 * 6)
+            listing_us = (time.perf_counter() - start) / reads * 1e6
+        print(f"{'zlib' if compressed else 'plain':6} {size:6.1f} MB  "
+              f"{post_us:6.1f} us per post read  {listing_us:6.1f} us per listing")
+    compression.MIN_SIZE = min_size
+    database.reset_pool()
+
+def bench_page_cache(posts=200, requests=5000):
+    """Requests/sec for public pages with and without the page cache"""
+    import cache
+    from app import app, page_cache
+
+    _fresh_database()
+    _seed_posts(posts)
+    urls = ['/', '/blog', '/blog?sort=title_asc', '/tag/python'] + [f'/blog/{i}' for i in range(1, 51)]
+
+    for enabled in (False, True):
+        cache.ENABLED = enabled
+        page_cache.clear()
+        with app.test_client() as client:
+            start = time.perf_counter()
+            for i in range(requests):
+                client.get(urls[i % len(urls)])
+                if i % 500 == 0:
+                    # A comment now and then, like a live site
+                    database.create_comment(i % 50 + 1, 'Reader', 'Nice post', '2024-12-15 10:00')
+            elapsed = time.perf_counter() - start
+        print(f"{'cached' if enabled else 'uncached':8} {requests / elapsed:7.0f} requests/sec")
+
+    stats = page_cache.stats()
+    print(f"hit ratio {stats['hit_ratio']:.1%}, {stats['pages']} pages in {stats['bytes'] / 1024:.0f} KB, "
+          f"{stats['invalidations']} invalidated")
+    cache.ENABLED = False
+    database.reset_pool()
+
+def bench_conditional(posts=200, requests=3000):
+    """Requests/sec for full post page responses vs 304 revalidations"""
+    from app import app
+
+    _fresh_database()
+    _seed_posts(posts)
+    with app.test_client() as client:
+        etags = {}
+        for revalidate in (False, True):
+            start = time.perf_counter()
+            for i in range(requests):
+                url = f'/blog/{i % 50 + 1}'
+                headers = {'If-None-Match': etags[url]} if revalidate else {}
+                response = client.get(url, headers=headers)
+                etags[url] = response.headers['ETag']
+            elapsed = time.perf_counter() - start
+            print(f"{'304' if revalidate else '200':4} {requests / elapsed:7.0f} requests/sec")
+    database.reset_pool()
+
+def bench_object_cache(posts=2000, reads=20000):
+    """Read latency for posts, missing ids and the tag list with and without the object cache"""
+    _fresh_database()
+    _seed_posts(posts)
+
+    for enabled in (False, True):
+        database.OBJECT_CACHE = enabled
+        database._object_cache.clear()
+        with bench_app.app_context():
+            timings = []
+            for read in (lambda i: database.get_post_by_id(i % 200 + 1),
+                         lambda i: database.get_post_by_id(posts + 1 + i % 200),
+                         lambda i: database.get_all_tags()):
+                start = time.perf_counter()
+                for i in range(reads):
+                    read(i)
+                timings.append((time.perf_counter() - start) / reads * 1e6)
+        print(f"{'cached' if enabled else 'uncached':8} {timings[0]:6.1f} us per post  "
+              f"{timings[1]:6.1f} us per missing id  {timings[2]:6.1f} us per tag list")
+    database.OBJECT_CACHE = False
+    database.reset_pool()
+
+def bench_cards(posts=500, requests=2000):
+    """Requests/sec for listing pages with post cards rendered each time vs cached"""
+    from app import app, card_cache
+
+    _fresh_database()
+    _seed_posts(posts)
+    urls = [f'/blog?sort={sort}&page={page}' for sort in database.SORT_ORDERS for page in range(1, 11)]
+
+    max_size = card_cache.max_size
+    with app.test_client() as client:
+        for cached in (False, True):
+            card_cache.max_size = max_size if cached else 0
+            card_cache.clear()
+            before = card_cache.stats()
+            start = time.perf_counter()
+            for i in range(requests):
+                client.get(urls[i % len(urls)])
+            elapsed = time.perf_counter() - start
+            hits = card_cache.stats()['hits'] - before['hits']
+            print(f"{'cached' if cached else 'uncached':8} {requests / elapsed:7.0f} requests/sec, "
+                  f"{hits} cards reused")
+    card_cache.max_size = max_size
+    database.reset_pool()
+
+def bench_rendering(posts=200, requests=3000):
+    """Requests/sec for post pages with HTML rendered on save vs on every view"""
+    from app import app
+
+    _fresh_database()
+    section = '## Section\nSome **bold** text with a [link](https://example.com).\n\n- one\n- two\n\n'
+    for i in range(posts):
+        database.create_post(f'Post {i}', '# Intro\n' + section * 40, 'Excerpt', None, 'python, flask')
+
+    with app.test_client() as client:
+        for stored in (True, False):
+            if not stored:
+                # As if the rendered columns didn't exist: every view renders the post
+                database._run_write(lambda conn: conn.execute('UPDATE posts SET content_html = NULL'))
+            start = time.perf_counter()
+            for i in range(requests):
+                client.get(f'/blog/{i % posts + 1}')
+            elapsed = time.perf_counter() - start
+            print(f"{'on save' if stored else 'on view':8} {requests / elapsed:7.0f} requests/sec")
+    database.reset_pool()
+
+def bench_freeze(posts=50000):
+    """Static export time: full build, rebuild after one edit, and rebuild with no changes"""
+    import json
+    import bulk_io
+    import freeze
+
+    _fresh_database()
+    source = os.path.join(tempfile.mkdtemp(), 'posts.jsonl')
+    with open(source, 'w', encoding='utf-8') as f:
+        for i in range(posts):
+            f.write(json.dumps({'title': f'Post {i}', 'content': f'# Post {i}\n' + 'Lorem ipsum dolor sit amet. ' * 70,
+                                'excerpt': f'Excerpt for post {i}', 'tags': f'python, tag{i % 50}',
+                                'created_at': f'2024-01-01 00:00:{i % 60:02d}'}) + '\n')
+    bulk_io.import_posts(source)
+    output = os.path.join(tempfile.mkdtemp(), 'site')
+
+    for label, change in (('full build', None),
+                          ('one post edited', lambda: database.update_post(
+                              posts // 2, f'Post {posts // 2 - 1}', '2024-01-01', 'New text',
+                              'Edited excerpt', None, f'python, tag{(posts // 2 - 1) % 50}')),
+                          ('no changes', None)):
+        if change:
+            change()
+        stats = freeze.freeze(output)
+        print(f"{label:16} {stats['seconds']:7.2f}s  {stats['rendered']:6} pages rendered, "
+              f"{stats['unchanged']} unchanged")
+    database.reset_pool()
+
+def bench_prerender(posts=200, requests=5000):
+    """Requests/sec for public pages rendered by Flask, from the page cache and from disk"""
+    import tempfile
+    import cache
+    import prerender
+    from app import app, page_cache, prerendered
+
+    _fresh_database()
+    _seed_posts(posts)
+    urls = ['/', '/blog', '/blog?sort=title_asc', '/tag/python'] + [f'/blog/{i}' for i in range(1, 51)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        prerendered.directory = directory
+        for mode in ('flask', 'page cache', 'prerendered'):
+            cache.ENABLED = mode == 'page cache'
+            prerender.ENABLED = mode == 'prerendered'
+            page_cache.clear()
+            with app.test_client(use_cookies=False) as client:
+                start = time.perf_counter()
+                for i in range(requests):
+                    client.get(urls[i % len(urls)])
+                    if i % 500 == 0:
+                        # A comment now and then, like a live site
+                        database.create_comment(i % 50 + 1, 'Reader', 'Nice post', '2024-12-15 10:00')
+                elapsed = time.perf_counter() - start
+            print(f"{mode:12} {requests / elapsed:7.0f} requests/sec")
+        prerendered.wait_idle()
+        stats = prerendered.stats()
+        print(f"{stats['hits']} hits, {stats['stale_hits']} stale hits, {stats['refreshes']} pages refreshed")
+        prerendered.clear()
+
+    cache.ENABLED = False
+    prerender.ENABLED = False
+    database.reset_pool()
+
+def bench_images(size=(2400, 1600)):
+    """Bytes a listing card loads: the original upload vs its 320 px WebP copy, and time to resize"""
+    import images
+    if not images.available():
+        print('Pillow is not installed (pip install Pillow)')
+        return
+    from PIL import Image
+
+    _fresh_database()
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'photo.png')
+    # A photo-like image: smooth gradients with noise, which PNG compresses badly
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    Image.merge('RGB', (gradient, noise, gradient.transpose(Image.ROTATE_180))).save(path)
+
+    start = time.perf_counter()
+    variants = images.process_upload(path, '/static/uploads/photo.png')
+    elapsed = time.perf_counter() - start
+    thumbnail = os.path.getsize(os.path.join(folder, 'photo-320.webp'))
+    print(f"original   {os.path.getsize(path) / 1024:8.0f} KB")
+    print(f"320px webp {thumbnail / 1024:8.0f} KB")
+    print(f"{len(variants)} copies written in {elapsed * 1000:.0f} ms (off the request thread)")
+    database.reset_pool()
+
+def bench_uploads(size=5 * 1024 * 1024, uploads=20):
+    """Time to save a 5 MB upload (streamed and hashed) and disk used by repeated uploads"""
+    import io
+    import images
+    from werkzeug.datastructures import FileStorage
+    from app import app, save_uploaded_file
+
+    _fresh_database()
+    folder = tempfile.mkdtemp()
+    app.config['UPLOAD_FOLDER'] = folder
+    data = os.urandom(size)
+    # Random bytes aren't an image, so don't try to resize them
+    pillow, images.Image = images.Image, None
+
+    start = time.perf_counter()
+    with app.test_request_context():
+        for _ in range(uploads):
+            save_uploaded_file(FileStorage(io.BytesIO(data), 'photo.gif'))
+    elapsed = time.perf_counter() - start
+    images.Image = pillow
+    stored = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    print(f"{elapsed / uploads * 1000:6.1f} ms per {size // (1024 * 1024)} MB upload (hash computed while writing)")
+    print(f"{uploads} uploads of the same image: {stored / (1024 * 1024):.0f} MB on disk "
+          f"(was {uploads * size / (1024 * 1024):.0f} MB with one copy each)")
+    database.reset_pool()
+
+def bench_rows(rows=10000):
+    """Time and memory per 10k rows: sqlite3.Row vs the slotted records"""
+    import sqlite3
+    import tracemalloc
+
+    _fresh_database()
+    conn = database._connect(database.DATABASE)
+    conn.executemany(
+        'INSERT INTO posts (title, date, content, excerpt, tags) VALUES (?, ?, ?, ?, ?)',
+        ((f'Post {i}', '2025-01-01', f'Content {i}', f'Excerpt {i}', 'python') for i in range(rows))
+    )
+    conn.commit()
+    query = f'SELECT {database.POST_COLUMNS} FROM posts {database.SUMMARY_JOIN}'
+
+    for name, factory in (('sqlite3.Row', sqlite3.Row), ('Post', database.Post.row_factory)):
+        cursor = conn.cursor()
+        cursor.row_factory = factory
+        start = time.perf_counter()
+        for _ in range(5):
+            result = cursor.execute(query).fetchall()
+        fetch_ms = (time.perf_counter() - start) / 5 * 1000
+
+        # Read a few fields from every row, as a template (post.title) and
+        # as app.py (post['title']) do
+        start = time.perf_counter()
+        for post in result:
+            for field in ('title', 'excerpt', 'image_url', 'created_at'):
+                bench_app.jinja_env.getattr(post, field)
+        template_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for post in result:
+            post['title'], post['excerpt'], post['image_url'], post['created_at']
+        subscript_ms = (time.perf_counter() - start) * 1000
+
+        del result
+        tracemalloc.start()
+        result = cursor.execute(query).fetchall()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del result
+        print(f'{name:12} fetch {fetch_ms:6.1f} ms, post.field {template_ms:5.1f} ms, '
+              f"post['field'] {subscript_ms:5.1f} ms, "
+              f'{size / 1024 / 1024:5.2f} MB per {rows} rows')
+    conn.close()
+
+BENCHMARKS = {
+    'mixed_load': bench_mixed_load,
+    'search': bench_search,
+    'listing': bench_listing,
+    'comments': bench_comments,
+    'snapshot': bench_snapshot,
+    'rows': bench_rows,
+    'compression': bench_compression,
+    'page_cache': bench_page_cache,
+    'conditional': bench_conditional,
+    'object_cache': bench_object_cache,
+    'cards': bench_cards,
+    'rendering': bench_rendering,
+    'freeze': bench_freeze,
+    'prerender': bench_prerender,
+    'images': bench_images,
+    'uploads': bench_uploads,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'== {name}')
+        BENCHMARKS[name]()
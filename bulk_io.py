@@ -0,0 +1,318 @@
+"""
+Bulk import and export of posts (with their comments)
+Used by: python -m database import|export PATH
+
+Two formats are supported:
+  jsonl    - one JSON object per line (a file, or '-' for stdin/stdout)
+  markdown - a directory of .md files, one per post, each starting with
+             a front matter block of "key: value" lines between --- markers
+
+Both directions stream: only one chunk of posts is held in memory at a time,
+so a 40,000 post archive takes no more memory than a 40 post one.
+"""
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import compression
+import database
+import rendering
+from validation import validate_post_data, sanitize_tags
+
+# Posts per executemany batch / write transaction
+CHUNK_SIZE = 2000
+
+# Post fields in the order they are written out
+POST_FIELDS = ('title', 'date', 'excerpt', 'tags', 'image_url', 'created_at', 'updated_at')
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+
+def _guess_format(path):
+    """Pick a format from the path: directories and .md files are markdown"""
+    if path != '-' and (os.path.isdir(path) or path.endswith('.md')):
+        return 'markdown'
+    return 'jsonl'
+
+def _read_jsonl(path):
+    """Yield (where, record) for each line of a JSONL file"""
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield f'line {line_number}', json.loads(line)
+            except json.JSONDecodeError as e:
+                yield f'line {line_number}', ValueError(f'Invalid JSON: {e}')
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def parse_markdown(text):
+    """Split a Markdown document into a post record (front matter + content)
+
+    Front matter values may be JSON (as written by export) or plain text,
+    e.g. "title: My First Post" or "tags: python, flask".
+    """
+    match = re.match(r'---\n(.*?)\n---\n?(.*)', text, re.DOTALL)
+    if match is None:
+        raise ValueError('Missing front matter')
+    front_matter, content = match.groups()
+
+    record = {}
+    for line in front_matter.splitlines():
+        if not line.strip():
+            continue
+        key, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError(f'Invalid front matter line: {line}')
+        value = value.strip()
+        try:
+            record[key.strip()] = json.loads(value)
+        except json.JSONDecodeError:
+            record[key.strip()] = value
+    record['content'] = content.strip('\n')
+    return record
+
+def _read_markdown(path):
+    """Yield (where, record) for a .md file or every .md file in a directory"""
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.endswith('.md'))
+        files = [os.path.join(path, name) for name in names]
+    else:
+        files = [path]
+    for filename in files:
+        with open(filename, 'r', encoding='utf-8') as f:
+            text = f.read()
+        try:
+            yield filename, parse_markdown(text)
+        except ValueError as e:
+            yield filename, e
+
+# Record fields that must be text when present (tags may also be a list of text)
+TEXT_FIELDS = ('title', 'content', 'excerpt', 'date', 'image_url', 'created_at', 'updated_at')
+COMMENT_FIELDS = ('author', 'comment_text', 'date')
+
+def _wrong_type(record, fields):
+    """The first of fields holding something other than text, or None"""
+    for field in fields:
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            return field
+    return None
+
+def _clean(record, now):
+    """Validate a record and turn it into a (post row, comment rows) pair
+
+    Returns:
+        tuple: (post, comments, error) - error is None when the record is valid
+    """
+    if not isinstance(record, dict):
+        return None, None, 'Expected a JSON object'
+
+    # Checked up front, so a number where text belongs skips the record instead of stopping the import
+    field = _wrong_type(record, TEXT_FIELDS)
+    if field is not None:
+        return None, None, f'{field} must be a string'
+    tags = record.get('tags')
+    if not (tags is None or isinstance(tags, str)
+            or isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)):
+        return None, None, 'tags must be a string or a list of strings'
+    comments = record.get('comments')
+    if comments is not None and not isinstance(comments, list):
+        return None, None, 'comments must be a list'
+    for comment in comments or []:
+        if not isinstance(comment, dict):
+            return None, None, 'Each comment must be a JSON object'
+        field = _wrong_type(comment, COMMENT_FIELDS)
+        if field is not None:
+            return None, None, f'Comment {field} must be a string'
+
+    title = record.get('title') or ''
+    content = record.get('content') or ''
+    excerpt = record.get('excerpt') or ''
+    tags = record.get('tags') or ''
+    if isinstance(tags, list):
+        tags = ', '.join(tags)
+    tags = sanitize_tags(tags)
+
+    is_valid, error = validate_post_data(title, content, excerpt, tags)
+    if not is_valid:
+        return None, None, error
+
+    created_at = record.get('created_at') or now
+    post = (
+        title,
+        record.get('date') or created_at[:10],
+        compression.compress(content),
+        excerpt,
+        record.get('image_url') or None,
+        tags,
+        created_at,
+        record.get('updated_at') or created_at,
+    ) + rendering.render_post(content) + (rendering.norwegian_datetime(created_at),)
+
+    comments = []
+    for comment in record.get('comments') or []:
+        if not comment.get('comment_text') or not comment.get('date'):
+            return None, None, 'Comments need comment_text and date'
+        comments.append((comment.get('author') or 'Anonymous', comment['comment_text'], comment['date']))
+    return post, comments, None
+
+# -----------------------------------------------------------------------------
+# Import
+# -----------------------------------------------------------------------------
+
+def _insert_chunk(conn, chunk):
+    """Insert a chunk of (post, comments) pairs with executemany
+
+    Returns:
+        int: Number of comments inserted
+    """
+    conn.executemany('''
+        INSERT INTO posts (title, date, content, excerpt, image_url, tags, created_at, updated_at,
+                           content_html, toc_html, reading_time, created_display)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [post for post, _ in chunk])
+    # AUTOINCREMENT ids within one transaction are consecutive
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    first_id = last_id - len(chunk) + 1
+
+    links = []
+    comments = []
+    for post_id, (post, post_comments) in enumerate(chunk, first_id):
+        for name in database._split_tags(post[5]):
+            links.append((post_id, post[6], name))
+        comments.extend((post_id,) + comment for comment in post_comments)
+
+    conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', {(name,) for _, _, name in links})
+    conn.executemany('''
+        INSERT OR IGNORE INTO post_tags (tag_id, post_id, created_at)
+        SELECT id, ?, ? FROM tags WHERE name = ?
+    ''', links)
+    conn.executemany(database.COMMENT_INSERT_QUERY, comments)
+    return len(comments)
+
+def import_posts(path, fmt=None, chunk_size=CHUNK_SIZE, errors=sys.stderr):
+    """Import posts (and their comments) from a JSONL file or Markdown files
+
+    Invalid records are reported to errors and skipped; the rest are
+    inserted chunk_size posts per transaction.
+
+    Returns:
+        dict: posts, comments and skipped counts, and seconds taken
+    """
+    fmt = fmt or _guess_format(path)
+    records = _read_markdown(path) if fmt == 'markdown' else _read_jsonl(path)
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    stats = {'posts': 0, 'comments': 0, 'skipped': 0}
+    start = time.perf_counter()
+
+    chunk = []
+    for where, record in records:
+        if isinstance(record, Exception):
+            post, comments, error = None, None, str(record)
+        else:
+            post, comments, error = _clean(record, now)
+        if error:
+            print(f'{where}: {error}', file=errors)
+            stats['skipped'] += 1
+            continue
+
+        chunk.append((post, comments))
+        if len(chunk) >= chunk_size:
+            stats['comments'] += database._run_write(lambda conn: _insert_chunk(conn, chunk))
+            stats['posts'] += len(chunk)
+            chunk = []
+
+    if chunk:
+        stats['comments'] += database._run_write(lambda conn: _insert_chunk(conn, chunk))
+        stats['posts'] += len(chunk)
+
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+
+def _iter_posts(conn):
+    """Yield (post, comments) for every post, reading both tables in one pass
+
+    Posts and comments are walked side by side in post_id order, so nothing
+    but the current post's comments is ever held in memory.
+    """
+    posts = conn.cursor()
+    posts.row_factory = database.Post.row_factory
+    posts.execute(f'SELECT {database.POST_COLUMNS} FROM posts {database.SUMMARY_JOIN} ORDER BY posts.id')
+    comments = conn.cursor()
+    comments.row_factory = database.Comment.row_factory
+    comments.execute(f'SELECT {database.COMMENT_COLUMNS} FROM comments ORDER BY post_id, id')
+    comment = comments.fetchone()
+    for post in posts:
+        # Skip comments left behind by deleted posts
+        while comment is not None and comment['post_id'] < post['id']:
+            comment = comments.fetchone()
+        post_comments = []
+        while comment is not None and comment['post_id'] == post['id']:
+            post_comments.append({
+                'author': comment['author'],
+                'comment_text': comment['comment_text'],
+                'date': comment['date'],
+            })
+            comment = comments.fetchone()
+        yield post, post_comments
+
+def _record(post, comments):
+    """Turn a post row and its comments into an export record"""
+    record = {field: post[field] for field in POST_FIELDS}
+    record['content'] = compression.decompress(post['content'])
+    record['comments'] = comments
+    return record
+
+def format_markdown(record):
+    """Write a post record as Markdown with a front matter block"""
+    lines = ['---']
+    for field in POST_FIELDS + ('comments',):
+        lines.append(f'{field}: {json.dumps(record[field], ensure_ascii=False)}')
+    lines.append('---')
+    return '\n'.join(lines) + '\n\n' + record['content'] + '\n'
+
+def _markdown_filename(post):
+    """File name for an exported post, e.g. 00042-my-first-post.md"""
+    slug = re.sub(r'[^a-z0-9]+', '-', post['title'].lower()).strip('-')[:50] or 'post'
+    return f"{post['id']:05d}-{slug}.md"
+
+def export_posts(path, fmt=None):
+    """Export every post (with its comments) to a JSONL file or a Markdown directory
+
+    Returns:
+        int: Number of posts written
+    """
+    fmt = fmt or _guess_format(path)
+    conn = database.get_db_connection()
+    count = 0
+    try:
+        if fmt == 'markdown':
+            os.makedirs(path, exist_ok=True)
+            for post, comments in _iter_posts(conn):
+                with open(os.path.join(path, _markdown_filename(post)), 'w', encoding='utf-8') as f:
+                    f.write(format_markdown(_record(post, comments)))
+                count += 1
+        else:
+            f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+            try:
+                for post, comments in _iter_posts(conn):
+                    f.write(json.dumps(_record(post, comments), ensure_ascii=False) + '\n')
+                    count += 1
+            finally:
+                if f is not sys.stdout:
+                    f.close()
+    finally:
+        database.release_db_connection(conn)
+    return count
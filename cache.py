@@ -0,0 +1,252 @@
+"""
+In-process caches for rendered HTML
+Used by app.py: PageCache (see "Page Cache" there) and FragmentCache (post_card())
+
+PageCache - whole pages for anonymous GET requests
+
+Each cached page remembers the database keys it was built from (see
+database.add_write_listener()), e.g. 'posts' or 'post:42'. A write drops
+exactly the pages that used one of the keys it changed; everything else
+stays cached. The cache holds at most max_bytes of pages and drops the
+least recently used ones first.
+
+Only one thread renders a missing page at a time: the others wait for it
+and are served its result, so a burst of requests for a popular post
+renders it once.
+
+Turn it on with BLOG_PAGE_CACHE=1.
+
+FragmentCache - pieces of pages, such as the post cards in listings. A
+fragment's key holds everything it is rendered from, so it never goes stale
+and nothing has to drop it; outdated versions are evicted as they age.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+ENABLED = os.getenv('BLOG_PAGE_CACHE', '0') == '1'
+
+# Largest total size of the cached pages
+MAX_BYTES = int(float(os.getenv('BLOG_PAGE_CACHE_MB', '32')) * 1024 * 1024)
+
+# Longest time to wait for another thread to render a page before rendering it too
+RENDER_WAIT = 5.0
+
+# Rough per-entry bookkeeping cost, added to the size of each page
+ENTRY_OVERHEAD = 200
+
+# Most fragments FragmentCache keeps
+FRAGMENT_CACHE_SIZE = int(os.getenv('BLOG_FRAGMENT_CACHE_SIZE', '2000'))
+
+
+class CachedPage:
+    """A rendered response: status, headers and body"""
+
+    __slots__ = ('status', 'headers', 'body', 'keys', 'size')
+
+    def __init__(self, status, headers, body, keys):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.keys = frozenset(keys)
+        self.size = len(body) + sum(len(name) + len(value) for name, value in headers) + ENTRY_OVERHEAD
+
+
+class Ticket:
+    """A claim to render one missing page, from PageCache.get_or_claim()"""
+
+    __slots__ = ('url', 'started', 'leader')
+
+    def __init__(self, url, started, leader):
+        self.url = url
+        self.started = started   # PageCache clock when rendering started
+        self.leader = leader     # True if other threads are waiting on this render
+
+
+class PageCache:
+    """Bounded LRU cache of rendered pages, dropped by database key"""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0           # Requests that waited for another thread's render
+        self.evictions = 0       # Pages dropped to stay under max_bytes
+        self.invalidations = 0   # Pages dropped because a write changed them
+        self.size = 0
+        self._pages = OrderedDict()   # url -> CachedPage, least recently used first
+        self._by_key = {}             # database key -> urls of pages that used it
+        self._rendering = {}          # url -> Event set when its render is done
+        # Bumped by every invalidate(); a page is only stored if none of its
+        # keys changed while it was being rendered
+        self._clock = 0
+        self._changed_at = {}         # database key -> clock of its last change
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+
+    def get_or_claim(self, url, timeout=RENDER_WAIT):
+        """Look a page up, waiting if another thread is already rendering it
+
+        Returns:
+            tuple: (page, ticket) - page is None on a miss, and the caller
+            should render it, store() it and always release() the ticket
+        """
+        with self._lock:
+            page = self._hit(url)
+            if page is not None:
+                return page, None
+            event = self._rendering.get(url)
+            if event is None:
+                self._rendering[url] = threading.Event()
+                self.misses += 1
+                return None, Ticket(url, self._clock, leader=True)
+            self.waits += 1
+
+        event.wait(timeout)
+        with self._lock:
+            page = self._hit(url)
+            if page is not None:
+                return page, None
+            self.misses += 1
+            return None, Ticket(url, self._clock, leader=False)
+
+    def rendering(self, url):
+        """Check whether a thread is rendering url right now"""
+        return url in self._rendering
+
+    def wait(self, url, timeout=RENDER_WAIT):
+        """Wait until no thread is rendering url (lets async callers wait off the event loop)"""
+        with self._lock:
+            event = self._rendering.get(url)
+            if event is not None:
+                self.waits += 1
+        if event is not None:
+            event.wait(timeout)
+
+    def _hit(self, url):
+        """Return a cached page and mark it recently used (call with _lock held)"""
+        page = self._pages.get(url)
+        if page is not None:
+            self._pages.move_to_end(url)
+            self.hits += 1
+        return page
+
+    def store(self, ticket, page):
+        """Cache a page rendered under ticket, unless a write changed its data meanwhile"""
+        with self._lock:
+            if ticket.started < self._cleared_at:
+                return
+            if any(self._changed_at.get(key, -1) > ticket.started for key in page.keys):
+                return
+            if page.size > self.max_bytes:
+                return
+            self._drop(ticket.url)
+            self._pages[ticket.url] = page
+            self.size += page.size
+            for key in page.keys:
+                self._by_key.setdefault(key, set()).add(ticket.url)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._pages)))
+                self.evictions += 1
+
+    def release(self, ticket):
+        """Let threads waiting on this ticket's page go ahead"""
+        if ticket.leader:
+            with self._lock:
+                event = self._rendering.pop(ticket.url, None)
+            if event is not None:
+                event.set()
+
+    def _drop(self, url):
+        """Remove one page (call with _lock held)"""
+        page = self._pages.pop(url, None)
+        if page is None:
+            return
+        self.size -= page.size
+        for key in page.keys:
+            urls = self._by_key.get(key)
+            if urls is not None:
+                urls.discard(url)
+                if not urls:
+                    del self._by_key[key]
+
+    def invalidate(self, keys):
+        """Drop every page built from any of these database keys (a write listener)"""
+        with self._lock:
+            self._clock += 1
+            for key in keys:
+                self._changed_at[key] = self._clock
+                for url in list(self._by_key.get(key, ())):
+                    self._drop(url)
+                    self.invalidations += 1
+
+    def clear(self):
+        """Drop every page"""
+        with self._lock:
+            self._clock += 1
+            self._cleared_at = self._clock
+            self._pages.clear()
+            self._by_key.clear()
+            self._changed_at = {}
+            self.size = 0
+
+    def stats(self):
+        """Return the cache counters as a dictionary"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'pages': len(self._pages),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class FragmentCache:
+    """Bounded LRU cache of rendered fragments, keyed by what they are rendered from"""
+
+    def __init__(self, max_size=FRAGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fragments = OrderedDict()   # key -> rendered text, least recently used first
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Return the fragment for key, calling render() to make it if it isn't cached"""
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        fragment = render()
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        """Drop every fragment"""
+        with self._lock:
+            self._fragments.clear()
+
+    def stats(self):
+        """Return the cache counters as a dictionary"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'fragments': len(self._fragments),
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,65 @@
+"""
+Compressed storage for post bodies
+Long post content is stored as a compressed BLOB; short content stays TEXT
+
+A compressed value starts with a one-byte format marker so the format can
+change later without rewriting old rows:
+  0x01 - zlib
+  0x02 - zstd (only written when the zstandard package is installed)
+
+SQL code (the full-text index triggers and its content view) reads bodies
+through the decompress() SQL function, which register() adds to a connection.
+"""
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content shorter than this (in bytes) is not worth compressing
+MIN_SIZE = int(os.getenv('BLOG_COMPRESS_MIN_SIZE', '1024'))
+
+# 'zlib' or 'zstd' (falls back to zlib if zstandard isn't installed)
+CODEC = os.getenv('BLOG_COMPRESSION', 'zlib')
+
+ZLIB = 1
+ZSTD = 2
+
+
+def compress(text):
+    """Encode post content for storage
+
+    Returns the text unchanged if it is short or doesn't shrink, otherwise a
+    BLOB made of the format marker followed by the compressed UTF-8 bytes.
+    """
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    if len(data) < MIN_SIZE:
+        return text
+    if CODEC == 'zstd' and zstandard is not None:
+        blob = bytes([ZSTD]) + zstandard.ZstdCompressor(level=9).compress(data)
+    else:
+        blob = bytes([ZLIB]) + zlib.compress(data, 6)
+    return blob if len(blob) < len(data) else text
+
+
+def decompress(value):
+    """Decode stored post content back into text (text values pass straight through)"""
+    if not isinstance(value, bytes):
+        return value
+    marker, data = value[0], value[1:]
+    if marker == ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if marker == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('Post content is zstd-compressed; install the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    raise ValueError(f'Unknown content format marker {marker}')
+
+
+def register(conn):
+    """Add the decompress() SQL function to a connection"""
+    conn.create_function('decompress', 1, decompress, deterministic=True)
@@ -1,24 +1,993 @@
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+from flask import g, has_app_context
+import compression
+import migrations
+import query_log
+import rendering
 
 # Database file path
 DATABASE = 'blog.db'
 
-def get_db_connection():
-    """Create a connection to the database"""
-    conn = sqlite3.connect(DATABASE)
+# Connection pool settings
+POOL_SIZE = 8        # Maximum number of open connections per database file
+POOL_TIMEOUT = 5.0   # Seconds to wait for a free connection before giving up
+
+# Storage mode:
+#   'default' - rollback journal, reads and writes share the request connection
+#   'wal'     - WAL journal, reads use read-only pooled connections and all
+#               writes are funnelled through one writer thread
+STORAGE_MODE = os.getenv('BLOG_STORAGE_MODE', 'default')
+
+# Comment write-behind: queue comment inserts and commit them in batches,
+# one transaction (and one fsync) per batch instead of per comment
+COMMENT_BATCHING = os.getenv('BLOG_COMMENT_BATCHING', '0') == '1'
+COMMENT_BATCH_SIZE = int(os.getenv('BLOG_COMMENT_BATCH_SIZE', '100'))
+COMMENT_BATCH_LATENCY = float(os.getenv('BLOG_COMMENT_BATCH_LATENCY_MS', '20')) / 1000
+
+# Read snapshot: serve reads from an in-memory copy of the database, copied
+# with the backup API and refreshed after writes. Changes made by other
+# processes show up within SNAPSHOT_MAX_STALENESS seconds
+READ_SNAPSHOT = os.getenv('BLOG_READ_SNAPSHOT', '0') == '1'
+SNAPSHOT_MAX_STALENESS = float(os.getenv('BLOG_SNAPSHOT_MAX_STALENESS_MS', '1000')) / 1000
+
+# Object cache: keep posts (and misses) and the tag list in memory, LRU-evicted
+# and dropped by the writes that change them. Other processes' writes show up
+# once an entry is OBJECT_CACHE_TTL seconds old
+OBJECT_CACHE = os.getenv('BLOG_OBJECT_CACHE', '0') == '1'
+OBJECT_CACHE_SIZE = int(os.getenv('BLOG_OBJECT_CACHE_SIZE', '1000'))
+OBJECT_CACHE_TTL = float(os.getenv('BLOG_OBJECT_CACHE_TTL', '60'))
+
+# Seconds an uploaded file is kept with no post using it, so a form that
+# uploads the image before saving the post never loses it
+UPLOAD_GRACE = int(os.getenv('BLOG_UPLOAD_GRACE', '600'))
+
+# Threads that run database reads for the async (ASGI) API. Each holds one
+# pooled connection while it works, so there is no point in more than POOL_SIZE
+ASYNC_WORKERS = int(os.getenv('BLOG_ASYNC_WORKERS', str(POOL_SIZE)))
+
+# Pragmas applied to every connection in WAL mode
+WAL_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',   # WAL is still crash-safe with NORMAL
+    'PRAGMA busy_timeout = 5000',    # Wait up to 5s for a lock instead of failing
+    'PRAGMA cache_size = -16000',    # 16 MB page cache per connection
+    'PRAGMA mmap_size = 134217728',  # Memory-map up to 128 MB of the file
+)
+
+def _connect(database, read_only=False):
+    """Open a new SQLite connection configured the way the app expects"""
+    if read_only:
+        path = os.path.abspath(database)
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    else:
+        # Pooled connections move between request threads, so allow that
+        conn = sqlite3.connect(database, check_same_thread=False)
     # This makes rows behave like dictionaries - you can access columns by name
     conn.row_factory = sqlite3.Row
-    return conn
+    # Lets SQL (the search index) read compressed post bodies
+    compression.register(conn)
+    if STORAGE_MODE == 'wal':
+        if not read_only:
+            conn.execute('PRAGMA journal_mode = WAL')
+        for pragma in WAL_PRAGMAS:
+            conn.execute(pragma)
+    if not read_only:
+        _ensure_schema(conn)
+    return query_log.instrument(conn)
+
+def _ensure_schema(conn):
+    """Apply any pending migrations (cheap once the database is up to date)"""
+    migrations.migrate(conn)
+
+def _split_tags(tags):
+    """Split a tag string from sanitize_tags() into unique tag names"""
+    names = []
+    seen = set()
+    for name in (tags or '').split(','):
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+def _set_post_tags(conn, post_id, tags):
+    """Replace the tag links of a post with the tags in a tag string"""
+    conn.execute('DELETE FROM post_tags WHERE post_id = ?', (post_id,))
+    for name in _split_tags(tags):
+        conn.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (name,))
+        conn.execute('''
+            INSERT INTO post_tags (tag_id, post_id, created_at)
+            SELECT tags.id, posts.id, posts.created_at FROM tags, posts
+            WHERE tags.name = ? AND posts.id = ?
+        ''', (name, post_id))
+
+class ConnectionPool:
+    """A bounded pool of reusable connections to one SQLite database file
+
+    acquire() hands out an idle connection if there is one, opens a new one
+    while fewer than max_size are open, and otherwise waits up to timeout
+    seconds for another caller to release() one.
+    """
+
+    def __init__(self, database, max_size=POOL_SIZE, timeout=POOL_TIMEOUT, read_only=False):
+        self.database = database
+        self.read_only = read_only
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0    # acquire() reused an idle connection
+        self.misses = 0  # acquire() had to open a new connection
+        self.waits = 0   # acquire() had to wait for a connection to be released
+        self._idle = []
+        self._in_use = set()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Check a connection out of the pool"""
+        with self._cond:
+            if not self._idle and len(self._in_use) >= self.max_size:
+                self.waits += 1
+                available = self._cond.wait_for(
+                    lambda: self._idle or len(self._in_use) < self.max_size,
+                    timeout=self.timeout
+                )
+                if not available:
+                    raise TimeoutError(f"No database connection available after {self.timeout} seconds")
+
+            if self._idle:
+                self.hits += 1
+                conn = self._idle.pop()
+            else:
+                self.misses += 1
+                conn = _connect(self.database, self.read_only)
+            self._in_use.add(conn)
+            return conn
+
+    def release(self, conn):
+        """Give a connection back to the pool"""
+        with self._cond:
+            if conn not in self._in_use:
+                # Checked out before close_all() - don't let it back in
+                conn.close()
+                return
+            self._in_use.discard(conn)
+            try:
+                # Throw away anything the caller left uncommitted
+                conn.rollback()
+                self._idle.append(conn)
+            except sqlite3.Error:
+                conn.close()
+            self._cond.notify()
+
+    def close_all(self):
+        """Close idle connections and forget the ones that are checked out"""
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+            self._in_use = set()
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return the pool counters as a dictionary"""
+        with self._cond:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'max_size': self.max_size,
+            }
+
+class WriterThread(threading.Thread):
+    """Runs every write against one connection, one at a time
+
+    Callers hand a function to execute(); it runs in this thread with the
+    writer connection, is committed (or rolled back if it raises), and the
+    result or exception is passed back to the caller.
+    """
+
+    def __init__(self, database):
+        super().__init__(name='blog-db-writer', daemon=True)
+        self.database = database
+        self._queue = queue.Queue()
+        # Connect here so a bad database path fails in the caller
+        self._conn = _connect(database)
+        self.start()
+
+    def execute(self, fn):
+        """Run fn(conn) in the writer thread and wait for its result"""
+        future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, future = item
+            try:
+                result = fn(self._conn)
+                self._conn.commit()
+            except BaseException as e:
+                self._conn.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            query_log.finish(self._conn)
+        self._conn.close()
+
+    def stop(self):
+        """Finish queued writes, then close the connection"""
+        self._queue.put(None)
+        self.join()
+
+class CommentBatcher(threading.Thread):
+    """Group-commits comment inserts
+
+    submit() queues a comment and blocks until the batch holding it has been
+    committed, so callers still learn whether their comment was saved. While
+    one batch is being committed the next one fills up; it is written once
+    the queue is empty, it has max_size comments, or its first comment has
+    waited max_latency seconds.
+    """
+
+    def __init__(self, database, writer=None, max_size=COMMENT_BATCH_SIZE, max_latency=COMMENT_BATCH_LATENCY):
+        super().__init__(name='blog-comment-batcher', daemon=True)
+        self.database = database
+        self.writer = writer   # WAL mode: batches go through the writer thread
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.batches = 0    # Transactions committed
+        self.comments = 0   # Comments written
+        self._queue = queue.Queue()
+        self._conn = None
+        self.start()
+
+    def submit(self, row):
+        """Queue a (post_id, author, comment_text, date) row and return its new id"""
+        future = Future()
+        self._queue.put((row, future))
+        return future.result()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_size and time.monotonic() < deadline:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+        if self._conn is not None:
+            self._conn.close()
+
+    def _transaction(self, fn):
+        """Run fn(conn) in one committed transaction"""
+        if self.writer is not None:
+            return self.writer.execute(fn)
+        if self._conn is None:
+            self._conn = _connect(self.database)
+        try:
+            result = fn(self._conn)
+            self._conn.commit()
+            return result
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            query_log.finish(self._conn)
+
+    def _write(self, batch):
+        """Insert a batch in one transaction and resolve each caller's future"""
+        rows = [row for row, _ in batch]
+
+        def insert_all(conn):
+            conn.executemany(COMMENT_INSERT_QUERY, rows)
+            # AUTOINCREMENT ids within one transaction are consecutive
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            return list(range(last_id - len(rows) + 1, last_id + 1))
+
+        try:
+            ids = self._transaction(insert_all)
+        except sqlite3.Error:
+            # One bad comment shouldn't fail the rest - write them one at a time
+            for row, future in batch:
+                try:
+                    future.set_result(self._transaction(
+                        lambda conn: conn.execute(COMMENT_INSERT_QUERY, row).lastrowid
+                    ))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        _snapshot_changed(self.database)
+        self.batches += 1
+        self.comments += len(batch)
+        for (_, future), comment_id in zip(batch, ids):
+            future.set_result(comment_id)
+
+    def stop(self):
+        """Write whatever is queued, then stop"""
+        self._queue.put(None)
+        self.join()
+
+class ReadSnapshot:
+    """Read-only in-memory copy of a database file
+
+    The copy is a shared-cache in-memory database, so every thread reads the
+    same pages through its own connection. Each refresh loads a new copy with
+    the backup API and switches readers over to it; a refresh happens when
+    this process writes (mark_changed()) or when PRAGMA data_version shows
+    another connection or process has committed. data_version is checked at
+    most once every max_staleness seconds.
+    """
+
+    _generations = itertools.count()
+
+    def __init__(self, database, max_staleness=SNAPSHOT_MAX_STALENESS):
+        self.database = database
+        self.max_staleness = max_staleness
+        self.refreshes = 0                # Copies loaded so far
+        self.last_refresh_seconds = 0.0   # How long the latest copy took
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = set()   # Every open reader connection, closed by close()
+        # Source of the copies; its data_version changes when anyone else commits
+        self._source = _connect(database)
+        self._memory = None     # Keeps the current copy alive
+        self._uri = None
+        self._data_version = None
+        self._changed = False
+        self._checked_at = 0.0
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        """Load a new copy of the database (call with _lock held)"""
+        start = time.perf_counter()
+        # Read the version first: a commit during the copy then causes another refresh
+        data_version = self._source.execute('PRAGMA data_version').fetchone()[0]
+        uri = f'file:blog-snapshot-{next(self._generations)}?mode=memory&cache=shared'
+        memory = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._source.backup(memory)
+
+        old = self._memory
+        self._memory, self._uri, self._data_version = memory, uri, data_version
+        if old is not None:
+            # Readers still on the old copy keep it alive until they switch
+            old.close()
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - start
+
+    def mark_changed(self):
+        """Refresh before the next read (this process has just written)"""
+        self._changed = True
+
+    def _check(self):
+        """Refresh the copy if the database has changed since it was taken"""
+        if not self._changed and time.monotonic() - self._checked_at < self.max_staleness:
+            return
+        with self._lock:
+            if not self._changed and time.monotonic() - self._checked_at < self.max_staleness:
+                return   # Another thread just checked
+            changed, self._changed = self._changed, False
+            if changed or self._source.execute('PRAGMA data_version').fetchone()[0] != self._data_version:
+                self._refresh()
+            self._checked_at = time.monotonic()
+
+    def connection(self):
+        """Get this thread's connection to the current copy"""
+        self._check()
+        local = self._local
+        if getattr(local, 'uri', None) != self._uri:
+            if getattr(local, 'conn', None) is not None:
+                self._readers.discard(local.conn)
+                local.conn.close()
+            conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            compression.register(conn)
+            conn.execute('PRAGMA query_only = 1')
+            local.conn = query_log.instrument(conn)
+            local.uri = self._uri
+            self._readers.add(local.conn)
+        return local.conn
+
+    def owns(self, conn):
+        """Check whether conn is one of this snapshot's reader connections"""
+        return conn in self._readers
+
+    def stats(self):
+        """Size of the copy in memory and how often it has been refreshed"""
+        with self._lock:
+            page_count = self._memory.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self._memory.execute('PRAGMA page_size').fetchone()[0]
+        return {
+            'memory_bytes': page_count * page_size,
+            'refreshes': self.refreshes,
+            'last_refresh_seconds': self.last_refresh_seconds,
+            'readers': len(self._readers),
+        }
+
+    def close(self):
+        """Close the copy, the source connection and every reader connection"""
+        with self._lock:
+            for conn in list(self._readers):
+                conn.close()
+            self._readers.clear()
+            self._memory.close()
+            self._source.close()
+
+class ObjectCache:
+    """Thread-safe LRU cache of read results, each kept for at most ttl seconds
+
+    Misses are cached too (a None result), so repeated lookups of a post that
+    doesn't exist don't reach SQLite either. Writes drop the entries they
+    change through invalidate(); the TTL bounds how stale an entry can get
+    when another process writes to the database.
+    """
+
+    def __init__(self, max_size=OBJECT_CACHE_SIZE, ttl=OBJECT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value), least recently used first
+        # Bumped by invalidate() and clear(); a result loaded while it
+        # changed may be stale, so it is returned but not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load, *args):
+        """Return the cached value for key, or load(*args) and cache it"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = load(*args)
+
+        with self._lock:
+            if self._generation == generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, keys):
+        """Drop the entries for these keys"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache counters as a dictionary"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+# One pool and writer per database file (tests switch DATABASE at runtime)
+_pools = {}
+_writers = {}
+_batchers = {}
+_snapshots = {}
+_pools_lock = threading.Lock()
+
+# Shared by every database file; keys start with the file's path
+_object_cache = ObjectCache()
+
+# Connection bound to the current async read thread (see _run_read())
+_bound = threading.local()
+_read_executor = None
+
+def get_pool():
+    """Get the connection pool for the current DATABASE"""
+    with _pools_lock:
+        pool = _pools.get(DATABASE)
+        if pool is None:
+            pool = _pools[DATABASE] = ConnectionPool(DATABASE, read_only=STORAGE_MODE == 'wal')
+        return pool
+
+def get_writer():
+    """Get the writer thread for the current DATABASE (WAL mode)"""
+    with _pools_lock:
+        writer = _writers.get(DATABASE)
+        if writer is None:
+            writer = _writers[DATABASE] = WriterThread(DATABASE)
+        return writer
+
+def get_comment_batcher():
+    """Get the comment batcher for the current DATABASE (write-behind mode)"""
+    writer = get_writer() if STORAGE_MODE == 'wal' else None
+    with _pools_lock:
+        batcher = _batchers.get(DATABASE)
+        if batcher is None:
+            batcher = _batchers[DATABASE] = CommentBatcher(DATABASE, writer)
+        return batcher
+
+def get_snapshot():
+    """Get the read snapshot for the current DATABASE (loaded on first use)"""
+    with _pools_lock:
+        snapshot = _snapshots.get(DATABASE)
+        if snapshot is None:
+            snapshot = _snapshots[DATABASE] = ReadSnapshot(DATABASE)
+        return snapshot
+
+def _snapshot_changed(database):
+    """Tell the database's read snapshot (if any) that a write has committed"""
+    snapshot = _snapshots.get(database)
+    if snapshot is not None:
+        snapshot.mark_changed()
+
+def reset_pool():
+    """Close and drop the pool, writer, batcher and snapshot for the current DATABASE"""
+    with _pools_lock:
+        pool = _pools.pop(DATABASE, None)
+        writer = _writers.pop(DATABASE, None)
+        batcher = _batchers.pop(DATABASE, None)
+        snapshot = _snapshots.pop(DATABASE, None)
+    _object_cache.clear()
+    if snapshot is not None:
+        snapshot.close()
+    # Flush queued comments before the writer goes away
+    if batcher is not None:
+        batcher.stop()
+    if pool is not None:
+        pool.close_all()
+    if writer is not None:
+        writer.stop()
+
+def get_db_connection():
+    """Get a connection to the database
+
+    Inside a Flask request the same pooled connection is returned on every
+    call and handed back to the pool when the request ends. Outside a request
+    (CLI, tests) a fresh connection is opened. In WAL mode the connection is
+    read-only; writes go through _run_write().
+    """
+    bound = getattr(_bound, 'conn', None)
+    if bound is not None:
+        return bound
+    if has_app_context():
+        if 'db_conn' not in g:
+            g.db_pool = get_pool()
+            g.db_conn = g.db_pool.acquire()
+        return g.db_conn
+    return _connect(DATABASE, read_only=STORAGE_MODE == 'wal')
+
+def get_read_connection():
+    """Get a connection for read queries
+
+    This is the read snapshot's connection when READ_SNAPSHOT is on, and
+    get_db_connection() otherwise. Release it with release_db_connection().
+    """
+    if READ_SNAPSHOT:
+        return get_snapshot().connection()
+    return get_db_connection()
+
+def release_db_connection(conn):
+    """Finish using a connection from get_db_connection() or get_read_connection()
+
+    Request, async read and snapshot connections stay open until the work is
+    done; all others are closed.
+    """
+    query_log.finish(conn)
+    if getattr(_bound, 'conn', None) is conn:
+        return
+    snapshot = _snapshots.get(DATABASE)
+    if snapshot is not None and snapshot.owns(conn):
+        return
+    if has_app_context() and g.get('db_conn') is conn:
+        return
+    conn.close()
+
+def close_request_connection(exception=None):
+    """Return the request's connection to the pool (teardown handler)"""
+    conn = g.pop('db_conn', None)
+    pool = g.pop('db_pool', None)
+    if conn is not None:
+        pool.release(conn)
+
+def init_app(app):
+    """Register the per-request connection handling with a Flask app"""
+    app.after_request(query_log.add_query_headers)
+    app.teardown_appcontext(close_request_connection)
+
+def _run_write(fn):
+    """Run fn(conn) as one committed write transaction and return its result
+
+    In WAL mode this happens on the writer thread; otherwise on the normal
+    connection from get_db_connection().
+    """
+    if STORAGE_MODE == 'wal':
+        result = get_writer().execute(fn)
+        _snapshot_changed(DATABASE)
+        return result
 
-def init_db():
-    """Initialize the database using schema.sql"""
     conn = get_db_connection()
-    with open('schema.sql', 'r') as f:
-        conn.executescript(f.read())
-    conn.commit()
+    try:
+        result = fn(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    _snapshot_changed(DATABASE)
+    return result
+
+# Functions called after a post or comment write commits (see add_write_listener())
+_write_listeners = []
+
+def add_write_listener(fn):
+    """Call fn(keys) after every committed post or comment write
+
+    keys is a set of strings naming what the write changed:
+      'posts'       which posts exist, or their order in listings
+      'tags'        the list of tags and their post counts
+      'post:<id>'   one post, its comments or its comment count
+      'tag:<name>'  the posts with one tag (name in lower case)
+      'image:<url>' the resized copies of one uploaded image
+    """
+    _write_listeners.append(fn)
+
+def _notify_write(keys):
+    """Tell the object cache and the write listeners what a committed write changed"""
+    cache_keys = [(DATABASE, key) for key in keys]
+    # A post's version (see get_post_version()) is cached next to the post
+    cache_keys += [(DATABASE, key, 'version') for key in keys if key.startswith('post:')]
+    _object_cache.invalidate(cache_keys)
+    for fn in _write_listeners:
+        fn(keys)
+
+def _post_keys(post_id, *tag_strings):
+    """The write listener keys for a change to a post with these tag strings"""
+    keys = {'posts', 'tags', f'post:{post_id}'}
+    for tags in tag_strings:
+        keys.update(f'tag:{name.lower()}' for name in _split_tags(tags))
+    return keys
+
+def _execute_write(query, params=()):
+    """Run a single write statement and return the new row id"""
+    return _run_write(lambda conn: conn.execute(query, params).lastrowid)
+
+def init_db():
+    """Initialize the database, applying any pending migrations"""
+    # Pooled connections may point at an older copy of the file
+    reset_pool()
+    # Opening a writable connection runs the migrations
+    conn = _connect(DATABASE)
+    version = migrations.current_version(conn)
     conn.close()
-    print("Database initialized!")
+    print(f"Database initialized! (schema version {version})")
+
+class Record:
+    """Base class for the compact row records below
+
+    Each record keeps its fields in __slots__, so it is smaller and faster to
+    build than a sqlite3.Row. Fields can be read as attributes (post.title,
+    for templates), by name or position (post['title'], post[0]), and
+    dict(record) works, just like sqlite3.Row.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except TypeError:
+            # Not a name, so a position
+            return getattr(self, self.__slots__[key])
+        except AttributeError:
+            raise IndexError(f'No item with key {key!r}') from None
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """sqlite3 row factory for queries selecting this record's columns in order"""
+        return cls(*row)
+
+class Post(Record):
+    """A full post, as shown on its own page"""
+    __slots__ = ('id', 'title', 'date', 'content', 'excerpt', 'image_url', 'tags',
+                 'created_at', 'updated_at', 'content_html', 'toc_html', 'reading_time',
+                 'created_display', 'comment_count', 'image_variants')
+
+    def __init__(self, id, title, date, content, excerpt, image_url, tags,
+                 created_at, updated_at, content_html=None, toc_html='', reading_time=1,
+                 created_display=None, comment_count=0, image_variants=None):
+        self.id = id
+        self.title = title
+        self.date = date
+        self.content = content
+        self.excerpt = excerpt
+        self.image_url = image_url
+        self.tags = tags
+        self.created_at = created_at
+        self.updated_at = updated_at
+        # Rendered when the post is saved (see rendering.py)
+        self.content_html = content_html
+        self.toc_html = toc_html
+        self.reading_time = reading_time
+        self.created_display = created_display
+        self.comment_count = comment_count
+        # The image's resized copies, if any (see IMAGE_VARIANTS_COLUMN)
+        self.image_variants = image_variants
+
+    def __repr__(self):
+        return f'<Post {self.id}: {self.title!r}>'
+
+class PostSummary(Record):
+    """A post as shown on a listing card - everything except the body"""
+    __slots__ = ('id', 'title', 'excerpt', 'image_url', 'tags', 'created_at', 'updated_at',
+                 'created_display', 'comment_count', 'image_variants')
+
+    def __init__(self, id, title, excerpt, image_url, tags, created_at, updated_at,
+                 created_display=None, comment_count=0, image_variants=None):
+        self.id = id
+        self.title = title
+        self.excerpt = excerpt
+        self.image_url = image_url
+        self.tags = tags
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.created_display = created_display
+        self.comment_count = comment_count
+        self.image_variants = image_variants
+
+    def __repr__(self):
+        return f'<PostSummary {self.id}: {self.title!r}>'
+
+class SearchResult(Record):
+    """A search match - a listing card's fields and a snippet of the matching text"""
+    __slots__ = ('id', 'title', 'excerpt', 'image_url', 'tags', 'created_at', 'updated_at',
+                 'created_display', 'comment_count', 'image_variants', 'snippet')
+
+    def __init__(self, id, title, excerpt, image_url, tags, created_at, updated_at,
+                 created_display, comment_count, image_variants, snippet):
+        self.id = id
+        self.title = title
+        self.excerpt = excerpt
+        self.image_url = image_url
+        self.tags = tags
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.created_display = created_display
+        self.comment_count = comment_count
+        self.image_variants = image_variants
+        self.snippet = snippet
+
+class Comment(Record):
+    """A comment on a post"""
+    __slots__ = ('id', 'post_id', 'author', 'comment_text', 'date')
+
+    def __init__(self, id, post_id, author, comment_text, date):
+        self.id = id
+        self.post_id = post_id
+        self.author = author
+        self.comment_text = comment_text
+        self.date = date
+
+# The resized copies of a post's image, one "width format url" line each
+# (see images.parse_variants()), read off the image_variants primary key. Part
+# of the post records, so pages get them from the same (awaited) read as the
+# post instead of looking them up while the template renders
+IMAGE_VARIANTS_COLUMN = (
+    "(SELECT group_concat(image_variants.width || ' ' || image_variants.format || ' ' || image_variants.url, char(10)) "
+    "FROM image_variants WHERE image_variants.image_url = posts.image_url)"
+)
+
+# Columns for each record, in __slots__ order. Queries using POST_COLUMNS
+# must also include SUMMARY_JOIN for the comment count
+POST_COLUMNS = (
+    'posts.id, posts.title, posts.date, posts.content, posts.excerpt, posts.image_url, '
+    'posts.tags, posts.created_at, posts.updated_at, posts.content_html, posts.toc_html, '
+    f'posts.reading_time, posts.created_display, COALESCE(post_stats.comment_count, 0), {IMAGE_VARIANTS_COLUMN}'
+)
+COMMENT_COLUMNS = 'id, post_id, author, comment_text, date'
+
+# Columns listing queries select, in PostSummary order. Never includes content,
+# which can be 50,000 characters per post. Queries selecting these must also
+# include SUMMARY_JOIN for the comment count
+SUMMARY_COLUMNS = (
+    'posts.id, posts.title, posts.excerpt, posts.image_url, posts.tags, posts.created_at, '
+    f'posts.updated_at, posts.created_display, COALESCE(post_stats.comment_count, 0), {IMAGE_VARIANTS_COLUMN}'
+)
+SUMMARY_JOIN = 'LEFT JOIN post_stats ON post_stats.post_id = posts.id'
+
+def _fetch_records(conn, record, query, params=()):
+    """Run a query selecting a record class's columns and return a list of records"""
+    cursor = conn.cursor()
+    cursor.row_factory = record.row_factory
+    return cursor.execute(query, params).fetchall()
+
+def _fetch_summaries(conn, query, params=()):
+    """Run a query selecting SUMMARY_COLUMNS and return PostSummary objects"""
+    return _fetch_records(conn, PostSummary, query, params)
+
+# Sort orders: sort_by -> (column, direction). Ties are broken by id in the same direction
+SORT_ORDERS = {
+    'date_desc': ('created_at', 'DESC'),
+    'date_asc': ('created_at', 'ASC'),
+    'title_asc': ('title', 'ASC'),
+    'title_desc': ('title', 'DESC'),
+}
+
+def _sort_order(sort_by):
+    """Get the (column, direction) for a sort_by value, defaulting to date_desc"""
+    return SORT_ORDERS.get(sort_by, SORT_ORDERS['date_desc'])
+
+def _encode_position(kind, value, row_id):
+    """Pack a (kind, sort value, id) position into an opaque URL-safe cursor"""
+    data = json.dumps([kind, value, row_id]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def _decode_position(cursor, kind):
+    """Unpack a cursor made by _encode_position(), or None if it isn't a valid one for kind"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_kind, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    if cursor_kind != kind or not isinstance(value, str) or not isinstance(row_id, int):
+        return None
+    return value, row_id
+
+def encode_cursor(post, sort_by='date_desc'):
+    """Make an opaque pagination cursor pointing at a post in a sort order"""
+    column, _ = _sort_order(sort_by)
+    return _encode_position(sort_by, post[column], post['id'])
+
+def decode_cursor(cursor, sort_by='date_desc'):
+    """Turn a cursor back into a (sort value, post id) pair
+
+    Returns None if the cursor is malformed or belongs to another sort order.
+    """
+    return _decode_position(cursor, sort_by)
+
+def encode_comment_cursor(comment):
+    """Make an opaque cursor pointing at a comment (for "load more")"""
+    return _encode_position('comments', comment['date'], comment['id'])
+
+def decode_comment_cursor(cursor):
+    """Turn a comment cursor back into a (date, comment id) pair, or None if invalid"""
+    return _decode_position(cursor, 'comments')
+
+def _posts_page_query(sort_by, has_cursor, backwards, has_tag):
+    """Build the SQL for one get_posts_page() variant
+
+    Parameters are the tag (if any), then the cursor's sort value and id
+    (if any), then the row limit and offset.
+    """
+    column, direction = _sort_order(sort_by)
+    if backwards:
+        # Walk backwards from the cursor; the caller flips the rows into display order
+        direction = 'ASC' if direction == 'DESC' else 'DESC'
+    comparison = '<' if direction == 'DESC' else '>'
+
+    if has_tag and column == 'created_at':
+        # post_tags carries created_at, so a tag's posts come straight off its index
+        source = '''tags JOIN post_tags ON post_tags.tag_id = tags.id
+            JOIN posts ON posts.id = post_tags.post_id'''
+        key = ('post_tags.created_at', 'post_tags.post_id')
+    elif has_tag:
+        source = '''tags JOIN post_tags ON post_tags.tag_id = tags.id
+            JOIN posts ON posts.id = post_tags.post_id'''
+        key = (f'posts.{column}', 'posts.id')
+    else:
+        source = 'posts'
+        key = (f'posts.{column}', 'posts.id')
+
+    conditions = []
+    if has_tag:
+        conditions.append('tags.name = ?')
+    if has_cursor:
+        conditions.append(f'({key[0]}, {key[1]}) {comparison} (?, ?)')
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    return f'''
+        SELECT {SUMMARY_COLUMNS} FROM {source} {SUMMARY_JOIN} {where}
+        ORDER BY {key[0]} {direction}, {key[1]} {direction}
+        LIMIT ? OFFSET ?
+    '''
+
+def get_posts_page(sort_by='date_desc', limit=6, after=None, before=None, tag=None, offset=0):
+    """Get one page of posts using keyset (cursor) pagination
+
+    Instead of skipping rows with OFFSET, the query seeks straight to the rows
+    after (or before) a (sort value, id) position, so every page costs the same
+    no matter how deep it is.
+
+    Args:
+        sort_by: Sort order - 'date_desc', 'date_asc', 'title_asc', 'title_desc'
+        limit: Number of posts per page
+        after: (sort value, id) of the last post on the previous page
+        before: (sort value, id) of the first post on the next page
+        tag: Only include posts with this tag
+        offset: Number of posts to skip (only for old ?page=N links, which have no cursor)
+
+    Returns:
+        tuple: (posts, has_more) - PostSummary objects, and whether another
+        page exists in the direction being paged
+    """
+    cursor = after if after is not None else before
+    query = _posts_page_query(sort_by, cursor is not None, before is not None, tag is not None)
+    params = ([tag] if tag is not None else []) + (list(cursor) if cursor is not None else [])
+
+    conn = get_read_connection()
+    # Fetch one extra row to find out whether there is another page
+    posts = _fetch_summaries(conn, query, params + [limit + 1, offset])
+    release_db_connection(conn)
+
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    if before is not None:
+        posts.reverse()
+    return posts, has_more
 
 def get_all_posts(sort_by='date_desc', limit=None, offset=0):
     """Get all posts from the database with various sorting options and pagination
@@ -28,138 +997,685 @@ def get_all_posts(sort_by='date_desc', limit=None, offset=0):
         limit: Maximum number of posts to return (None for all posts)
         offset: Number of posts to skip (for pagination)
     """
-    conn = get_db_connection()
+    conn = get_read_connection()
+    if limit is not None:
+        posts = _fetch_records(conn, Post, _all_posts_query(sort_by, paged=True), (limit, offset))
+    else:
+        posts = _fetch_records(conn, Post, _all_posts_query(sort_by))
+    release_db_connection(conn)
+    for post in posts:
+        _unpack_post(post)
+    return posts
 
+def _all_posts_query(sort_by, paged=False, summaries=False):
+    """Build the SQL for get_all_posts(), with LIMIT ? OFFSET ? if paged"""
     # Determine ORDER BY clause based on sort_by parameter
-    if sort_by == 'date_asc':
-        order_clause = 'ORDER BY created_at ASC, id ASC'
-    elif sort_by == 'title_asc':
-        order_clause = 'ORDER BY title ASC'
-    elif sort_by == 'title_desc':
-        order_clause = 'ORDER BY title DESC'
-    else:  # default to date_desc
-        order_clause = 'ORDER BY created_at DESC, id DESC'
-
-    # Add LIMIT and OFFSET if specified
-    query = f'SELECT * FROM posts {order_clause}'
-    if limit is not None:
-        query += f' LIMIT {limit} OFFSET {offset}'
+    column, direction = _sort_order(sort_by)
+    if summaries:
+        select = f'SELECT {SUMMARY_COLUMNS} FROM posts {SUMMARY_JOIN}'
+    else:
+        select = f'SELECT {POST_COLUMNS} FROM posts {SUMMARY_JOIN}'
+    query = f'{select} ORDER BY posts.{column} {direction}, posts.id {direction}'
+    if paged:
+        query += ' LIMIT ? OFFSET ?'
+    return query
 
-    posts = conn.execute(query).fetchall()
-    conn.close()
+def get_post_summaries(sort_by='date_desc', limit=6, offset=0):
+    """Get posts for a listing page as PostSummary objects (no content)
+
+    Args:
+        sort_by: Sort order - 'date_desc', 'date_asc', 'title_asc', 'title_desc'
+        limit: Maximum number of posts to return
+        offset: Number of posts to skip (for old ?page=N links)
+    """
+    conn = get_read_connection()
+    posts = _fetch_summaries(conn, _all_posts_query(sort_by, paged=True, summaries=True), (limit, offset))
+    release_db_connection(conn)
     return posts
 
+# Kept up to date by triggers, so this is a single-row lookup rather than a COUNT(*)
+POSTS_COUNT_QUERY = "SELECT value FROM counters WHERE name = 'posts'"
+
 def get_posts_count():
     """Get the total count of posts in the database"""
-    conn = get_db_connection()
-    count = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
-    conn.close()
+    conn = get_read_connection()
+    count = conn.execute(POSTS_COUNT_QUERY).fetchone()[0]
+    release_db_connection(conn)
     return count
 
+# Change watermarks kept up to date by triggers (see migration 8), used as
+# ETag / Last-Modified validators. Both are single-row lookups
+SITE_VERSION_QUERY = "SELECT name, value FROM counters WHERE name IN ('version', 'changed_at')"
+
+POST_VERSION_QUERY = '''
+    SELECT COALESCE(post_stats.version, 0),
+           COALESCE(post_stats.changed_at,
+                    CAST(strftime('%s', COALESCE(posts.updated_at, posts.created_at)) AS INTEGER), 0)
+    FROM posts LEFT JOIN post_stats ON post_stats.post_id = posts.id
+    WHERE posts.id = ?
+'''
+
+def get_site_version():
+    """Get (version, changed_at) for the whole site
+
+    version goes up whenever a post or comment is added, edited or deleted,
+    and changed_at is when that last happened (unix seconds).
+    """
+    conn = get_read_connection()
+    values = dict(conn.execute(SITE_VERSION_QUERY).fetchall())
+    release_db_connection(conn)
+    return values.get('version', 0), values.get('changed_at', 0)
+
+def get_post_version(post_id):
+    """Get (version, changed_at) for one post and its comments, or None if there is no such post"""
+    if OBJECT_CACHE:
+        # Cached apart from the post itself, so a 304 never loads the full row.
+        # Misses are cached too - probes for random ids stop at the cache
+        return _object_cache.get_or_load((DATABASE, f'post:{post_id}', 'version'), _load_post_version, post_id)
+    return _load_post_version(post_id)
+
+def _load_post_version(post_id):
+    """Read a post's version from the database (see get_post_version())"""
+    conn = get_read_connection()
+    row = conn.execute(POST_VERSION_QUERY, (post_id,)).fetchone()
+    release_db_connection(conn)
+    return tuple(row) if row else None
+
+POST_BY_ID_QUERY = f'SELECT {POST_COLUMNS} FROM posts {SUMMARY_JOIN} WHERE posts.id = ?'
+
 def get_post_by_id(post_id):
-    """Get a single post by its ID"""
-    conn = get_db_connection()
-    post = conn.execute('SELECT * FROM posts WHERE id = ?', (post_id,)).fetchone()
-    conn.close()
+    """Get a single post by its ID, with its comment_count (None if there is no such post)"""
+    if OBJECT_CACHE:
+        return _object_cache.get_or_load((DATABASE, f'post:{post_id}'), _load_post, post_id)
+    return _load_post(post_id)
+
+def _load_post(post_id):
+    """Read a post from the database (see get_post_by_id())"""
+    conn = get_read_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = Post.row_factory
+    post = cursor.execute(POST_BY_ID_QUERY, (post_id,)).fetchone()
+    release_db_connection(conn)
+    if post is not None:
+        _unpack_post(post)
     return post
 
+def _unpack_post(post):
+    """Decompress a post's body and stored HTML, rendering the HTML if it is missing"""
+    # Long bodies (and their HTML) are stored compressed; only full-post reads need them
+    post.content = compression.decompress(post.content)
+    if post.content_html is None:
+        # Saved by an older version (or a raw SQL insert): render it now
+        post.content_html, post.toc_html, post.reading_time = rendering.render_post(post.content)
+        post.created_display = rendering.norwegian_datetime(post.created_at)
+    post.content_html = compression.decompress(post.content_html)
+
 def create_post(title, content, excerpt, image_url, tags):
     """Insert a new post into the database
 
     Timestamps (created_at, updated_at) are explicitly set in UTC.
     The date field is set to current date for display purposes.
+    Returns the id of the new post.
     """
-    conn = get_db_connection()
     # Generate display date and timestamps
     date = datetime.now().strftime('%Y-%m-%d')
     timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
-    conn.execute('''
-        INSERT INTO posts (title, date, content, excerpt, image_url, tags, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (title, date, content, excerpt, image_url, tags, timestamp, timestamp))
-    conn.commit()
-    conn.close()
+    stored_content = compression.compress(content)
+    # Render once here, so showing the post never has to
+    content_html, toc_html, minutes = rendering.render_post(content)
+    created_display = rendering.norwegian_datetime(timestamp)
+
+    def insert(conn):
+        post_id = conn.execute('''
+            INSERT INTO posts (title, date, content, excerpt, image_url, tags, created_at, updated_at,
+                               content_html, toc_html, reading_time, created_display)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (title, date, stored_content, excerpt, image_url, tags, timestamp, timestamp,
+              content_html, toc_html, minutes, created_display)).lastrowid
+        _set_post_tags(conn, post_id, tags)
+        return post_id
+
+    post_id = _run_write(insert)
+    _notify_write(_post_keys(post_id, tags))
+    return post_id
 
 def update_post(post_id, title, date, content, excerpt, image_url, tags):
     """Update an existing post in the database
 
     Updates the updated_at timestamp automatically.
     """
-    conn = get_db_connection()
     # Generate current timestamp for updated_at
     updated_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    conn.execute('''
-        UPDATE posts
-        SET title = ?, date = ?, content = ?, excerpt = ?, image_url = ?, tags = ?, updated_at = ?
-        WHERE id = ?
-    ''', (title, date, content, excerpt, image_url, tags, updated_at, post_id))
-    conn.commit()
-    conn.close()
+    stored_content = compression.compress(content)
+    content_html, toc_html, minutes = rendering.render_post(content)
+
+    def update(conn):
+        row = conn.execute('SELECT tags FROM posts WHERE id = ?', (post_id,)).fetchone()
+        conn.execute('''
+            UPDATE posts
+            SET title = ?, date = ?, content = ?, excerpt = ?, image_url = ?, tags = ?, updated_at = ?,
+                content_html = ?, toc_html = ?, reading_time = ?
+            WHERE id = ?
+        ''', (title, date, stored_content, excerpt, image_url, tags, updated_at,
+              content_html, toc_html, minutes, post_id))
+        _set_post_tags(conn, post_id, tags)
+        return row[0] if row else None
+
+    old_tags = _run_write(update)
+    _notify_write(_post_keys(post_id, old_tags, tags))
 
 def delete_post(post_id):
     """Delete a post from the database"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
-    conn.commit()
-    conn.close()
+    def delete(conn):
+        row = conn.execute('SELECT tags FROM posts WHERE id = ?', (post_id,)).fetchone()
+        conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+        return row[0] if row else None
+
+    old_tags = _run_write(delete)
+    _notify_write(_post_keys(post_id, old_tags))
+
+# Look the tag up by its unique name index, then follow the links to its posts
+POSTS_BY_TAG_QUERY = f'''
+    SELECT {SUMMARY_COLUMNS} FROM tags
+    JOIN post_tags ON post_tags.tag_id = tags.id
+    JOIN posts ON posts.id = post_tags.post_id
+    {SUMMARY_JOIN}
+    WHERE tags.name = ?
+    ORDER BY post_tags.created_at DESC, post_tags.post_id DESC
+'''
 
 def get_posts_by_tag(tag):
-    """Get all posts that contain a specific tag"""
-    conn = get_db_connection()
-    # Use LIKE to search for the tag in the tags column
-    # Add wildcards to match tag anywhere in the string
-    posts = conn.execute(
-        "SELECT * FROM posts WHERE tags LIKE ? ORDER BY created_at DESC, id DESC",
-        (f'%{tag}%',)
-    ).fetchall()
-    conn.close()
+    """Get PostSummary objects for every post with a tag (case-insensitive, whole tag only)"""
+    conn = get_read_connection()
+    posts = _fetch_summaries(conn, POSTS_BY_TAG_QUERY, (tag,))
+    release_db_connection(conn)
     return posts
 
+TAG_COUNTS_QUERY = 'SELECT name, post_count FROM tags WHERE post_count > 0 ORDER BY name'
+
+def get_tag_counts():
+    """Get all tags in use with the number of posts that have them, sorted by name"""
+    if OBJECT_CACHE:
+        return _object_cache.get_or_load((DATABASE, 'tags'), _load_tag_counts)
+    return _load_tag_counts()
+
+def _load_tag_counts():
+    """Read the tag counts from the database (see get_tag_counts())"""
+    conn = get_read_connection()
+    tags = conn.execute(TAG_COUNTS_QUERY).fetchall()
+    release_db_connection(conn)
+    return tags
+
 def get_all_tags():
-    """Get all unique tags from all posts"""
-    conn = get_db_connection()
-    posts = conn.execute('SELECT tags FROM posts WHERE tags IS NOT NULL AND tags != ""').fetchall()
-    conn.close()
-    
-    # Collect all unique tags
-    all_tags = set()
-    for post in posts:
-        if post['tags']:
-            # Split tags and add to set (removes duplicates)
-            tags = [tag.strip() for tag in post['tags'].split(',')]
-            all_tags.update(tags)
-    
-    # Return as sorted list
-    return sorted(all_tags)
+    """Get all unique tags from all posts, sorted by name"""
+    return [tag['name'] for tag in get_tag_counts()]
+
+# Markers SQLite puts around matched words in search snippets. They can't
+# appear in posts, so the text can be HTML-escaped before they become <mark>
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+# rank is bm25 with per-column weights (see migration 4), best matches first
+SEARCH_QUERY = f'''
+    SELECT {SUMMARY_COLUMNS},
+           snippet(posts_fts, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 24) AS snippet
+    FROM posts_fts
+    JOIN posts ON posts.id = posts_fts.rowid
+    {SUMMARY_JOIN}
+    WHERE posts_fts MATCH ?
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+'''
+
+def _fts_query(text):
+    """Turn free text from the search box into a safe FTS5 query
+
+    Every word must match; the last one also matches as a prefix so results
+    show up while a word is still being typed.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search_posts(text, limit=10, offset=0):
+    """Full-text search over post titles, excerpts, content and tags
+
+    Returns:
+        tuple: (posts, has_more) - SearchResult objects, best matches first,
+        each with a snippet of matching text wrapped in HIGHLIGHT_START /
+        HIGHLIGHT_END markers
+    """
+    query = _fts_query(text)
+    if query is None:
+        return [], False
+
+    conn = get_read_connection()
+    # Fetch one extra row to find out whether there is another page
+    posts = _fetch_records(conn, SearchResult, SEARCH_QUERY, (query, limit + 1, offset))
+    release_db_connection(conn)
+    return posts[:limit], len(posts) > limit
+
+COMMENTS_FOR_POST_QUERY = f'SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id = ? ORDER BY date DESC, id DESC'
 
 def get_comments_for_post(post_id):
     """Get all comments for a specific post, ordered by date (newest first)"""
-    conn = get_db_connection()
-    comments = conn.execute(
-        'SELECT * FROM comments WHERE post_id = ? ORDER BY date DESC',
-        (post_id,)
-    ).fetchall()
-    conn.close()
+    conn = get_read_connection()
+    comments = _fetch_records(conn, Comment, COMMENTS_FOR_POST_QUERY, (post_id,))
+    release_db_connection(conn)
     return comments
 
+# One page of a post's comments, newest first, starting after a (date, id)
+# position when there is one. Both read straight off idx_comments_post_date
+COMMENTS_PAGE_QUERY = f'''
+    SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id = ?
+    ORDER BY date DESC, id DESC LIMIT ?
+'''
+COMMENTS_PAGE_AFTER_QUERY = f'''
+    SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id = ? AND (date, id) < (?, ?)
+    ORDER BY date DESC, id DESC LIMIT ?
+'''
+
+def get_comments_page(post_id, limit=20, after=None):
+    """Get one page of a post's comments, newest first
+
+    Args:
+        post_id: The post whose comments to get
+        limit: Comments per page
+        after: (date, id) of the last comment on the previous page, from
+            decode_comment_cursor(), or None for the first page
+
+    Returns:
+        tuple: (comments, has_more) - whether older comments follow
+    """
+    conn = get_read_connection()
+    if after is None:
+        comments = _fetch_records(conn, Comment, COMMENTS_PAGE_QUERY, (post_id, limit + 1))
+    else:
+        comments = _fetch_records(conn, Comment, COMMENTS_PAGE_AFTER_QUERY, (post_id, *after, limit + 1))
+    release_db_connection(conn)
+    return comments[:limit], len(comments) > limit
+
+COMMENT_INSERT_QUERY = '''
+    INSERT INTO comments (post_id, author, comment_text, date)
+    VALUES (?, ?, ?, ?)
+'''
+
 def create_comment(post_id, author, comment_text, date):
-    """Insert a new comment into the database"""
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO comments (post_id, author, comment_text, date)
-        VALUES (?, ?, ?, ?)
-    ''', (post_id, author, comment_text, date))
-    conn.commit()
-    conn.close()
+    """Insert a new comment into the database and return its id
+
+    With COMMENT_BATCHING on, the insert is group-committed with other
+    comments arriving at the same time; this still waits for the commit.
+    """
+    row = (post_id, author, comment_text, date)
+    if COMMENT_BATCHING:
+        comment_id = get_comment_batcher().submit(row)
+    else:
+        comment_id = _execute_write(COMMENT_INSERT_QUERY, row)
+    _notify_write({f'post:{post_id}'})
+    return comment_id
 
 def delete_comment(comment_id):
     """Delete a comment from the database"""
-    conn = get_db_connection()
-    conn.execute('DELETE FROM comments WHERE id = ?', (comment_id,))
-    conn.commit()
+    def delete(conn):
+        row = conn.execute('SELECT post_id FROM comments WHERE id = ?', (comment_id,)).fetchone()
+        conn.execute('DELETE FROM comments WHERE id = ?', (comment_id,))
+        return row[0] if row else None
+
+    post_id = _run_write(delete)
+    if post_id is not None:
+        _notify_write({f'post:{post_id}'})
+
+def repair_counters():
+    """Recompute every trigger-maintained counter from the real rows
+
+    Returns:
+        list: (counter name, stored value, actual value) for each counter
+        that had drifted and was fixed
+    """
+    def repair(conn):
+        drift = []
+        for name, actual_query in (
+            ('posts', 'SELECT COUNT(*) FROM posts'),
+            ('comments', 'SELECT COUNT(*) FROM comments'),
+        ):
+            actual = conn.execute(actual_query).fetchone()[0]
+            row = conn.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+            stored = row[0] if row else None
+            if stored != actual:
+                drift.append((name, stored, actual))
+                conn.execute('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)', (name, actual))
+
+        rows = conn.execute('''
+            SELECT posts.id, post_stats.comment_count,
+                   (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)
+            FROM posts LEFT JOIN post_stats ON post_stats.post_id = posts.id
+        ''').fetchall()
+        for post_id, stored, actual in rows:
+            if stored != actual:
+                drift.append((f'comments:post {post_id}', stored, actual))
+                # Bump the version too, so cached copies of the post are revalidated
+                conn.execute('''
+                    INSERT INTO post_stats (post_id, comment_count) VALUES (?, ?)
+                    ON CONFLICT (post_id) DO UPDATE
+                    SET comment_count = excluded.comment_count, version = version + 1
+                ''', (post_id, actual))
+        conn.execute('DELETE FROM post_stats WHERE post_id NOT IN (SELECT id FROM posts)')
+
+        rows = conn.execute('''
+            SELECT url, refs, (SELECT COUNT(*) FROM posts WHERE posts.image_url = uploads.url)
+            FROM uploads
+        ''').fetchall()
+        for url, stored, actual in rows:
+            if stored != actual:
+                drift.append((f'refs:{url}', stored, actual))
+                conn.execute('UPDATE uploads SET refs = ? WHERE url = ?', (actual, url))
+        return drift
+
+    return _run_write(repair)
+
+def render_posts():
+    """Re-render the stored HTML, table of contents, reading time and display
+    date of every post (after changing rendering.py)
+
+    Returns:
+        int: Number of posts rendered
+    """
+    count = _run_write(rendering.rerender_posts)
+    conn = get_read_connection()
+    post_ids = [row[0] for row in conn.execute('SELECT id FROM posts')]
+    release_db_connection(conn)
+    keys = {'posts', 'tags'}
+    keys.update(f'post:{post_id}' for post_id in post_ids)
+    _notify_write(keys)
+    return count
+
+# Resized copies of an uploaded image, by format, then smallest first (the primary key order)
+IMAGE_VARIANTS_QUERY = 'SELECT width, format, url FROM image_variants WHERE image_url = ? ORDER BY format, width'
+
+def get_image_variants(image_url):
+    """Get the resized copies made of an uploaded image (see images.py)
+
+    Returns:
+        tuple: (width, format, url) for each copy - empty if there are none
+        (yet), e.g. for linked images or while the upload is being processed
+
+    Pages don't call this: post records carry their image's copies (see
+    IMAGE_VARIANTS_COLUMN).
+    """
+    conn = get_read_connection()
+    rows = conn.execute(IMAGE_VARIANTS_QUERY, (image_url,)).fetchall()
+    release_db_connection(conn)
+    return tuple(tuple(row) for row in rows)
+
+def record_image_variants(image_url, variants):
+    """Store the (width, format, url) copies made of an uploaded image
+
+    Pages showing the image are told through the write listeners, so they
+    are rendered again with the new copies.
+
+    Returns:
+        bool: False if the upload was removed meanwhile (nothing is stored,
+        and the caller should delete the copies' files)
+    """
+    def record(conn):
+        if conn.execute('SELECT 1 FROM uploads WHERE url = ?', (image_url,)).fetchone() is None:
+            return None
+        conn.executemany(
+            'INSERT OR REPLACE INTO image_variants (image_url, width, format, url) VALUES (?, ?, ?, ?)',
+            [(image_url,) + tuple(variant) for variant in variants]
+        )
+        return [row[0] for row in conn.execute('SELECT id FROM posts WHERE image_url = ?', (image_url,))]
+
+    post_ids = _run_write(record)
+    if post_ids is None:
+        return False
+    keys = {f'image:{image_url}'}
+    if post_ids:
+        # Cards on the listings show the image too
+        keys.update({'posts', *(f'post:{post_id}' for post_id in post_ids)})
+    _notify_write(keys)
+    return True
+
+# An earlier upload with the same content
+UPLOAD_BY_HASH_QUERY = 'SELECT url FROM uploads WHERE sha256 = ?'
+
+# Unused uploads old enough that no request can still be about to use them
+UNUSED_UPLOADS_QUERY = 'DELETE FROM uploads WHERE refs = 0 AND uploaded_at <= ? RETURNING url'
+
+def store_upload(sha256, url, size, place):
+    """Record an uploaded file by its content hash
+
+    If a file with the same content was uploaded before, its URL is returned
+    and the new copy isn't needed. Otherwise place(url) is called to move the
+    new file into place. It runs inside the write transaction, so
+    collect_unused_uploads() can't remove the file in between.
+
+    Returns:
+        tuple: (url, stored) - stored is False if the content was already there
+    """
+    now = int(time.time())
+
+    def store(conn):
+        row = conn.execute(UPLOAD_BY_HASH_QUERY, (sha256,)).fetchone()
+        if row is not None:
+            # Used again: keep it for another UPLOAD_GRACE seconds even if no post uses it yet
+            conn.execute('UPDATE uploads SET uploaded_at = ? WHERE url = ?', (now, row[0]))
+            return row[0], False
+        conn.execute('INSERT INTO uploads (url, sha256, size, uploaded_at) VALUES (?, ?, ?, ?)',
+                     (url, sha256, size, now))
+        place(url)
+        return url, True
+
+    return _run_write(store)
+
+def collect_unused_uploads(remove, grace=None):
+    """Forget uploads no post uses any more, with their resized copies
+
+    A post's image counts as a use (kept up to date by triggers, see
+    migration 11). Files uploaded in the last grace seconds (UPLOAD_GRACE)
+    are kept, since the post that will use them may not be saved yet.
+    remove(urls) deletes the files; it runs inside the write transaction, so
+    store_upload() can't bring one of them back in between.
+
+    Returns:
+        list: URLs of the uploads removed
+    """
+    cutoff = int(time.time()) - (UPLOAD_GRACE if grace is None else grace)
+
+    def collect(conn):
+        urls = [row[0] for row in conn.execute(UNUSED_UPLOADS_QUERY, (cutoff,)).fetchall()]
+        copies = []
+        for url in urls:
+            copies.extend(row[2] for row in conn.execute(IMAGE_VARIANTS_QUERY, (url,)).fetchall())
+            conn.execute('DELETE FROM image_variants WHERE image_url = ?', (url,))
+        if urls:
+            remove(urls + copies)
+        return urls
+
+    urls = _run_write(collect)
+    if urls:
+        _notify_write({f'image:{url}' for url in urls})
+    return urls
+
+# -----------------------------------------------------------------------------
+# Async reads (used by asgi.py)
+# -----------------------------------------------------------------------------
+
+def get_read_executor():
+    """Get the bounded thread pool that runs async reads"""
+    global _read_executor
+    with _pools_lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='blog-read')
+        return _read_executor
+
+def _pooled_call(fn, args, kwargs):
+    """Call fn on this thread with a pooled connection bound for its queries"""
+    if READ_SNAPSHOT:
+        # Reads come from the snapshot, no need to tie up a pooled connection
+        return fn(*args, **kwargs)
+    pool = get_pool()
+    conn = pool.acquire()
+    _bound.conn = conn
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _bound.conn = None
+        pool.release(conn)
+
+async def _run_read(fn, *args, **kwargs):
+    """Run a sync read function on the read executor without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_read_executor(), _pooled_call, fn, args, kwargs)
+
+async def get_post_summaries_async(sort_by='date_desc', limit=6, offset=0):
+    """Async version of get_post_summaries()"""
+    return await _run_read(get_post_summaries, sort_by, limit, offset)
+
+async def get_posts_page_async(sort_by='date_desc', limit=6, after=None, before=None, tag=None, offset=0):
+    """Async version of get_posts_page()"""
+    return await _run_read(get_posts_page, sort_by, limit, after=after, before=before, tag=tag, offset=offset)
+
+async def get_posts_count_async():
+    """Async version of get_posts_count()"""
+    return await _run_read(get_posts_count)
+
+async def get_post_by_id_async(post_id):
+    """Async version of get_post_by_id()"""
+    return await _run_read(get_post_by_id, post_id)
+
+async def get_all_tags_async():
+    """Async version of get_all_tags()"""
+    return await _run_read(get_all_tags)
+
+async def get_comments_for_post_async(post_id):
+    """Async version of get_comments_for_post()"""
+    return await _run_read(get_comments_for_post, post_id)
+
+async def get_comments_page_async(post_id, limit=20, after=None):
+    """Async version of get_comments_page()"""
+    return await _run_read(get_comments_page, post_id, limit, after)
+
+async def get_site_version_async():
+    """Async version of get_site_version()"""
+    return await _run_read(get_site_version)
+
+async def get_post_version_async(post_id):
+    """Async version of get_post_version()"""
+    return await _run_read(get_post_version, post_id)
+
+# -----------------------------------------------------------------------------
+# Query plan checks
+# -----------------------------------------------------------------------------
+
+def _hot_queries():
+    """Every read query the app runs, with sample parameters, for plan checks"""
+    queries = [
+        ('get_posts_count', POSTS_COUNT_QUERY, ()),
+        ('get_site_version', SITE_VERSION_QUERY, ()),
+        ('get_post_version', POST_VERSION_QUERY, (1,)),
+        ('get_post_by_id', POST_BY_ID_QUERY, (1,)),
+        ('get_posts_by_tag', POSTS_BY_TAG_QUERY, ('python',)),
+        ('get_tag_counts', TAG_COUNTS_QUERY, ()),
+        ('get_comments_for_post', COMMENTS_FOR_POST_QUERY, (1,)),
+        ('get_comments_page', COMMENTS_PAGE_QUERY, (1, 21)),
+        ('get_comments_page[after]', COMMENTS_PAGE_AFTER_QUERY, (1, '2025-01-01 12:00', 5, 21)),
+        ('search_posts', SEARCH_QUERY, ('"python"*', 11, 0)),
+        ('get_image_variants', IMAGE_VARIANTS_QUERY, ('/static/uploads/x.png',)),
+        ('store_upload', UPLOAD_BY_HASH_QUERY, ('0' * 64,)),
+        ('collect_unused_uploads', UNUSED_UPLOADS_QUERY, (0,)),
+    ]
+    for sort_by in SORT_ORDERS:
+        column, direction = _sort_order(sort_by)
+        queries.append((f'get_all_posts[{sort_by}]', _all_posts_query(sort_by, paged=True), (6, 0)))
+        queries.append((
+            f'get_post_summaries[{sort_by}]',
+            _all_posts_query(sort_by, paged=True, summaries=True),
+            (6, 0)
+        ))
+        for has_cursor, backwards in ((False, False), (True, False), (True, True)):
+            for has_tag in (False, True):
+                if has_tag and column != 'created_at':
+                    continue  # Tag pages are only sorted by date
+                params = (['python'] if has_tag else []) + (['x', 1] if has_cursor else []) + [7, 0]
+                name = f"get_posts_page[{sort_by}{', cursor' if has_cursor else ''}{', backwards' if backwards else ''}{', tag' if has_tag else ''}]"
+                queries.append((name, _posts_page_query(sort_by, has_cursor, backwards, has_tag), params))
+    return queries
+
+def check_query_plans():
+    """Run EXPLAIN QUERY PLAN on every hot query
+
+    Returns:
+        list: (query name, plan detail) for each step that scans a whole
+        table without an index or sorts through a temporary B-tree
+    """
+    conn = _connect(DATABASE)
+    problems = []
+    for name, query, params in _hot_queries():
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params):
+            detail = row['detail']
+            # "SCAN x VIRTUAL TABLE" is a full-text index lookup, not a table scan
+            full_scan = detail.startswith('SCAN ') and ' USING ' not in detail and 'VIRTUAL TABLE' not in detail
+            if full_scan or 'USE TEMP B-TREE' in detail:
+                problems.append((name, detail))
     conn.close()
+    return problems
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+
+def main(argv=None):
+    """Database maintenance commands (python database.py --help)"""
+    parser = argparse.ArgumentParser(description='Blog database tools')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('init', help='Create the database and apply migrations (default)')
+    commands.add_parser('check-plans', help='Fail if a hot query scans a table or sorts in a temp B-tree')
+    commands.add_parser('repair-counters', help='Recompute post and comment counters and report drift')
+    commands.add_parser('render-posts', help='Re-render the stored HTML of every post')
+    for name, help_text in (
+        ('import', 'Import posts and comments from a JSONL file or Markdown files'),
+        ('export', 'Export posts and comments to a JSONL file or a Markdown directory'),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('path', help="JSONL file ('-' for stdin/stdout), .md file or directory")
+        command.add_argument('--format', choices=('jsonl', 'markdown'),
+                             help='Default: markdown for directories and .md files, otherwise jsonl')
+    args = parser.parse_args(argv)
+
+    if args.command in (None, 'init'):
+        init_db()
+    elif args.command == 'check-plans':
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"{name}: {detail}")
+        print(f"{len(_hot_queries())} queries checked, {len(problems)} problems")
+        return 1 if problems else 0
+    elif args.command == 'repair-counters':
+        drift = repair_counters()
+        for name, stored, actual in drift:
+            print(f"{name}: {stored} -> {actual}")
+        print(f"{len(drift)} counters repaired")
+    elif args.command == 'render-posts':
+        print(f"{render_posts()} posts rendered")
+    elif args.command == 'import':
+        import bulk_io
+        stats = bulk_io.import_posts(args.path, args.format)
+        rate = stats['posts'] / stats['seconds'] if stats['seconds'] else 0
+        print(f"Imported {stats['posts']} posts and {stats['comments']} comments "
+              f"in {stats['seconds']:.1f}s ({rate:.0f} posts/sec), {stats['skipped']} skipped",
+              file=sys.stderr)
+        return 1 if stats['skipped'] else 0
+    elif args.command == 'export':
+        import bulk_io
+        count = bulk_io.export_posts(args.path, args.format)
+        print(f"Exported {count} posts", file=sys.stderr)
+    return 0
 
 # Only run this if we're running this file directly
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
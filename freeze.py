@@ -0,0 +1,318 @@
+"""
+Static export ("freeze") of the public site
+Used by: python freeze.py OUTPUT_DIR [--workers N] [--full]
+
+Renders the home page, every page of /blog in each sort order, every post,
+every page of each tag and the about page with the normal templates (as a
+visitor who isn't logged in), and saves each one as OUTPUT_DIR/<path>/index.html,
+so any static file server can serve the site. Static files are copied to
+OUTPUT_DIR/static.
+
+Rebuilds are incremental. Each page gets a fingerprint of everything it
+shows - the post's version and updated_at (see migration 8), the cards on
+it with their comment counts, the page count, the tag list and the
+templates' modification time - and the fingerprints are kept in
+OUTPUT_DIR/.freeze.json. Only pages whose fingerprint changed are rendered
+again, and pages that no longer exist (deleted posts, unused tags) are
+removed. Large rebuilds are rendered by a pool of processes.
+
+Search, login and "load more comments" need the running app.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote, urlencode
+
+import cache
+import database
+from app import (app, static_listing_path, POSTS_PER_PAGE, TAG_POSTS_PER_PAGE,
+                 FEATURED_POSTS, TEMPLATE_VERSION)
+
+# Fingerprints of the exported pages, kept in the output directory
+MANIFEST = '.freeze.json'
+
+# Pages per task handed to a pool process
+CHUNK_SIZE = 200
+
+# Fewer changed pages than this are rendered here: starting the pool costs more
+POOL_THRESHOLD = 500
+
+# Every post's id, sort values and version. The version goes up whenever
+# anything on the post's page or card changes - an edit or a comment (see
+# migration 8) - so "id.version" stands in for the post in fingerprints
+POSTS_QUERY = '''
+    SELECT posts.id, posts.title, posts.created_at, COALESCE(post_stats.version, 0)
+    FROM posts LEFT JOIN post_stats ON post_stats.post_id = posts.id
+'''
+
+# Each tag's posts in tag page order (see database._posts_page_query())
+TAG_POSTS_QUERY = '''
+    SELECT tags.name, post_tags.post_id
+    FROM tags JOIN post_tags ON post_tags.tag_id = tags.id
+    ORDER BY tags.name, post_tags.created_at DESC, post_tags.post_id DESC
+'''
+
+# -----------------------------------------------------------------------------
+# Planning
+# -----------------------------------------------------------------------------
+
+def _digest(text):
+    """Short stable hash of a string (the same in every process and run)"""
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+def _listing_pages(pages, path, post_ids, cards, per_page, sort_by=None, shared=''):
+    """Add every page of a listing (post ids already in display order) to pages"""
+    total_pages = (len(post_ids) + per_page - 1) // per_page
+    prefix = f'{TEMPLATE_VERSION} {shared} {total_pages} '
+    listed = [cards[post_id] for post_id in post_ids]
+    for start in range(0, max(len(post_ids), 1), per_page):
+        number = start // per_page + 1
+        fingerprint = _digest(prefix + ' '.join(listed[start:start + per_page]))
+        # The URL is only worked out if the page has to be rendered (see _page_url())
+        after = post_ids[start - 1] if start else None
+        pages[static_listing_path(path, number, sort_by)] = (fingerprint, (path, number, sort_by, after))
+
+def _page_url(request, sort_values):
+    """The URL to render a page from: a path, or a listing page from _listing_pages()"""
+    if isinstance(request, str):
+        return request
+    path, number, sort_by, after = request
+    args = {'sort': sort_by, 'page': number} if sort_by else {'page': number}
+    if after is not None:
+        # The same cursor the previous page's "Next" link has
+        column = database.SORT_ORDERS[sort_by or 'date_desc'][0]
+        title, created_at = sort_values[after]
+        args['after'] = database.encode_cursor(
+            {'id': after, column: title if column == 'title' else created_at}, sort_by or 'date_desc')
+    return f'{quote(path)}?{urlencode(args)}'
+
+def plan_pages():
+    """Work out every page of the public site
+
+    Returns:
+        tuple: (pages, sort_values) - pages maps each output path (e.g.
+        '/blog/42/') to (fingerprint, what to render it from), and
+        sort_values maps post ids to (title, created_at) for _page_url()
+    """
+    conn = database.get_read_connection()
+    # Plain tuples: much cheaper than sqlite3.Row for a few hundred thousand rows
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    posts = cursor.execute(POSTS_QUERY).fetchall()
+    orders = {}
+    for sort_by, (column, direction) in database.SORT_ORDERS.items():
+        # Straight off the listing indexes, in the order the app shows them
+        cursor.execute(f'SELECT id FROM posts ORDER BY {column} {direction}, id {direction}')
+        orders[sort_by] = [post_id for post_id, in cursor]
+    tag_posts = cursor.execute(TAG_POSTS_QUERY).fetchall()
+    database.release_db_connection(conn)
+    tag_list = _digest(repr(database.get_all_tags()))
+
+    cards = {post_id: f'{post_id}.{version}' for post_id, _, _, version in posts}
+    sort_values = {post_id: (title, created_at) for post_id, title, created_at, _ in posts}
+
+    pages = {}
+    for post_id, card in cards.items():
+        pages[f'/blog/{post_id}/'] = (f'{TEMPLATE_VERSION} {card}', f'/blog/{post_id}')
+
+    for sort_by, post_ids in orders.items():
+        _listing_pages(pages, '/blog', post_ids, cards, POSTS_PER_PAGE, sort_by, tag_list)
+    # /blog is the first page of the default order
+    pages['/blog/'] = (pages[static_listing_path('/blog', 1, 'date_desc')][0], '/blog')
+    featured = [cards[post_id] for post_id in orders['date_desc'][:FEATURED_POSTS]]
+    pages['/'] = (' '.join([str(TEMPLATE_VERSION)] + featured), '/')
+
+    grouped = {}
+    for name, post_id in tag_posts:
+        grouped.setdefault(name, []).append(post_id)
+    for name, post_ids in grouped.items():
+        # /tag/<tag_name> can't match these, so the app has no page for them either
+        if '/' in name or name.startswith('.'):
+            continue
+        _listing_pages(pages, f'/tag/{name}', post_ids, cards, TAG_POSTS_PER_PAGE)
+
+    pages['/about/'] = (str(TEMPLATE_VERSION), '/about')
+    return pages, sort_values
+
+# -----------------------------------------------------------------------------
+# Rendering
+# -----------------------------------------------------------------------------
+
+# Test client of the process doing the rendering (see _start_renderer())
+_client = None
+
+def _start_renderer(database_path):
+    """Set a process up to render pages: same database, static links, no page cache"""
+    global _client
+    database.DATABASE = database_path
+    cache.ENABLED = False
+    app.config['STATIC_LINKS'] = True
+    _client = app.test_client()
+
+def _output_file(output, path):
+    """File a page is saved to, e.g. OUTPUT/blog/42/index.html"""
+    return os.path.join(output, path.strip('/'), 'index.html')
+
+def _render(output, jobs):
+    """Render (path, url) jobs into output
+
+    Returns:
+        list: (path, status code) for each page that didn't render
+    """
+    failed = []
+    for path, url in jobs:
+        response = _client.get(url)
+        if response.status_code != 200:
+            failed.append((path, response.status_code))
+            continue
+        filename = _output_file(output, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write then rename, so the file server never sends half a page
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(response.data)
+        os.replace(filename + '.tmp', filename)
+    return failed
+
+def _render_here(output, jobs):
+    """Render jobs in this process, putting the app settings back afterwards"""
+    saved = (database.DATABASE, cache.ENABLED, app.config['STATIC_LINKS'])
+    try:
+        _start_renderer(database.DATABASE)
+        return _render(output, jobs)
+    finally:
+        database.DATABASE, cache.ENABLED, app.config['STATIC_LINKS'] = saved
+
+def _render_in_pool(output, jobs, workers):
+    """Render jobs CHUNK_SIZE at a time across a pool of processes"""
+    # spawn, not fork: a forked child would share the parent's open SQLite connections
+    context = multiprocessing.get_context('spawn')
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_start_renderer, initargs=(database.DATABASE,)) as pool:
+        chunks = [jobs[i:i + CHUNK_SIZE] for i in range(0, len(jobs), CHUNK_SIZE)]
+        for result in pool.map(_render, [output] * len(chunks), chunks):
+            failed.extend(result)
+    return failed
+
+def _copy_static(output):
+    """Copy new or changed static files into output/static, return how many were copied"""
+    copied = 0
+    for root, _, files in os.walk(app.static_folder):
+        target_dir = os.path.join(output, 'static', os.path.relpath(root, app.static_folder))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_dir, name)
+            stat = os.stat(source)
+            if os.path.exists(target):
+                existing = os.stat(target)
+                if existing.st_size == stat.st_size and int(existing.st_mtime) == int(stat.st_mtime):
+                    continue
+            shutil.copy2(source, target)
+            copied += 1
+    return copied
+
+# -----------------------------------------------------------------------------
+# Freeze
+# -----------------------------------------------------------------------------
+
+def _site_version():
+    """Changes whenever any post, comment or template changes (see database.get_site_version())"""
+    version, changed_at = database.get_site_version()
+    return f'{version} {changed_at} {TEMPLATE_VERSION}'
+
+def _read_manifest(output):
+    """The site version and page fingerprints of the last export to output"""
+    try:
+        with open(os.path.join(output, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest['site'], manifest['pages']
+    except (OSError, ValueError, KeyError):
+        return None, {}
+
+def _write_manifest(output, site, pages):
+    """Save the site version and the fingerprints of the exported pages"""
+    filename = os.path.join(output, MANIFEST)
+    with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        # dumps() rather than dump(): it uses the much faster C encoder
+        f.write(json.dumps({'site': site, 'pages': pages}, ensure_ascii=False))
+    os.replace(filename + '.tmp', filename)
+
+def freeze(output, workers=None, full=False):
+    """Export the public site to output, rendering only the pages that changed
+
+    Args:
+        output: Directory to write the site to (created if missing)
+        workers: Processes for large rebuilds (default: one per CPU)
+        full: Render every page, ignoring the last export's fingerprints
+
+    Returns:
+        dict: rendered, unchanged, removed, failed and static counts, and seconds taken
+    """
+    start = time.perf_counter()
+    os.makedirs(output, exist_ok=True)
+    site = _site_version()
+    old_site, old = (None, {}) if full else _read_manifest(output)
+    if site == old_site:
+        # Nothing was written since the last export
+        return {'rendered': 0, 'unchanged': len(old), 'removed': 0, 'failed': [],
+                'static': _copy_static(output), 'seconds': time.perf_counter() - start}
+    pages, sort_values = plan_pages()
+
+    jobs = [(path, _page_url(request, sort_values))
+            for path, (fingerprint, request) in pages.items() if old.get(path) != fingerprint]
+    if len(jobs) < POOL_THRESHOLD or workers == 1:
+        failed = _render_here(output, jobs)
+    else:
+        failed = _render_in_pool(output, jobs, workers or os.cpu_count())
+
+    # Deepest first, so /tag/x/2/ is gone before /tag/x/ tries to remove its directory
+    removed = sorted((path for path in old if path not in pages), reverse=True)
+    for path in removed:
+        filename = _output_file(output, path)
+        if os.path.exists(filename):
+            os.remove(filename)
+        try:
+            os.rmdir(os.path.dirname(filename))
+        except OSError:
+            pass   # Not empty (e.g. /blog/ holds other pages)
+
+    # Failed pages are left out of the manifest so the next run tries them again
+    failed_paths = {path for path, _ in failed}
+    _write_manifest(output, None if failed else site,
+                    {path: fingerprint for path, (fingerprint, _) in pages.items() if path not in failed_paths})
+
+    return {
+        'rendered': len(jobs) - len(failed),
+        'unchanged': len(pages) - len(jobs),
+        'removed': len(removed),
+        'failed': failed,
+        'static': _copy_static(output),
+        'seconds': time.perf_counter() - start,
+    }
+
+def main(argv=None):
+    """Export the public site as static files (python freeze.py --help)"""
+    parser = argparse.ArgumentParser(description='Export the blog as a static site')
+    parser.add_argument('output', help='Directory to write the site to')
+    parser.add_argument('--workers', type=int, help='Render processes for large rebuilds (default: one per CPU)')
+    parser.add_argument('--full', action='store_true', help='Render every page, not just the changed ones')
+    args = parser.parse_args(argv)
+
+    stats = freeze(args.output, workers=args.workers, full=args.full)
+    for path, status in stats['failed']:
+        print(f'{path}: HTTP {status}', file=sys.stderr)
+    print(f"Rendered {stats['rendered']} pages in {stats['seconds']:.1f}s "
+          f"({stats['unchanged']} unchanged, {stats['removed']} removed, "
+          f"{len(stats['failed'])} failed, {stats['static']} static files copied)", file=sys.stderr)
+    return 1 if stats['failed'] else 0
+
+# Only run this if we're running this file directly
+if __name__ == '__main__':
+    raise SystemExit(main())
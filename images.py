@@ -0,0 +1,179 @@
+"""
+Resized copies of uploaded images
+Used by app.py: save_uploaded_file() hands each upload to schedule(), and the
+templates show the copies through the responsive_image macro
+
+Each upload is decoded once, on a background thread, and written again at
+every width in WIDTHS (no wider than the original) as WebP and as a fallback
+format (JPEG, or PNG for images with transparency). The copies carry no
+metadata: EXIF orientation is applied to the pixels and the rest is dropped.
+They are recorded in the image_variants table (see
+database.record_image_variants()), and pages then send them with srcset and
+sizes, so a card loads a thumbnail instead of the original.
+
+Needs the Pillow package; without it uploads are only stored as they are.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+import database
+
+# Widths (in pixels) of the copies made of each upload
+WIDTHS = tuple(int(width) for width in os.getenv('BLOG_IMAGE_WIDTHS', '320,640,1280').split(','))
+
+# Encoder quality for the WebP and JPEG copies (1-100)
+QUALITY = int(os.getenv('BLOG_IMAGE_QUALITY', '80'))
+
+# File extension for each format
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+
+# One thread is enough: uploads are rare, and resizing is CPU-bound anyway
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='blog-images')
+
+
+def available():
+    """Check whether copies can be made (Pillow is installed)"""
+    return Image is not None
+
+
+class Variants:
+    """The srcset values for one image's copies, as used by the responsive_image macro"""
+
+    __slots__ = ('webp_srcset', 'srcset', 'src')
+
+    def __init__(self, webp_srcset, srcset, src):
+        self.webp_srcset = webp_srcset
+        self.srcset = srcset
+        self.src = src
+
+
+def srcsets(rows):
+    """Turn (width, format, url) rows from database.get_image_variants() into Variants
+
+    Returns:
+        Variants: or None if the image has no copies (yet)
+    """
+    webp = [f'{url} {width}w' for width, fmt, url in rows if fmt == 'webp']
+    fallback = [(width, url) for width, fmt, url in rows if fmt != 'webp']
+    if not webp or not fallback:
+        return None
+    # Browsers that ignore srcset get the largest copy
+    return Variants(', '.join(webp), ', '.join(f'{url} {width}w' for width, url in fallback), fallback[-1][1])
+
+
+def parse_variants(text):
+    """Turn a post record's image_variants column into Variants (see database.IMAGE_VARIANTS_COLUMN)
+
+    Returns:
+        Variants: or None if the post's image has no copies
+    """
+    if not text:
+        return None
+    rows = (line.split(' ', 2) for line in text.split('\n'))
+    # group_concat() doesn't promise an order, so sort by format, then smallest first
+    return srcsets(sorted(((int(width), fmt, url) for width, fmt, url in rows), key=lambda row: (row[1], row[0])))
+
+# -----------------------------------------------------------------------------
+# Processing
+# -----------------------------------------------------------------------------
+
+def _copy_path(path, width, fmt):
+    """Where the copy of an upload is written, e.g. uploads/abc-640.webp"""
+    return f'{os.path.splitext(path)[0]}-{width}.{EXTENSIONS[fmt]}'
+
+def _save(image, filename, fmt):
+    """Encode one copy, writing it under a temporary name first"""
+    tmp = filename + '.tmp'
+    if fmt == 'webp':
+        image.save(tmp, 'WEBP', quality=QUALITY, method=4)
+    elif fmt == 'jpeg':
+        image.save(tmp, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(tmp, 'PNG', optimize=True)
+    os.replace(tmp, filename)
+
+def make_variants(path, url):
+    """Write the resized copies of an upload next to it
+
+    Returns:
+        list: (width, format, url) for each copy written - empty for images
+        that are kept as they are (animated GIFs)
+    """
+    with Image.open(path) as original:
+        if getattr(original, 'is_animated', False):
+            return []
+        # Turn the pixels the way the EXIF orientation says, since EXIF is dropped
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    fallback = 'png' if has_alpha else 'jpeg'
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # Never enlarge: widths past the original become one copy at its own width
+    widths = sorted({min(width, image.width) for width in WIDTHS})
+    variants = []
+    # Largest first, each copy resized from the one before, so the original is decoded once
+    for width in reversed(widths):
+        if width != image.width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for fmt in ('webp', fallback):
+            filename = _copy_path(path, width, fmt)
+            _save(image, filename, fmt)
+            variants.append((width, fmt, _copy_path(url, width, fmt)))
+    return variants
+
+def process_upload(path, url):
+    """Make and record the copies of one upload (runs on the background thread)
+
+    Returns:
+        list: (width, format, url) for each copy recorded
+    """
+    try:
+        variants = make_variants(path, url)
+    except Exception as e:
+        print(f"Error resizing image {url}: {e}")
+        return []
+    if not database.record_image_variants(url, variants):
+        # No post kept the upload, and it was removed while the copies were made
+        remove_files(os.path.dirname(path), [variant_url for _, _, variant_url in variants])
+        return []
+    return variants
+
+def schedule(path, url):
+    """Make the copies of an upload in the background
+
+    Returns:
+        Future: resolves to process_upload()'s result, or None without Pillow
+    """
+    if not available():
+        return None
+    return _executor.submit(process_upload, path, url)
+
+# -----------------------------------------------------------------------------
+# Cleanup
+# -----------------------------------------------------------------------------
+
+def remove_files(folder, urls):
+    """Delete the files in folder named by the last part of each URL"""
+    for url in urls:
+        filepath = os.path.join(folder, url.split('/')[-1])
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting image file: {e}")
+
+def collect_unused(folder):
+    """Delete the uploads no post uses any more, and their copies (see database.collect_unused_uploads())
+
+    Returns:
+        list: URLs of the uploads deleted
+    """
+    return database.collect_unused_uploads(lambda urls: remove_files(folder, urls))
@@ -0,0 +1,497 @@
+"""
+Versioned schema migrations for the blog database
+Each migration runs once, in order, and is recorded in the schema_version table
+"""
+import os
+import sqlite3
+
+import compression
+import rendering
+
+# Baseline schema (migration 1), found next to this module
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def _statements(script):
+    """Split a SQL script into single statements (trigger bodies stay whole)"""
+    statements = []
+    current = ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    if current.strip() and not current.strip().startswith('--'):
+        statements.append(current.strip())
+    return statements
+
+
+def _run_script(conn, script):
+    """Run each statement of a script inside the current transaction
+
+    Unlike executescript(), this does not commit, so a migration either
+    applies completely or not at all.
+    """
+    for statement in _statements(script):
+        conn.execute(statement)
+
+
+def _split_tags(tags):
+    """Split a comma-joined tag string into unique tag names"""
+    names = []
+    seen = set()
+    for name in (tags or '').split(','):
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+
+# -----------------------------------------------------------------------------
+# Migrations
+# -----------------------------------------------------------------------------
+
+def migration_001_base_tables(conn):
+    """Create the posts and comments tables from schema.sql"""
+    with open(SCHEMA_FILE, 'r') as f:
+        _run_script(conn, f.read())
+
+
+def migration_002_tags(conn):
+    """Create the tags and post_tags tables and fill them from posts.tags"""
+    _run_script(conn, '''
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            post_count INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS post_tags (
+            tag_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, post_id),
+            FOREIGN KEY (tag_id) REFERENCES tags (id) ON DELETE CASCADE,
+            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags (post_id);
+
+        CREATE TRIGGER IF NOT EXISTS post_tags_count_insert AFTER INSERT ON post_tags
+        BEGIN
+            UPDATE tags SET post_count = post_count + 1 WHERE id = new.tag_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS post_tags_count_delete AFTER DELETE ON post_tags
+        BEGIN
+            UPDATE tags SET post_count = post_count - 1 WHERE id = old.tag_id;
+        END;
+
+        -- Foreign keys are not enforced, so clean up tag links when a post goes
+        CREATE TRIGGER IF NOT EXISTS posts_delete_tags AFTER DELETE ON posts
+        BEGIN
+            DELETE FROM post_tags WHERE post_id = old.id;
+        END;
+    ''')
+
+    # Databases that already have links (from before migrations existed) are left alone
+    if conn.execute('SELECT 1 FROM post_tags LIMIT 1').fetchone():
+        return
+    posts = conn.execute('SELECT id, tags FROM posts WHERE tags IS NOT NULL AND tags != ""').fetchall()
+    for post_id, tags in posts:
+        for name in _split_tags(tags):
+            conn.execute('INSERT OR IGNORE INTO tags (name) VALUES (?)', (name,))
+            conn.execute(
+                'INSERT INTO post_tags (tag_id, post_id) SELECT id, ? FROM tags WHERE name = ?',
+                (post_id, name)
+            )
+
+
+def migration_003_listing_indexes(conn):
+    """Add the indexes the listing, tag and comment queries sort by"""
+    _run_script(conn, '''
+        -- Date sorts (both directions) and keyset pagination on (created_at, id)
+        CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at, id);
+
+        -- Title sorts and keyset pagination on (title, id)
+        CREATE INDEX IF NOT EXISTS idx_posts_title ON posts (title, id);
+
+        -- Comments for one post, newest first
+        CREATE INDEX IF NOT EXISTS idx_comments_post_date ON comments (post_id, date, id);
+
+        -- Copy each post's created_at into its tag links so a tag's posts can be
+        -- read newest first straight from one index
+        ALTER TABLE post_tags ADD COLUMN created_at DATETIME;
+        UPDATE post_tags SET created_at = (SELECT created_at FROM posts WHERE posts.id = post_tags.post_id);
+        CREATE INDEX IF NOT EXISTS idx_post_tags_tag_created ON post_tags (tag_id, created_at, post_id);
+    ''')
+
+
+def migration_004_search(conn):
+    """Add the posts_fts full-text index over title, excerpt, content and tags"""
+    _run_script(conn, '''
+        -- External content table: the text lives in posts, FTS only keeps the index
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            title, excerpt, content, tags,
+            content = 'posts',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts
+        BEGIN
+            INSERT INTO posts_fts (rowid, title, excerpt, content, tags)
+            VALUES (new.id, new.title, new.excerpt, new.content, new.tags);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, excerpt, content, tags)
+            VALUES ('delete', old.id, old.title, old.excerpt, old.content, old.tags);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, excerpt, content, tags ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, excerpt, content, tags)
+            VALUES ('delete', old.id, old.title, old.excerpt, old.content, old.tags);
+            INSERT INTO posts_fts (rowid, title, excerpt, content, tags)
+            VALUES (new.id, new.title, new.excerpt, new.content, new.tags);
+        END;
+
+        -- Rank by bm25, weighting matches in title, excerpt, content and tags.
+        -- ORDER BY rank is then answered by FTS5 itself, without a sort step
+        INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 3.0)');
+
+        -- Index the posts that already exist
+        INSERT INTO posts_fts (posts_fts) VALUES ('rebuild');
+    ''')
+
+
+def migration_005_summary_indexes(conn):
+    """Make the listing indexes cover every column a post card or the tag list shows"""
+    _run_script(conn, '''
+        -- Listing queries read only these columns, so they are answered from
+        -- the index and never touch the table rows with their large content
+        CREATE INDEX IF NOT EXISTS idx_posts_created_summary
+            ON posts (created_at, id, title, excerpt, image_url, tags, updated_at);
+        CREATE INDEX IF NOT EXISTS idx_posts_title_summary
+            ON posts (title, id, excerpt, image_url, tags, created_at, updated_at);
+
+        -- Tag list: only tags in use, already in name order
+        CREATE INDEX IF NOT EXISTS idx_tags_in_use ON tags (name, post_count) WHERE post_count > 0;
+
+        -- Same leading columns as above, so no longer needed
+        DROP INDEX IF EXISTS idx_posts_created;
+        DROP INDEX IF EXISTS idx_posts_title;
+    ''')
+
+
+def migration_006_counters(conn):
+    """Add trigger-maintained post/comment totals and per-post comment counts"""
+    _run_script(conn, '''
+        -- Site-wide totals ('posts', 'comments')
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        -- One row per post
+        CREATE TABLE IF NOT EXISTS post_stats (
+            post_id INTEGER PRIMARY KEY,
+            comment_count INTEGER NOT NULL DEFAULT 0
+        );
+
+        INSERT OR REPLACE INTO counters (name, value) VALUES
+            ('posts', (SELECT COUNT(*) FROM posts)),
+            ('comments', (SELECT COUNT(*) FROM comments));
+        INSERT OR REPLACE INTO post_stats (post_id, comment_count)
+            SELECT id, (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id) FROM posts;
+
+        CREATE TRIGGER IF NOT EXISTS posts_counters_insert AFTER INSERT ON posts
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'posts';
+            INSERT OR IGNORE INTO post_stats (post_id) VALUES (new.id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_counters_delete AFTER DELETE ON posts
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'posts';
+            DELETE FROM post_stats WHERE post_id = old.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS comments_counters_insert AFTER INSERT ON comments
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'comments';
+            UPDATE post_stats SET comment_count = comment_count + 1 WHERE post_id = new.post_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS comments_counters_delete AFTER DELETE ON comments
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'comments';
+            UPDATE post_stats SET comment_count = comment_count - 1 WHERE post_id = old.post_id;
+        END;
+    ''')
+
+
+def migration_007_compress_content(conn):
+    """Compress long post bodies and index them through a decompressing view"""
+    compression.register(conn)
+    _run_script(conn, '''
+        -- The old index reads posts.content directly, which is about to hold BLOBs
+        DROP TRIGGER IF EXISTS posts_fts_insert;
+        DROP TRIGGER IF EXISTS posts_fts_delete;
+        DROP TRIGGER IF EXISTS posts_fts_update;
+        DROP TABLE IF EXISTS posts_fts;
+    ''')
+
+    # Compress existing bodies a batch at a time, so the whole table is never in memory
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, content FROM posts WHERE id > ? AND typeof(content) = 'text' ORDER BY id LIMIT 500",
+            (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE posts SET content = ? WHERE id = ?',
+            [(compression.compress(content), post_id) for post_id, content in rows]
+        )
+        last_id = rows[-1][0]
+
+    _run_script(conn, '''
+        -- Posts as the full-text index sees them: with the body as text
+        CREATE VIEW IF NOT EXISTS posts_fts_source AS
+            SELECT id, title, excerpt, decompress(content) AS content, tags FROM posts;
+
+        CREATE VIRTUAL TABLE posts_fts USING fts5(
+            title, excerpt, content, tags,
+            content = 'posts_fts_source',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER posts_fts_insert AFTER INSERT ON posts
+        BEGIN
+            INSERT INTO posts_fts (rowid, title, excerpt, content, tags)
+            VALUES (new.id, new.title, new.excerpt, decompress(new.content), new.tags);
+        END;
+
+        CREATE TRIGGER posts_fts_delete AFTER DELETE ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, excerpt, content, tags)
+            VALUES ('delete', old.id, old.title, old.excerpt, decompress(old.content), old.tags);
+        END;
+
+        CREATE TRIGGER posts_fts_update AFTER UPDATE OF title, excerpt, content, tags ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, excerpt, content, tags)
+            VALUES ('delete', old.id, old.title, old.excerpt, decompress(old.content), old.tags);
+            INSERT INTO posts_fts (rowid, title, excerpt, content, tags)
+            VALUES (new.id, new.title, new.excerpt, decompress(new.content), new.tags);
+        END;
+
+        INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 3.0)');
+        INSERT INTO posts_fts (posts_fts) VALUES ('rebuild');
+    ''')
+
+
+def migration_008_change_watermarks(conn):
+    """Add trigger-maintained versions and change times for the site and each post"""
+    _run_script(conn, '''
+        -- 'version' goes up on every post or comment change (deletes too) and
+        -- 'changed_at' is when that last happened, in unix seconds
+        INSERT OR REPLACE INTO counters (name, value) VALUES
+            ('version', 0),
+            ('changed_at', COALESCE((SELECT CAST(strftime('%s', MAX(updated_at)) AS INTEGER) FROM posts), 0));
+
+        -- The same for one post: its own edits and its comments
+        ALTER TABLE post_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE post_stats ADD COLUMN changed_at INTEGER;
+
+        CREATE TRIGGER IF NOT EXISTS posts_version_insert AFTER INSERT ON posts
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'version';
+            UPDATE counters SET value = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'changed_at';
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_version_update AFTER UPDATE ON posts
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'version';
+            UPDATE counters SET value = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'changed_at';
+            UPDATE post_stats SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE post_id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_version_delete AFTER DELETE ON posts
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'version';
+            UPDATE counters SET value = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'changed_at';
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS comments_version_insert AFTER INSERT ON comments
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'version';
+            UPDATE counters SET value = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'changed_at';
+            UPDATE post_stats SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE post_id = new.post_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS comments_version_delete AFTER DELETE ON comments
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'version';
+            UPDATE counters SET value = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'changed_at';
+            UPDATE post_stats SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE post_id = old.post_id;
+        END;
+    ''')
+
+
+def migration_009_rendered_posts(conn):
+    """Store each post's rendered HTML, table of contents, reading time and display date"""
+    _run_script(conn, '''
+        -- Filled in by rendering.render_post() whenever a post is saved
+        ALTER TABLE posts ADD COLUMN content_html;
+        ALTER TABLE posts ADD COLUMN toc_html TEXT NOT NULL DEFAULT '';
+        ALTER TABLE posts ADD COLUMN reading_time INTEGER NOT NULL DEFAULT 1;
+        ALTER TABLE posts ADD COLUMN created_display TEXT;
+
+        -- Cards show the display date, so the covering indexes need it too
+        DROP INDEX IF EXISTS idx_posts_created_summary;
+        DROP INDEX IF EXISTS idx_posts_title_summary;
+        CREATE INDEX idx_posts_created_summary
+            ON posts (created_at, id, title, excerpt, image_url, tags, updated_at, created_display);
+        CREATE INDEX idx_posts_title_summary
+            ON posts (title, id, excerpt, image_url, tags, created_at, updated_at, created_display);
+    ''')
+    rendering.rerender_posts(conn)
+
+
+def migration_010_image_variants(conn):
+    """Record the resized copies made of each uploaded image (see images.py)"""
+    _run_script(conn, '''
+        CREATE TABLE IF NOT EXISTS image_variants (
+            image_url TEXT NOT NULL,      -- The original upload, as stored in posts.image_url
+            format TEXT NOT NULL,         -- 'webp', or the fallback 'jpeg' / 'png'
+            width INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            PRIMARY KEY (image_url, format, width)
+        ) WITHOUT ROWID;
+    ''')
+
+
+def migration_011_uploads(conn):
+    """Track uploaded files by content hash, with trigger-maintained reference counts"""
+    _run_script(conn, '''
+        CREATE TABLE IF NOT EXISTS uploads (
+            url TEXT PRIMARY KEY,          -- As stored in posts.image_url
+            sha256 TEXT,                   -- NULL for files uploaded before this migration
+            size INTEGER,
+            refs INTEGER NOT NULL DEFAULT 0,   -- Posts using the file
+            uploaded_at INTEGER NOT NULL DEFAULT 0   -- Unix seconds of the last upload of this content
+        ) WITHOUT ROWID;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256);
+        -- Only unused files are ever looked for by age
+        CREATE INDEX IF NOT EXISTS idx_uploads_unused ON uploads (uploaded_at) WHERE refs = 0;
+
+        -- Files already uploaded keep their names
+        INSERT OR IGNORE INTO uploads (url, refs)
+            SELECT image_url, COUNT(*) FROM posts
+            WHERE image_url LIKE '/static/uploads/%'
+            GROUP BY image_url;
+
+        -- Links to other sites have no uploads row, so these change nothing for them
+        CREATE TRIGGER IF NOT EXISTS posts_uploads_insert AFTER INSERT ON posts
+        WHEN new.image_url IS NOT NULL
+        BEGIN
+            UPDATE uploads SET refs = refs + 1 WHERE url = new.image_url;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_uploads_update AFTER UPDATE OF image_url ON posts
+        WHEN old.image_url IS NOT new.image_url
+        BEGIN
+            UPDATE uploads SET refs = refs - 1 WHERE url = old.image_url;
+            UPDATE uploads SET refs = refs + 1 WHERE url = new.image_url;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_uploads_delete AFTER DELETE ON posts
+        WHEN old.image_url IS NOT NULL
+        BEGIN
+            UPDATE uploads SET refs = refs - 1 WHERE url = old.image_url;
+        END;
+    ''')
+
+
+# (version, description, function) - append new migrations to the end, never reorder
+MIGRATIONS = [
+    (1, 'Create posts and comments tables', migration_001_base_tables),
+    (2, 'Add tags and post_tags tables', migration_002_tags),
+    (3, 'Add listing, tag and comment indexes', migration_003_listing_indexes),
+    (4, 'Add posts_fts full-text search index', migration_004_search),
+    (5, 'Add covering indexes for listing cards', migration_005_summary_indexes),
+    (6, 'Add trigger-maintained counters', migration_006_counters),
+    (7, 'Compress long post content', migration_007_compress_content),
+    (8, 'Add change watermarks for conditional GET', migration_008_change_watermarks),
+    (9, 'Store rendered post HTML and display dates', migration_009_rendered_posts),
+    (10, 'Add image_variants table', migration_010_image_variants),
+    (11, 'Add reference-counted uploads table', migration_011_uploads),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# -----------------------------------------------------------------------------
+# Runner
+# -----------------------------------------------------------------------------
+
+def current_version(conn):
+    """Get the newest migration applied to a database (0 if none)"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        # No schema_version table yet
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Apply every migration the database doesn't have yet
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction, so two
+    processes starting at once can't apply the same migration twice.
+
+    Returns:
+        list: Versions that were applied
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    conn.commit()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Check again now that we hold the write lock
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,439 @@
+"""
+Pre-rendered public pages, kept on disk and served ahead of Flask
+Used by app.py (see "Pre-rendered Pages" there) and asgi.py
+
+Every public page sent to a visitor who isn't logged in is also written to
+DIRECTORY, one file per page. PrerenderMiddleware wraps the Flask WSGI app
+and sends those files byte for byte before Flask routes the request: no
+database access and no template rendering.
+
+Each page remembers the database keys it was built from (see
+database.add_write_listener()), like the page cache. A write marks the pages
+that used what it changed as stale and queues them for a background thread,
+which renders them again. Until then the stale copy is still served, for at
+most MAX_STALE seconds; after that requests go to Flask again. Pages that
+have no copy yet go to Flask too, and are saved on the way out.
+
+Which page uses which keys is only known to this process, so each server
+process writes its pages to its own folder in DIRECTORY (named after its
+process id) and empties that folder on start. The folder is bounded like the
+page cache: past MAX_PAGES pages or MAX_BYTES, the least recently used pages
+are deleted.
+
+Turn it on with BLOG_PRERENDER=1.
+"""
+import hashlib
+import io
+import os
+import queue
+import re
+import threading
+import time
+import sys
+from collections import OrderedDict
+from urllib.parse import parse_qsl, quote, unquote, urlencode
+
+from werkzeug.http import is_resource_modified, parse_date, unquote_etag
+from werkzeug.wsgi import wrap_file
+
+ENABLED = os.getenv('BLOG_PRERENDER', '0') == '1'
+
+# Where the pages are written (each process uses a folder of its own in here)
+DIRECTORY = os.getenv('BLOG_PRERENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prerendered'))
+
+# Longest time (seconds) a stale page is still served while it is rendered again
+MAX_STALE = float(os.getenv('BLOG_PRERENDER_MAX_STALE', '30'))
+
+# Most pages (and total size, in MB) each process keeps on disk
+MAX_PAGES = int(os.getenv('BLOG_PRERENDER_MAX_PAGES', '2000'))
+MAX_BYTES = int(float(os.getenv('BLOG_PRERENDER_MB', '64')) * 1024 * 1024)
+
+# Keys in the WSGI environ:
+#   REFRESH - set on the refresh thread's own requests, which always go to Flask
+#   SAVE    - set by app.py to the page's database keys when it may be saved
+#   STARTED - the store's clock when Flask started rendering the page
+REFRESH = 'blog.prerender.refresh'
+SAVE = 'blog.prerender.save'
+STARTED = 'blog.prerender.started'
+
+# Headers that only describe one response and are never saved
+UNSAVED_HEADERS = {'content-length', 'set-cookie', 'x-cache', 'x-prerendered',
+                   'x-query-count', 'x-query-time-ms'}
+
+# Names of the files this module writes (anything else in DIRECTORY is left alone)
+PAGE_FILE = re.compile(r'^[0-9a-f]{40}-\d+\.html$')
+
+# Bytes read per chunk when a server has no wsgi.file_wrapper
+BLOCK_SIZE = 64 * 1024
+
+
+def page_url(path, args, names):
+    """The URL a page is saved under: its path and the query parameters in names"""
+    query = urlencode([(name, args[name]) for name in names if name in args])
+    return f'{quote(path)}?{query}'
+
+
+def refresh_environ(url):
+    """A WSGI environ for the refresh thread's GET request for a page URL"""
+    path, _, query = url.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        # PEP 3333 wants the decoded path as latin-1 characters
+        'PATH_INFO': unquote(path).encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        REFRESH: True,
+    }
+
+
+class PrerenderedPage:
+    """A page saved on disk, with the headers it is sent with"""
+
+    __slots__ = ('url', 'filename', 'headers', 'keys', 'size', 'etag', 'last_modified')
+
+    def __init__(self, url, filename, headers, keys, size):
+        self.url = url
+        self.filename = filename
+        self.headers = headers
+        self.keys = frozenset(keys)
+        self.size = size
+        self.etag = None
+        self.last_modified = None
+        for name, value in headers:
+            if name.lower() == 'etag':
+                self.etag = unquote_etag(value)[0]
+            elif name.lower() == 'last-modified':
+                self.last_modified = parse_date(value)
+
+
+class PrerenderStore:
+    """Index of the pages saved in a directory, and the thread that refreshes them"""
+
+    def __init__(self, args=(), cookie_name='session', directory=DIRECTORY, max_stale=MAX_STALE,
+                 max_pages=MAX_PAGES, max_bytes=MAX_BYTES):
+        self.args = args                 # Query parameters that change what a page shows
+        self.cookie_name = cookie_name   # Visitors sending this cookie always get Flask
+        self.directory = directory
+        self.path = None                 # This process's folder, made by the first save
+        self.max_stale = max_stale
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        # Called with a page's URL on the refresh thread; it should request
+        # the page with REFRESH set in the environ, which saves it again
+        self.render = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.refreshes = 0
+        self.evictions = 0        # Pages deleted to stay under max_pages / max_bytes
+        self.size = 0             # Bytes of all the pages in _pages
+        self._pages = OrderedDict()   # url -> PrerenderedPage, least recently used first
+        self._by_key = {}         # database key -> urls of pages that used it
+        self._stale = {}          # url -> time.monotonic() when it went stale
+        self._versions = 0        # Numbers new files, so a file is never rewritten in place
+        # Bumped by every invalidate(); a page is only saved if none of its
+        # keys changed while it was being rendered
+        self._clock = 0
+        self._changed_at = {}     # database key -> clock of its last change
+        self._cleared_at = 0
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._thread = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # Serving
+    # -------------------------------------------------------------------------
+
+    def request_url(self, environ):
+        """The page URL for a WSGI request"""
+        # PEP 3333 passes the path as latin-1; Flask decodes it as UTF-8
+        path = environ.get('PATH_INFO', '').encode('latin-1').decode('utf-8', 'replace')
+        args = {}
+        for name, value in parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True):
+            args.setdefault(name, value)   # Flask's request.args[name] is the first value
+        return page_url('/' + path.lstrip('/'), args, self.args)
+
+    def find(self, environ):
+        """Look up the saved page for a request
+
+        On a miss, notes the store's clock in the environ so save() can tell
+        whether a write happened while Flask rendered the page.
+
+        Returns:
+            tuple: (page, stale), or None if Flask should handle the request
+        """
+        if not ENABLED or environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return None
+        # The refresh thread's requests, and visitors with a session (logged
+        # in, or a flash message waiting) are always rendered by Flask
+        if environ.get(REFRESH) or self.cookie_name + '=' in environ.get('HTTP_COOKIE', ''):
+            environ[STARTED] = self._clock
+            return None
+        url = self.request_url(environ)
+        with self._lock:
+            page = self._pages.get(url)
+            stale_since = self._stale.get(url)
+            if page is None or (stale_since is not None and time.monotonic() - stale_since > self.max_stale):
+                self.misses += 1
+                environ[STARTED] = self._clock
+                return None
+            self._pages.move_to_end(url)
+            if stale_since is None:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+        return page, stale_since is not None
+
+    def response(self, environ, page, stale):
+        """Build the response for a saved page
+
+        Returns:
+            tuple: (status, headers, file) - file is the open page, or None for
+            HEAD requests and 304s; None instead of the tuple if the file has
+            just been replaced (the request should then go to Flask)
+        """
+        headers = page.headers + [('X-Prerendered', 'STALE' if stale else 'HIT')]
+        # A stale copy is never confirmed as current
+        if not stale and (page.etag or page.last_modified) and not is_resource_modified(
+                environ, etag=page.etag, last_modified=page.last_modified):
+            return 304, [(name, value) for name, value in headers
+                         if name.lower() not in ('content-type', 'content-encoding')], None
+        headers.append(('Content-Length', str(page.size)))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return 200, headers, None
+        try:
+            return 200, headers, open(page.filename, 'rb')
+        except FileNotFoundError:
+            return None
+
+    # -------------------------------------------------------------------------
+    # Saving
+    # -------------------------------------------------------------------------
+
+    def save(self, environ, status, headers, body):
+        """Save a page Flask rendered, if app.py marked it as savable
+
+        Returns:
+            bool: True if the page was saved
+        """
+        keys = environ.get(SAVE)
+        started = environ.get(STARTED)
+        if keys is None or started is None or status != 200:
+            return False
+        headers = [(name, value) for name, value in headers if name.lower() not in UNSAVED_HEADERS]
+        url = self.request_url(environ)
+
+        if len(body) > self.max_bytes:
+            return False
+        with self._lock:
+            if not self._current(keys, started):
+                return False
+            self._prepare()
+            self._versions += 1
+            name = f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}-{self._versions}.html"
+        filename = os.path.join(self.path, name)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, filename)
+
+        page = PrerenderedPage(url, filename, headers, keys, len(body))
+        removed = []
+        with self._lock:
+            # A write may have happened while the file was being written
+            if not self._current(keys, started):
+                removed.append(page)
+            else:
+                old = self._drop(url)
+                if old is not None:
+                    removed.append(old)
+                self._pages[url] = page
+                self.size += page.size
+                for key in page.keys:
+                    self._by_key.setdefault(key, set()).add(url)
+                self.saves += 1
+                while len(self._pages) > self.max_pages or self.size > self.max_bytes:
+                    removed.append(self._drop(next(iter(self._pages))))
+                    self.evictions += 1
+        for old in removed:
+            self._remove_file(old.filename)
+        return page not in removed
+
+    def _current(self, keys, started):
+        """Check that none of keys changed since the clock read started (call with _lock held)"""
+        if started < self._cleared_at:
+            return False
+        return not any(self._changed_at.get(key, -1) > started for key in keys)
+
+    def _prepare(self):
+        """Create this process's folder and remove pages left in it by an earlier run (call with _lock held)"""
+        if self._ready:
+            return
+        # Only this process's folder: other workers sharing DIRECTORY keep their pages
+        self.path = os.path.join(self.directory, str(os.getpid()))
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            if PAGE_FILE.match(name) or (name.endswith('.tmp') and PAGE_FILE.match(name[:-4])):
+                self._remove_file(os.path.join(self.path, name))
+        self._ready = True
+
+    def _drop(self, url):
+        """Take one page out of the index and return it (call with _lock held)"""
+        page = self._pages.pop(url, None)
+        self._stale.pop(url, None)
+        if page is None:
+            return None
+        self.size -= page.size
+        for key in page.keys:
+            urls = self._by_key.get(key)
+            if urls is not None:
+                urls.discard(url)
+                if not urls:
+                    del self._by_key[key]
+        return page
+
+    @staticmethod
+    def _remove_file(filename):
+        """Delete a page file (a request may still be sending it, which is fine on POSIX)"""
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    # -------------------------------------------------------------------------
+    # Invalidation and refresh
+    # -------------------------------------------------------------------------
+
+    def invalidate(self, keys):
+        """Mark every page built from any of these database keys as stale (a write listener)"""
+        now = time.monotonic()
+        queued = []
+        with self._lock:
+            self._clock += 1
+            for key in keys:
+                self._changed_at[key] = self._clock
+                for url in self._by_key.get(key, ()):
+                    self._stale.setdefault(url, now)
+                    # Without a renderer the page just expires after max_stale
+                    if self.render is not None and url not in self._queued:
+                        self._queued.add(url)
+                        queued.append(url)
+            if queued and self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, name='blog-prerender', daemon=True)
+                self._thread.start()
+        for url in queued:
+            self._queue.put(url)
+
+    def _refresh_loop(self):
+        """Render stale pages again, one at a time (runs on the refresh thread)"""
+        while True:
+            url = self._queue.get()
+            try:
+                with self._lock:
+                    self._queued.discard(url)
+                    wanted = url in self._stale
+                if wanted:
+                    try:
+                        self.render(url)
+                    except Exception:
+                        pass   # The page is dropped below and Flask renders it on the next request
+                    with self._lock:
+                        self.refreshes += 1
+                        # Not saved again (an error, a deleted post, or another
+                        # write while rendering): stop serving the old copy.
+                        # If a write queued it again, it is rendered once more
+                        old = self._drop(url) if url in self._stale and url not in self._queued else None
+                    if old is not None:
+                        self._remove_file(old.filename)
+            finally:
+                self._queue.task_done()
+
+    def wait_idle(self):
+        """Block until every queued page has been rendered again"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def clear(self):
+        """Forget and delete every page"""
+        with self._lock:
+            self._clock += 1
+            self._cleared_at = self._clock
+            self._changed_at = {}
+            pages = list(self._pages.values())
+            self._pages.clear()
+            self.size = 0
+            self._by_key.clear()
+            self._stale.clear()
+        for page in pages:
+            self._remove_file(page.filename)
+
+    def stats(self):
+        """Return the counters as a dictionary"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'saves': self.saves,
+                'refreshes': self.refreshes,
+                'evictions': self.evictions,
+                'pages': len(self._pages),
+                'stale': len(self._stale),
+                'bytes': self.size,
+                'max_pages': self.max_pages,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class PrerenderMiddleware:
+    """WSGI middleware that sends saved pages and saves the ones Flask renders"""
+
+    STATUS = {200: '200 OK', 304: '304 NOT MODIFIED'}
+
+    def __init__(self, wsgi_app, store):
+        self.wsgi_app = wsgi_app
+        self.store = store
+
+    def __call__(self, environ, start_response):
+        found = self.store.find(environ)
+        if found is not None:
+            response = self.store.response(environ, *found)
+            if response is not None:
+                status, headers, f = response
+                start_response(self.STATUS[status], headers)
+                return [] if f is None else wrap_file(environ, f, BLOCK_SIZE)
+
+        if not ENABLED:
+            return self.wsgi_app(environ, start_response)
+
+        sent = {}
+
+        def capture(status, headers, exc_info=None):
+            sent['status'] = int(status.split(' ', 1)[0])
+            sent['headers'] = headers
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.wsgi_app(environ, capture)
+        if SAVE not in environ:
+            return app_iter
+        # Flask has already finished the response, so this only joins its body
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        self.store.save(environ, sent['status'], sent['headers'], body)
+        return [body]
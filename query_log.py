@@ -0,0 +1,228 @@
+"""
+Query instrumentation for the blog database
+Times every query, logs slow ones, and counts queries per request
+
+Turn it on with BLOG_QUERY_LOG=1. When it is off, connections are plain
+sqlite3 connections and nothing here runs.
+"""
+import logging
+import os
+import re
+import time
+from flask import current_app, g, has_app_context
+
+# Wrap new connections with InstrumentedConnection
+ENABLED = os.getenv('BLOG_QUERY_LOG', '0') == '1'
+
+# Queries slower than this are logged as warnings (every query is logged at DEBUG)
+SLOW_QUERY_MS = float(os.getenv('BLOG_SLOW_QUERY_MS', '100'))
+
+# Add the EXPLAIN QUERY PLAN output to slow query warnings
+EXPLAIN_SLOW_QUERIES = os.getenv('BLOG_SLOW_QUERY_EXPLAIN', '0') == '1'
+
+logger = logging.getLogger('blog.queries')
+
+
+class QueryRecord:
+    """Timing for one query: SQL, parameter count, rows returned and seconds
+
+    Time spent fetching rows counts too, so a record is only complete once
+    the rows have been read (see InstrumentedConnection.flush()).
+    """
+
+    __slots__ = ('sql', 'params', 'param_count', 'rows', 'seconds', 'cursor')
+
+    def __init__(self, sql, params, param_count, cursor):
+        self.sql = sql
+        self.params = params
+        self.param_count = param_count
+        self.rows = 0
+        self.seconds = 0.0
+        self.cursor = cursor
+
+    def __repr__(self):
+        return f'<QueryRecord {self.seconds * 1000:.2f} ms, {self.rows} rows: {_one_line(self.sql)}>'
+
+
+def _one_line(sql):
+    """Collapse a query's whitespace so it fits on one log line"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def _param_count(params):
+    """Number of bound parameters (executemany counts every row's)"""
+    return len(params) if params is not None else 0
+
+
+class InstrumentedCursor:
+    """A sqlite3 cursor that adds its execute and fetch time to a QueryRecord"""
+
+    def __init__(self, connection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+        self._record = None
+
+    # row_factory is set per cursor for post summaries, so pass it through
+    @property
+    def row_factory(self):
+        return self._cursor.row_factory
+
+    @row_factory.setter
+    def row_factory(self, value):
+        self._cursor.row_factory = value
+
+    def execute(self, sql, params=()):
+        return self._run(sql, params, _param_count(params), self._cursor.execute)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        count = sum(_param_count(params) for params in seq_of_params)
+        return self._run(sql, seq_of_params, count, self._cursor.executemany, many=True)
+
+    def _run(self, sql, params, param_count, method, many=False):
+        self._connection.flush()
+        # Only single queries keep their parameters, for EXPLAIN
+        self._record = QueryRecord(sql, None if many else params, param_count, self._cursor)
+        self._connection.pending.append(self._record)
+        start = time.perf_counter()
+        try:
+            method(sql, params)
+        finally:
+            self._record.seconds += time.perf_counter() - start
+        return self
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._record is not None:
+                self._record.seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None and self._record is not None:
+            self._record.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+        if self._record is not None:
+            self._record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        if self._record is not None:
+            self._record.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def __getattr__(self, name):
+        # lastrowid, rowcount, description, close, ...
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """A sqlite3 connection whose queries are timed and logged
+
+    Queries are finished (logged and counted) by flush(), which runs when
+    the connection is released, before its next query, and after writes.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.pending = []
+
+    @property
+    def row_factory(self):
+        return self._conn.row_factory
+
+    @row_factory.setter
+    def row_factory(self, value):
+        self._conn.row_factory = value
+
+    def cursor(self):
+        return InstrumentedCursor(self, self._conn.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def flush(self):
+        """Finish every query that has run since the last flush"""
+        pending, self.pending = self.pending, []
+        for record in pending:
+            if record.cursor.description is None:
+                # INSERT/UPDATE/DELETE: count the rows changed instead
+                record.rows = max(record.cursor.rowcount, 0)
+            record.cursor = None
+            _finish(self._conn, record)
+
+    def __getattr__(self, name):
+        # commit, rollback, close, backup, ...
+        return getattr(self._conn, name)
+
+
+def _explain(conn, record):
+    """EXPLAIN QUERY PLAN for a slow SELECT, as indented lines (or '' if not possible)"""
+    if record.params is None:
+        return ''   # executemany
+    if not _one_line(record.sql).upper().startswith(('SELECT', 'WITH')):
+        return ''
+    try:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {record.sql}', record.params).fetchall()
+    except Exception as e:
+        return f'\n    (no plan: {e})'
+    return ''.join(f'\n    {row[3]}' for row in plan)
+
+
+def _finish(conn, record):
+    """Log a finished query and add it to the current request's totals"""
+    milliseconds = record.seconds * 1000
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_seconds = g.get('query_seconds', 0.0) + record.seconds
+
+    if milliseconds >= SLOW_QUERY_MS:
+        plan = _explain(conn, record) if EXPLAIN_SLOW_QUERIES else ''
+        logger.warning(
+            'Slow query (%.1f ms, %d params, %d rows): %s%s',
+            milliseconds, record.param_count, record.rows, _one_line(record.sql), plan
+        )
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            'Query (%.2f ms, %d params, %d rows): %s',
+            milliseconds, record.param_count, record.rows, _one_line(record.sql)
+        )
+
+
+def instrument(conn):
+    """Wrap a new connection if instrumentation is on, otherwise return it as is"""
+    if ENABLED:
+        return InstrumentedConnection(conn)
+    return conn
+
+
+def finish(conn):
+    """Finish any pending queries on a connection (no-op for plain connections)"""
+    if isinstance(conn, InstrumentedConnection):
+        conn.flush()
+
+
+def add_query_headers(response):
+    """after_request hook: report the request's query count and time in debug mode"""
+    if current_app.debug and 'query_count' in g:
+        response.headers['X-Query-Count'] = str(g.query_count)
+        response.headers['X-Query-Time-Ms'] = f'{g.query_seconds * 1000:.1f}'
+    return response
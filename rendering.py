@@ -0,0 +1,236 @@
+"""
+Write-time rendering of posts
+Turns a post's text into the HTML, table of contents, reading time and
+display date its page shows. database.py stores these with the post when it
+is saved, so page views only read them.
+
+Post text is a small, safe subset of Markdown:
+  # Heading, ## Subheading     (become <h3>, <h4>, ... with anchor ids)
+  **bold**, *italic*, `code`
+  [link text](https://example.com)
+  - list items, 1. numbered items
+  > quotes
+  ``` fenced code blocks ```
+  --- on its own line for a divider
+Everything else is plain text: HTML in a post is escaped, never passed
+through, and single line breaks are kept as <br>.
+"""
+import html
+import re
+from datetime import datetime
+
+import compression
+
+# Words read per minute, for the "N min read" estimate
+WORDS_PER_MINUTE = 200
+
+# A table of contents is only shown for posts with at least this many headings
+TOC_MIN_HEADINGS = 2
+
+NORWEGIAN_MONTHS = ('jan', 'feb', 'mar', 'apr', 'mai', 'jun',
+                    'jul', 'aug', 'sep', 'okt', 'nov', 'des')
+
+# Link targets allowed in posts (anything else is shown as plain text)
+SAFE_URL = re.compile(r'^(https?://|mailto:|/|#)', re.IGNORECASE)
+
+HEADING = re.compile(r'^(#{1,4})\s+(.+?)\s*#*$')
+BULLET = re.compile(r'^[-*]\s+(.*)$')
+NUMBERED = re.compile(r'^\d+[.)]\s+(.*)$')
+LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+BOLD = re.compile(r'\*\*(.+?)\*\*')
+ITALIC = re.compile(r'(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])')
+
+# -----------------------------------------------------------------------------
+# Dates
+# -----------------------------------------------------------------------------
+
+def norwegian_date(date_string):
+    """Convert date from YYYY-MM-DD to DD mon YYYY (e.g., 17 des 2025)"""
+    try:
+        date_obj = datetime.strptime(date_string, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        # If parsing fails, return original string
+        return date_string
+    return f"{date_obj.day:02d} {NORWEGIAN_MONTHS[date_obj.month - 1]} {date_obj.year}"
+
+def norwegian_datetime(datetime_string):
+    """Convert datetime to DD mon YYYY - HH:MM format (e.g., 17 des 2025 - 14:30)"""
+    try:
+        dt_obj = datetime.strptime(datetime_string, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return datetime_string
+    return (f"{dt_obj.day:02d} {NORWEGIAN_MONTHS[dt_obj.month - 1]} {dt_obj.year} - "
+            f"{dt_obj.hour:02d}:{dt_obj.minute:02d}")
+
+# -----------------------------------------------------------------------------
+# Markdown
+# -----------------------------------------------------------------------------
+
+def _inline(text):
+    """Escape a line of text and apply bold, italic, code and links"""
+    parts = text.split('`')
+    out = []
+    for i, part in enumerate(parts):
+        # Odd parts were between backticks (an unmatched last one is left as text)
+        if i % 2 == 1 and i < len(parts) - 1:
+            out.append(f'<code>{html.escape(part)}</code>')
+            continue
+        if i % 2 == 1:
+            part = '`' + part
+        part = html.escape(part)
+        part = LINK.sub(_link, part)
+        part = BOLD.sub(r'<strong>\1</strong>', part)
+        part = ITALIC.sub(r'<em>\1</em>', part)
+        out.append(part)
+    return ''.join(out)
+
+def _link(match):
+    """Turn an (already escaped) [text](url) into a link if the URL is safe"""
+    text, url = match.groups()
+    if not SAFE_URL.match(html.unescape(url)):
+        return text
+    return f'<a href="{url}">{text}</a>'
+
+def _slug(text, used):
+    """Make a unique anchor id from a heading"""
+    slug = re.sub(r'[^\w]+', '-', text.lower()).strip('-') or 'section'
+    candidate, n = slug, 2
+    while candidate in used:
+        candidate = f'{slug}-{n}'
+        n += 1
+    used.add(candidate)
+    return candidate
+
+def render_markdown(text):
+    """Render post text to HTML
+
+    Returns:
+        tuple: (html, headings) - headings is a list of (level, id, text)
+    """
+    out = []
+    headings = []
+    used_ids = set()
+    paragraph = []
+    list_tag = None
+    quote = []
+    lines = (text or '').replace('\r\n', '\n').split('\n')
+
+    def close_blocks():
+        nonlocal list_tag
+        if paragraph:
+            out.append('<p>' + '<br>\n'.join(_inline(line) for line in paragraph) + '</p>')
+            paragraph.clear()
+        if list_tag:
+            out.append(f'</{list_tag}>')
+            list_tag = None
+        if quote:
+            out.append('<blockquote><p>' + '<br>\n'.join(_inline(line) for line in quote) + '</p></blockquote>')
+            quote.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        stripped = line.strip()
+
+        if stripped.startswith('```'):
+            close_blocks()
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith('```'):
+                code.append(lines[i])
+                i += 1
+            out.append(f"<pre><code>{html.escape(chr(10).join(code))}</code></pre>")
+            i += 1
+            continue
+
+        heading = HEADING.match(stripped)
+        bullet = BULLET.match(stripped)
+        numbered = NUMBERED.match(stripped)
+
+        if not stripped:
+            close_blocks()
+        elif heading:
+            close_blocks()
+            # The post title is the page's <h2>, so '#' is <h3> and each extra '#' one level down
+            level = min(len(heading.group(1)) + 2, 6)
+            title = heading.group(2)
+            anchor = _slug(title, used_ids)
+            headings.append((level, anchor, title))
+            out.append(f'<h{level} id="{anchor}">{_inline(title)}</h{level}>')
+        elif stripped in ('---', '***'):
+            close_blocks()
+            out.append('<hr>')
+        elif bullet or numbered:
+            tag = 'ul' if bullet else 'ol'
+            if list_tag != tag:
+                close_blocks()
+                out.append(f'<{tag}>')
+                list_tag = tag
+            out.append(f'<li>{_inline((bullet or numbered).group(1))}</li>')
+        elif stripped.startswith('>'):
+            if not quote:
+                close_blocks()
+            quote.append(stripped[1:].strip())
+        else:
+            if list_tag or quote:
+                close_blocks()
+            paragraph.append(stripped)
+        i += 1
+
+    close_blocks()
+    return '\n'.join(out), headings
+
+def render_toc(headings):
+    """Render a table of contents for a post's headings ('' for short posts)"""
+    if len(headings) < TOC_MIN_HEADINGS:
+        return ''
+    top = min(level for level, _, _ in headings)
+    items = ''.join(
+        f'<li class="toc-level-{level - top + 1}"><a href="#{anchor}">{_inline(title)}</a></li>'
+        for level, anchor, title in headings
+    )
+    return f'<nav class="post-toc"><h4>Contents</h4><ol>{items}</ol></nav>'
+
+def reading_time(text):
+    """Estimated minutes to read a post (at least 1)"""
+    return max(1, round(len((text or '').split()) / WORDS_PER_MINUTE))
+
+# -----------------------------------------------------------------------------
+# Stored columns
+# -----------------------------------------------------------------------------
+
+def render_post(content):
+    """Render a post body for storage
+
+    Returns:
+        tuple: (content_html, toc_html, reading_time) - content_html is
+        compressed like post content (see compression.py)
+    """
+    body_html, headings = render_markdown(content)
+    return compression.compress(body_html), render_toc(headings), reading_time(content)
+
+def rerender_posts(conn, batch_size=500):
+    """Re-render the stored HTML and display date of every post, a batch at a time
+
+    Used by migration 9 and by: python database.py render-posts
+
+    Returns:
+        int: Number of posts rendered
+    """
+    compression.register(conn)
+    count = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, content, created_at FROM posts WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return count
+        conn.executemany(
+            'UPDATE posts SET content_html = ?, toc_html = ?, reading_time = ?, created_display = ? WHERE id = ?',
+            [render_post(compression.decompress(content)) + (norwegian_datetime(created_at), post_id)
+             for post_id, content, created_at in rows]
+        )
+        count += len(rows)
+        last_id = rows[-1][0]
@@ -1,3 +1,5 @@
+-- Baseline schema (migration 1). Later changes live in migrations.py.
+
 -- Posts table
 CREATE TABLE IF NOT EXISTS posts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -19,4 +21,4 @@ CREATE TABLE IF NOT EXISTS comments (
     comment_text TEXT NOT NULL,
     date TEXT NOT NULL,
     FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
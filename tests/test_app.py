@@ -55,6 +55,7 @@ def test_individual_post_page(client):
     assert response.status_code == 200
     assert b'Test Post' in response.data
     assert b'Test content for testing' in response.data
+    assert b'1 min read' in response.data
 
 def test_post_not_found(client):
     """Test 404 for non-existent post"""
@@ -261,4 +262,247 @@ def test_norwegian_date_filter(client):
 
     # Test invalid date returns original
     result = norwegian_date_filter('invalid-date')
-    assert result == 'invalid-date'
\ No newline at end of file
+    assert result == 'invalid-date'
+
+def test_request_uses_one_pooled_connection(client):
+    """Test that all queries in a request share one pooled connection"""
+    database.reset_pool()
+
+    # /blog runs several queries but should only open one connection
+    client.get('/blog')
+    stats = database.get_pool().stats()
+    assert stats['misses'] == 1
+    assert stats['in_use'] == 0
+
+    # The next request reuses it
+    client.get('/blog')
+    assert database.get_pool().stats()['hits'] == 1
+
+def test_blog_cursor_pagination(client):
+    """Test following Next links visits every post exactly once"""
+    import re
+
+    for i in range(12):
+        database.create_post(f'Paged Post {i}', 'Content', 'Excerpt', None, 'test')
+
+    seen = []
+    url = '/blog'
+    while url:
+        response = client.get(url)
+        html = response.data.decode()
+        seen.extend(re.findall(r'<h3>(.*?)</h3>', html))
+        match = re.search(r'href="(/blog\?[^"]*after=[^"]*)"', html)
+        url = match.group(1).replace('&amp;', '&') if match else None
+
+    assert len(seen) == 13
+    assert len(set(seen)) == 13
+
+def test_blog_old_page_links_still_work(client):
+    """Test that ?page=N links without a cursor still work"""
+    for i in range(8):
+        database.create_post(f'Old Link Post {i}', 'Content', 'Excerpt', None, 'test')
+
+    response = client.get('/blog?page=2')
+    assert response.status_code == 200
+    assert b'Page 2 of 2' in response.data
+    assert b'Old Link Post 1' in response.data
+
+    # Tag pages too, rather than showing page 1 again
+    for i in range(13):
+        database.create_post(f'Tagged Post {i}', 'Content', 'Excerpt', None, 'paged')
+    response = client.get('/tag/paged?page=2')
+    assert b'Tagged Post 0' in response.data
+    assert b'Tagged Post 12' not in response.data
+
+def test_tag_links_are_encoded(client):
+    """Test that tags with URL characters in them get working links"""
+    for i in range(13):
+        database.create_post(f'Sharp Post {i}', 'Content', 'Excerpt', None, 'C#')
+
+    assert b'href="/tag/C%23"' in client.get('/blog').data
+    response = client.get('/tag/C%23')
+    assert response.status_code == 200
+    assert b'href="/tag/C%23?page=2&amp;after=' in response.data
+    assert b'Sharp Post 0' in client.get('/tag/C%23?page=2').data
+
+def test_tag_page_number_is_validated(client):
+    """Test that bad ?page= values on tag pages fall back to page 1 instead of failing"""
+    for page in ('99999999999999999999', '0', '-3'):
+        response = client.get(f'/tag/test?page={page}')
+        assert response.status_code == 200
+        assert b'Test Post' in response.data
+        assert b'page=0' not in response.data
+
+def test_search(client):
+    """Test full-text search with highlighted snippets"""
+    database.create_post('SQLite Tips', 'Use an <index> to speed up queries', 'Database tricks', None, 'sqlite')
+
+    response = client.get('/search?q=index')
+    assert response.status_code == 200
+    assert b'SQLite Tips' in response.data
+    # Matches are highlighted and the post text is escaped
+    assert b'<mark>index</mark>' in response.data
+    assert b'&lt;' in response.data
+    assert b'Test Post' not in response.data
+
+    # Results are the same cards as the listings, with the snippet instead of the excerpt
+    database.create_comment(2, 'Alice', 'Handy', '2024-12-15 10:00')
+    response = client.get('/search?q=index')
+    assert b'class="comment-badge"' in response.data
+    assert b'Database tricks' not in response.data
+
+def test_search_pages(client):
+    """Test that search pages hold POSTS_PER_PAGE results and bad page numbers fall back to page 1"""
+    from app import POSTS_PER_PAGE
+    for i in range(POSTS_PER_PAGE + 1):
+        database.create_post(f'Searchable {i}', 'Findable content', 'Excerpt', None, 'test')
+
+    first = client.get('/search?q=findable').data
+    assert first.count(b'class="post-preview"') == POSTS_PER_PAGE
+    assert client.get('/search?q=findable&page=2').data.count(b'class="post-preview"') == 1
+
+    for page in ('99999999999999999999', '0', '-1'):
+        response = client.get(f'/search?q=findable&page={page}')
+        assert response.status_code == 200
+        assert response.data.count(b'class="post-preview"') == POSTS_PER_PAGE
+
+def test_search_handles_special_characters(client):
+    """Test that FTS syntax characters in queries don't cause errors"""
+    response = client.get('/search?q=%22unbalanced+OR+(*')
+    assert response.status_code == 200
+
+    response = client.get('/search?q=' + 'a' * 201)
+    assert b'200 characters or less' in response.data
+
+def test_post_page_shows_first_comments_only(client):
+    """Test that long comment threads are split into "load more" pages"""
+    import re
+    from app import COMMENTS_PER_PAGE
+
+    for i in range(COMMENTS_PER_PAGE + 5):
+        database.create_comment(1, f'Reader {i:02d}', 'Comment', f'2024-12-15 10:{i:02d}')
+
+    response = client.get('/blog/1')
+    assert response.data.count(b'class="comment"') == COMMENTS_PER_PAGE
+    assert b'Reader 24' in response.data
+    assert b'Reader 04' not in response.data
+    fragment_url = re.search(rb'data-fragment="([^"]+)"', response.data).group(1).decode()
+
+    # The fragment holds only the remaining comments, with no further link
+    fragment = client.get(fragment_url)
+    assert fragment.status_code == 200
+    assert fragment.data.count(b'class="comment"') == 5
+    assert b'Reader 04' in fragment.data
+    assert b'<html' not in fragment.data
+    assert b'load-more-comments' not in fragment.data
+
+    # Without JavaScript, the link opens the post page at the next comments
+    page_url = re.search(rb'href="(/blog/1\?comments=[^"#]+)', response.data).group(1).decode()
+    assert b'Reader 04' in client.get(page_url).data
+
+def test_page_cache_serves_anonymous_pages(client, monkeypatch):
+    """Test that public pages are cached and dropped when their data changes"""
+    import cache
+    from app import page_cache
+    monkeypatch.setattr(cache, 'ENABLED', True)
+    page_cache.clear()
+
+    assert client.get('/blog/1').headers['X-Cache'] == 'MISS'
+    assert client.get('/blog/1').headers['X-Cache'] == 'HIT'
+    assert client.get('/tag/flask').headers['X-Cache'] == 'MISS'
+
+    # A comment drops the post page and listings showing its card, nothing else
+    client.get('/about')
+    database.create_comment(1, 'Alice', 'Cached?', '2024-12-15 10:00')
+    response = client.get('/blog/1')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'Cached?' in response.data
+    assert client.get('/tag/flask').headers['X-Cache'] == 'MISS'
+    assert client.get('/about').headers['X-Cache'] == 'HIT'
+
+    # Logged-in visitors always get a fresh page
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    assert 'X-Cache' not in client.get('/blog/1').headers
+    stats = client.get('/admin/cache').get_json()
+    assert stats['hits'] == 2
+    assert stats['pages'] == 3
+
+def test_page_cache_keys_are_encoded(monkeypatch):
+    """Test that a query value holding & or = can't share another page's cache key"""
+    import cache
+    from app import page_cache_url
+    monkeypatch.setattr(cache, 'ENABLED', True)
+    with app.test_request_context('/blog?sort=date_asc%26page%3D2'):
+        crafted = page_cache_url()
+    with app.test_request_context('/blog?sort=date_asc&page=2&utm_source=feed'):
+        real = page_cache_url()
+    assert real == '/blog?sort=date_asc&page=2'
+    assert crafted != real
+
+def test_conditional_get(client):
+    """Test that unchanged pages get 304 Not Modified and changed pages don't"""
+    response = client.get('/blog/1')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert etag.startswith('W/"post-1-')
+
+    response = client.get('/blog/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get('/blog/1', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    # A new comment changes the post's ETag and the listings' ETag
+    blog_etag = client.get('/blog').headers['ETag']
+    database.create_comment(1, 'Alice', 'New comment', '2024-12-15 10:00')
+    assert client.get('/blog/1', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/blog', headers={'If-None-Match': blog_etag}).status_code == 200
+
+    # Logged-in visitors see admin buttons, so they don't share the guest copy
+    etag = client.get('/blog/1').headers['ETag']
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    assert client.get('/blog/1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_pages_that_flash_get_no_validators(client):
+    """Test that a page whose view flashed a message gets no ETag or Last-Modified"""
+    for path in ('/blog?page=0', '/blog?after=garbage'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+        assert 'Last-Modified' not in response.headers
+
+def test_static_files_support_conditional_get(client):
+    """Test that static files (and so uploads) are revalidated with 304s too"""
+    response = client.get('/static/style.css')
+    etag = response.headers['ETag']
+    response.close()
+    response = client.get('/static/style.css', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    response.close()
+
+def test_post_cards_are_rendered_once(client):
+    """Test that listing cards are reused across pages and re-rendered when the post changes"""
+    from app import card_cache
+    card_cache.clear()
+    before = card_cache.stats()
+
+    def rendered():
+        return card_cache.stats()['misses'] - before['misses']
+
+    client.get('/blog')
+    client.get('/blog?sort=title_asc')
+    client.get('/tag/flask')
+    assert rendered() == 1
+    assert card_cache.stats()['hits'] - before['hits'] == 2
+
+    # The comment badge is part of the card
+    database.create_comment(1, 'Alice', 'Nice', '2024-12-15 10:00')
+    response = client.get('/blog')
+    assert b'class="comment-badge"' in response.data
+    assert rendered() == 2
+
+    # The home page has its own card layout
+    response = client.get('/')
+    assert b'class="featured-post-link"' in response.data
+    assert rendered() == 3
@@ -0,0 +1,142 @@
+"""
+Tests for the ASGI entry point
+Calls the ASGI application directly, the way an ASGI server would
+"""
+import asyncio
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asgi
+import database
+from app import app
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def blog():
+    """Set up a test database with one post"""
+    database.DATABASE = TEST_DATABASE
+    app.config['TESTING'] = True
+    app.config['SECRET_KEY'] = 'test-secret-key'
+
+    database.init_db()
+    database.create_post('Test Post', 'Test content for testing', 'Test excerpt', None, 'test, flask')
+
+    yield
+
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+async def call(path, method='GET', body=b'', query_string=b'', headers=()):
+    """Send one request to the ASGI app and return (status, headers, body)"""
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': list(headers),
+        'server': ('testserver', 80),
+    }
+    await asgi.application(scope, receive, send)
+    response_headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], response_headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+def test_async_views_serve_public_pages(blog):
+    """Test that the public read pages are served by the async views"""
+    for path in ('/', '/blog', '/blog/1', '/tag/flask'):
+        status, headers, body = asyncio.run(call(path))
+        assert status == 200
+        assert b'Test Post' in body
+
+    status, _, body = asyncio.run(call('/blog/1/comments'))
+    assert status == 200
+
+    status, _, body = asyncio.run(call('/blog/99'))
+    assert status == 404
+    assert body == b'Post not found!'
+
+    # Bad page numbers fall back to page 1, as in app.py
+    status, _, body = asyncio.run(call('/tag/flask', query_string=b'page=99999999999999999999'))
+    assert status == 200
+    assert b'Test Post' in body
+
+def test_other_requests_fall_back_to_flask(blog):
+    """Test that forms and static files go through the normal Flask app"""
+    status, headers, body = asyncio.run(call(
+        '/blog/1', method='POST', body=b'author=Alice&comment_text=Nice+post',
+        headers=[(b'content-type', b'application/x-www-form-urlencoded')]
+    ))
+    assert status == 302
+    assert headers['location'] == '/blog/1'
+
+    # The flash message set by the sync view shows on the async page
+    cookie = headers['set-cookie'].split(';')[0].encode()
+    status, _, body = asyncio.run(call('/blog/1', headers=[(b'cookie', cookie)]))
+    assert b'Nice post' in body
+    assert b'Comment added successfully!' in body
+
+    status, _, _ = asyncio.run(call('/static/style.css'))
+    assert status == 200
+
+def test_many_concurrent_requests_share_few_threads(blog):
+    """Test that concurrent requests wait on the event loop, not on a thread each"""
+    import threading
+
+    async def burst():
+        return await asyncio.gather(*[call('/blog/1') for _ in range(200)])
+
+    results = asyncio.run(burst())
+    assert {status for status, _, _ in results} == {200}
+    assert threading.active_count() < 50
+
+def test_cached_page_rendered_once_under_load(blog, monkeypatch):
+    """Test that concurrent requests for an uncached page share one render"""
+    import cache
+    from app import page_cache
+    monkeypatch.setattr(cache, 'ENABLED', True)
+    page_cache.clear()
+    before = page_cache.stats()
+
+    async def burst():
+        return await asyncio.gather(*[call('/blog/1') for _ in range(50)])
+
+    results = asyncio.run(burst())
+    assert sorted(headers['x-cache'] for _, headers, _ in results) == ['HIT'] * 49 + ['MISS']
+    assert page_cache.stats()['misses'] - before['misses'] == 1
+
+def test_async_views_answer_conditional_get(blog):
+    """Test that the async views return 304 for a current ETag"""
+    status, headers, _ = asyncio.run(call('/blog/1'))
+    status, _, body = asyncio.run(call('/blog/1', headers=[(b'if-none-match', headers['etag'].encode())]))
+    assert status == 304
+    assert body == b''
+
+def test_async_views_send_prerendered_pages(blog, tmp_path, monkeypatch):
+    """Test that saved pages are sent from disk before an async view runs"""
+    import prerender
+    from app import prerendered
+    monkeypatch.setattr(prerender, 'ENABLED', True)
+    monkeypatch.setattr(prerendered, 'directory', str(tmp_path))
+    monkeypatch.setattr(prerendered, '_ready', False)
+
+    status, headers, first = asyncio.run(call('/blog/1'))
+    assert 'x-prerendered' not in headers
+    status, headers, second = asyncio.run(call('/blog/1'))
+    assert status == 200
+    assert headers['x-prerendered'] == 'HIT'
+    assert second == first
+    prerendered.clear()
@@ -0,0 +1,122 @@
+"""
+Unit tests for bulk import and export
+Tests JSONL and Markdown round trips and validation of imported records
+"""
+import io
+import json
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import bulk_io
+import database
+from database import get_post_by_id, get_comments_for_post, get_posts_by_tag, get_posts_count, search_posts
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def test_db():
+    """Set up an empty test database"""
+    database.DATABASE = TEST_DATABASE
+    database.init_db()
+    yield
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def write_jsonl(path, records):
+    """Write records to a JSONL file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+
+def test_import_jsonl(test_db, tmp_path):
+    """Test that imported posts get their tags, comments, counters and search entries"""
+    path = tmp_path / 'posts.jsonl'
+    write_jsonl(path, [
+        {'title': 'First', 'content': 'Hello world', 'excerpt': 'Hi', 'tags': 'python, Python, flask',
+         'created_at': '2024-01-01 10:00:00',
+         'comments': [{'author': 'Alice', 'comment_text': 'Nice', 'date': '2024-01-02 10:00'}]},
+        {'title': 'Second', 'content': 'More text', 'excerpt': 'More', 'tags': ['flask']},
+    ])
+
+    stats = bulk_io.import_posts(str(path), chunk_size=1)
+
+    assert (stats['posts'], stats['comments'], stats['skipped']) == (2, 1, 0)
+    assert get_posts_count() == 2
+    first = get_post_by_id(1)
+    assert first['tags'] == 'python, flask'
+    assert first['date'] == '2024-01-01'
+    assert first['comment_count'] == 1
+    assert [c['author'] for c in get_comments_for_post(1)] == ['Alice']
+    assert [p['title'] for p in get_posts_by_tag('flask')] == ['Second', 'First']
+    assert search_posts('hello')[0][0]['title'] == 'First'
+
+def test_import_skips_invalid_records(test_db, tmp_path):
+    """Test that bad lines are reported and skipped without stopping the import"""
+    path = tmp_path / 'posts.jsonl'
+    write_jsonl(path, [
+        '{not json',
+        {'title': '', 'content': 'No title', 'excerpt': 'Excerpt'},
+        {'title': 'Good', 'content': 'Content', 'excerpt': 'Excerpt'},
+    ])
+    errors = io.StringIO()
+
+    stats = bulk_io.import_posts(str(path), errors=errors)
+
+    assert (stats['posts'], stats['skipped']) == (1, 2)
+    assert 'line 1: Invalid JSON' in errors.getvalue()
+    assert 'line 2: Title is required' in errors.getvalue()
+
+def test_import_skips_records_with_wrong_types(test_db, tmp_path):
+    """Test that values of the wrong JSON type are reported instead of stopping the import"""
+    path = tmp_path / 'posts.jsonl'
+    post = {'title': 'Post', 'content': 'Content', 'excerpt': 'Excerpt'}
+    write_jsonl(path, [
+        {**post, 'created_at': 1734256800},
+        {**post, 'comments': ['Nice post']},
+        {**post, 'comments': [{'comment_text': 42, 'date': '2024-12-15 10:00'}]},
+        {**post, 'tags': ['python', 3]},
+        {**post, 'title': 'Good'},
+    ])
+    errors = io.StringIO()
+
+    stats = bulk_io.import_posts(str(path), errors=errors)
+
+    assert (stats['posts'], stats['skipped']) == (1, 4)
+    assert 'line 1: created_at must be a string' in errors.getvalue()
+    assert 'line 2: Each comment must be a JSON object' in errors.getvalue()
+    assert 'line 3: Comment comment_text must be a string' in errors.getvalue()
+    assert 'line 4: tags must be a string or a list of strings' in errors.getvalue()
+
+def test_export_and_reimport_round_trip(test_db, tmp_path):
+    """Test that exported JSONL and Markdown import back to the same posts"""
+    database.create_post('Round Trip', 'Line one\n\nLine two: with a colon', 'Excerpt', None, 'python, flask')
+    database.create_comment(1, 'Bob', 'Comment', '2024-12-15 10:00')
+    database.create_post('No Comments', 'Content', 'Excerpt', None, '')
+    original = [dict(get_post_by_id(1)), dict(get_post_by_id(2))]
+
+    assert bulk_io.export_posts(str(tmp_path / 'posts.jsonl')) == 2
+    assert bulk_io.export_posts(str(tmp_path / 'md'), 'markdown') == 2
+    assert sorted(os.listdir(tmp_path / 'md')) == ['00001-round-trip.md', '00002-no-comments.md']
+
+    for source in ('posts.jsonl', 'md'):
+        database.reset_pool()
+        os.remove(TEST_DATABASE)
+        database.init_db()
+        bulk_io.import_posts(str(tmp_path / source))
+        for post in original:
+            imported = dict(get_post_by_id(post['id']))
+            assert imported == post
+        assert [c['author'] for c in get_comments_for_post(1)] == ['Bob']
+
+def test_parse_hand_written_markdown():
+    """Test that plain front matter values (not JSON) are accepted"""
+    record = bulk_io.parse_markdown('---\ntitle: My First Post\ntags: python, flask\n---\n\n# Hello\n')
+    assert record == {'title': 'My First Post', 'tags': 'python, flask', 'content': '# Hello'}
+
+    with pytest.raises(ValueError):
+        bulk_io.parse_markdown('# No front matter')
@@ -0,0 +1,86 @@
+"""
+Unit tests for the page cache
+Tests LRU eviction, invalidation by database key and single-flight rendering
+"""
+import threading
+import time
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import PageCache, CachedPage
+
+def page(body, keys=()):
+    """A cached 200 response with a body"""
+    return CachedPage(200, [('Content-Type', 'text/html')], body, keys)
+
+def render(pages, url, body, keys=()):
+    """Claim, store and release a page the way a request does"""
+    _, ticket = pages.get_or_claim(url)
+    pages.store(ticket, page(body, keys))
+    pages.release(ticket)
+
+def test_lru_eviction_keeps_size_bounded():
+    """Test that the least recently used pages are dropped first"""
+    size = page(b'x' * 1000).size
+    pages = PageCache(max_bytes=size * 2)
+    render(pages, '/a', b'x' * 1000)
+    render(pages, '/b', b'x' * 1000)
+    pages.get_or_claim('/a')   # /a is now more recent than /b
+    render(pages, '/c', b'x' * 1000)
+
+    assert pages.get_or_claim('/a')[0] is not None
+    assert pages.get_or_claim('/b')[0] is None
+    stats = pages.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= stats['max_bytes']
+
+def test_invalidate_drops_only_matching_pages():
+    """Test that a write drops the pages built from what it changed"""
+    pages = PageCache()
+    render(pages, '/blog/1?', b'post 1', {'post:1'})
+    render(pages, '/blog/2?', b'post 2', {'post:2'})
+    render(pages, '/blog?', b'listing', {'posts', 'post:1', 'post:2'})
+
+    pages.invalidate({'post:1'})
+    assert pages.get_or_claim('/blog/1?')[0] is None
+    assert pages.get_or_claim('/blog?')[0] is None
+    assert pages.get_or_claim('/blog/2?')[0].body == b'post 2'
+    assert pages.stats()['invalidations'] == 2
+
+def test_page_changed_while_rendering_is_not_stored():
+    """Test that a render that raced with a write doesn't cache stale data"""
+    pages = PageCache()
+    _, ticket = pages.get_or_claim('/blog/1?')
+    pages.invalidate({'post:1'})
+    pages.store(ticket, page(b'stale', {'post:1'}))
+    pages.release(ticket)
+    assert pages.get_or_claim('/blog/1?')[0] is None
+
+def test_concurrent_misses_render_once():
+    """Test that requests for a page being rendered wait for that render"""
+    pages = PageCache()
+    renders = []
+    results = []
+
+    def request():
+        cached, ticket = pages.get_or_claim('/blog/1?')
+        if cached is None:
+            renders.append(1)
+            time.sleep(0.05)
+            cached = page(b'post 1')
+            pages.store(ticket, cached)
+            pages.release(ticket)
+        results.append(cached.body)
+
+    threads = [threading.Thread(target=request) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(renders) == 1
+    assert results == [b'post 1'] * 20
+    assert pages.stats()['hits'] == 19
@@ -10,6 +10,7 @@ import sys
 # Add parent directory to path so we can import our modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import compression
 from database import (
     get_db_connection, 
     get_all_posts, 
@@ -236,4 +237,498 @@ def test_pagination_limit_and_offset(test_db):
     assert len(second_page) == 5
 
     # Verify they're different posts
-    assert first_page[0]['id'] != second_page[0]['id']
\ No newline at end of file
+    assert first_page[0]['id'] != second_page[0]['id']
+
+def test_connection_pool_reuses_connections(test_db):
+    """Test that released connections are handed out again"""
+    from database import ConnectionPool
+
+    pool = ConnectionPool(TEST_DATABASE, max_size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+
+    # Second acquire should reuse the same connection
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    pool.close_all()
+
+def test_connection_pool_is_bounded(test_db):
+    """Test that the pool waits and times out when it is exhausted"""
+    from database import ConnectionPool
+
+    pool = ConnectionPool(TEST_DATABASE, max_size=1, timeout=0.05)
+    pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert pool.stats()['waits'] == 1
+    pool.close_all()
+
+@pytest.fixture
+def wal_db(test_db):
+    """Run a test with the database in WAL storage mode"""
+    import database
+    database.STORAGE_MODE = 'wal'
+    database.reset_pool()
+    yield
+    # Stopping the writer closes the last connection and removes the WAL files
+    database.reset_pool()
+    database.STORAGE_MODE = 'default'
+
+def test_wal_mode_reads_and_writes(wal_db):
+    """Test that writes go through the writer thread and are visible to readers"""
+    import threading
+    import database
+
+    post_id = create_post('WAL Post', 'Content', 'Excerpt', None, 'wal')
+
+    # Concurrent writers are serialised instead of failing with "database is locked"
+    threads = [
+        threading.Thread(target=create_comment, args=(post_id, f'User {i}', 'Hi', '2024-12-15 10:00'))
+        for i in range(10)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(get_comments_for_post(post_id)) == 10
+    conn = get_db_connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+def test_wal_mode_reports_write_errors(wal_db):
+    """Test that a failing write raises in the caller"""
+    with pytest.raises(sqlite3.IntegrityError):
+        create_comment(1, None, 'No author', '2024-12-15 10:00')
+
+    # The writer keeps working after an error
+    assert create_post('Still Works', 'Content', 'Excerpt', None, '') == 1
+
+def test_get_posts_by_tag_matches_whole_tags(test_db):
+    """Test that tag filtering doesn't match substrings of other tags"""
+    create_post('Python Post', 'Content', 'Excerpt', None, 'python')
+    create_post('Py Post', 'Content', 'Excerpt', None, 'py')
+
+    posts = get_posts_by_tag('py')
+    assert len(posts) == 1
+    assert posts[0]['title'] == 'Py Post'
+
+    # Tag lookup ignores case
+    assert len(get_posts_by_tag('PYTHON')) == 1
+
+def test_tag_counts_follow_updates_and_deletes(test_db):
+    """Test that per-tag post counts stay correct"""
+    from database import get_tag_counts
+
+    create_post('Post 1', 'Content', 'Excerpt', None, 'python, flask')
+    create_post('Post 2', 'Content', 'Excerpt', None, 'python')
+    update_post(2, 'Post 2', '2024-12-15', 'Content', 'Excerpt', None, 'testing')
+    delete_post(1)
+
+    counts = {tag['name']: tag['post_count'] for tag in get_tag_counts()}
+    assert counts == {'testing': 1}
+
+def test_tags_migrated_from_existing_posts(test_db):
+    """Test that posts written before the tag tables existed get their tags linked"""
+    # Insert directly, as an old version of the app would have
+    conn = sqlite3.connect(TEST_DATABASE)
+    conn.execute(
+        "INSERT INTO posts (title, date, content, excerpt, tags) VALUES ('Old', '2024-01-01', 'C', 'E', 'legacy, flask')"
+    )
+    conn.commit()
+    conn.close()
+
+    assert get_all_tags() == ['flask', 'legacy']
+    assert len(get_posts_by_tag('legacy')) == 1
+
+def test_keyset_pagination(test_db):
+    """Test walking forwards and backwards through pages with cursors"""
+    from database import get_posts_page
+
+    # Posts created in the same second share created_at, so id breaks the tie
+    for i in range(7):
+        create_post(f'Post {i}', 'Content', 'Excerpt', None, 'test')
+
+    first, has_more = get_posts_page('date_desc', limit=3)
+    assert [p['id'] for p in first] == [7, 6, 5]
+    assert has_more
+
+    last = first[-1]
+    second, has_more = get_posts_page('date_desc', limit=3, after=(last['created_at'], last['id']))
+    assert [p['id'] for p in second] == [4, 3, 2]
+    assert has_more
+
+    head = second[0]
+    back, has_more = get_posts_page('date_desc', limit=3, before=(head['created_at'], head['id']))
+    assert [p['id'] for p in back] == [7, 6, 5]
+    assert not has_more
+
+    by_title, _ = get_posts_page('title_desc', limit=2, after=('Post 5', 6))
+    assert [p['title'] for p in by_title] == ['Post 4', 'Post 3']
+
+def test_cursor_round_trip(test_db):
+    """Test that cursors decode only for the sort order they were made for"""
+    from database import encode_cursor, decode_cursor
+
+    create_post('Cursor Post', 'Content', 'Excerpt', None, 'test')
+    post = get_post_by_id(1)
+
+    cursor = encode_cursor(post, 'title_asc')
+    assert decode_cursor(cursor, 'title_asc') == ('Cursor Post', 1)
+    assert decode_cursor(cursor, 'date_desc') is None
+    assert decode_cursor('not-a-cursor', 'title_asc') is None
+
+def test_search_follows_post_changes(test_db):
+    """Test that the search index is kept in sync with posts by triggers"""
+    from database import search_posts
+
+    create_post('Flask Basics', 'Routing and templates', 'Getting started', None, 'flask')
+    create_post('Other Post', 'Mentions flask once', 'Something else', None, 'misc')
+
+    # Title matches rank above content matches
+    posts, has_more = search_posts('flask')
+    assert [post['title'] for post in posts] == ['Flask Basics', 'Other Post']
+    assert not has_more
+
+    update_post(1, 'Django Basics', '2024-12-15', 'Routing and templates', 'Getting started', None, 'django')
+    assert [post['title'] for post in search_posts('flask')[0]] == ['Other Post']
+
+    delete_post(2)
+    assert search_posts('flask')[0] == []
+    # Prefix matching on the last word
+    assert [post['title'] for post in search_posts('djan')[0]] == ['Django Basics']
+
+def test_post_summaries_leave_out_content(test_db):
+    """Test that listing queries return lightweight summaries without the body"""
+    from database import get_post_summaries, get_posts_page
+
+    create_post('Summary Post', 'A very long body', 'Short excerpt', None, 'python')
+
+    for posts in (get_post_summaries(limit=6), get_posts_page(limit=6)[0], get_posts_by_tag('python')):
+        post = posts[0]
+        # Both template-style and sqlite3.Row-style access work
+        assert post.title == 'Summary Post'
+        assert post['excerpt'] == 'Short excerpt'
+        assert not hasattr(post, 'content')
+
+def test_long_content_is_stored_compressed(test_db):
+    """Test that long bodies are stored as marked BLOBs and read back as text"""
+    from database import search_posts
+
+    long_content = 'Flask makes small web apps easy. ' * 100
+    create_post('Long Post', long_content, 'Excerpt', None, 'python')
+    create_post('Short Post', 'Short body', 'Excerpt', None, 'python')
+
+    conn = get_db_connection()
+    stored = conn.execute('SELECT content FROM posts ORDER BY id').fetchall()
+    conn.close()
+    assert isinstance(stored[0][0], bytes) and stored[0][0][0] == compression.ZLIB
+    assert len(stored[0][0]) < len(long_content)
+    assert stored[1][0] == 'Short body'
+
+    assert get_post_by_id(1)['content'] == long_content
+    assert get_all_posts()[1]['content'] == long_content
+
+    # The search index sees the decompressed text
+    update_post(1, 'Long Post', '2024-01-01', 'Django too. ' * 200, 'Excerpt', None, 'python')
+    assert [post['title'] for post in search_posts('django')[0]] == ['Long Post']
+    assert search_posts('flask')[0] == []
+
+def test_rendered_html_is_stored_on_save(test_db):
+    """Test that saving a post stores its HTML, and render_posts() rebuilds it"""
+    from database import render_posts
+
+    create_post('Notes', '# One\ntext\n## Two\nmore', 'Excerpt', None, 'python')
+    post = get_post_by_id(1)
+    assert post['content_html'].startswith('<h3 id="one">One</h3>')
+    assert '<a href="#two">Two</a>' in post['toc_html']
+    assert post['reading_time'] == 1
+    assert post['created_display'].endswith(post['created_at'][11:16])
+
+    update_post(1, 'Notes', '2024-01-01', 'Just *one* line', 'Excerpt', None, 'python')
+    post = get_post_by_id(1)
+    assert post['content_html'] == '<p>Just <em>one</em> line</p>'
+    assert post['toc_html'] == ''
+
+    # Rows written without the rendered columns are rendered on read, and by render_posts()
+    conn = get_db_connection()
+    conn.execute("UPDATE posts SET content_html = NULL, created_display = NULL")
+    conn.commit()
+    conn.close()
+    assert get_post_by_id(1)['content_html'] == '<p>Just <em>one</em> line</p>'
+    assert render_posts() == 1
+    conn = get_db_connection()
+    assert conn.execute('SELECT content_html FROM posts').fetchone()[0] == '<p>Just <em>one</em> line</p>'
+    conn.close()
+
+def test_counters_follow_posts_and_comments(test_db):
+    """Test that trigger-maintained counters match the real row counts"""
+    from database import get_posts_count, get_post_summaries
+
+    create_post('Post 1', 'Content', 'Excerpt', None, 'test')
+    create_post('Post 2', 'Content', 'Excerpt', None, 'test')
+    create_comment(1, 'Alice', 'First', '2024-12-15 10:00')
+    create_comment(1, 'Bob', 'Second', '2024-12-15 11:00')
+    create_comment(2, 'Carol', 'Third', '2024-12-15 12:00')
+    from database import delete_comment
+    delete_comment(3)
+
+    assert get_posts_count() == 2
+    assert get_post_by_id(1)['comment_count'] == 2
+    counts = {post.id: post.comment_count for post in get_post_summaries()}
+    assert counts == {1: 2, 2: 0}
+
+def test_repair_counters_reports_drift(test_db):
+    """Test that repair_counters() fixes and reports counters that drifted"""
+    from database import repair_counters, get_posts_count
+
+    create_post('Post 1', 'Content', 'Excerpt', None, 'test')
+    create_comment(1, 'Alice', 'Comment', '2024-12-15 10:00')
+    assert repair_counters() == []
+
+    # Simulate drift, e.g. rows changed by a tool that bypassed the triggers
+    conn = sqlite3.connect(TEST_DATABASE)
+    conn.execute("UPDATE counters SET value = 7 WHERE name = 'posts'")
+    conn.execute("UPDATE post_stats SET comment_count = 0")
+    conn.commit()
+    conn.close()
+
+    assert repair_counters() == [('posts', 7, 1), ('comments:post 1', 0, 1)]
+    assert get_posts_count() == 1
+    assert get_post_by_id(1)['comment_count'] == 1
+
+@pytest.fixture
+def batched_comments(test_db):
+    """Run a test with comment write-behind batching turned on"""
+    import database
+    database.COMMENT_BATCHING = True
+    yield database
+    database.reset_pool()
+    database.COMMENT_BATCHING = False
+
+def test_batched_comments_share_commits(batched_comments):
+    """Test that concurrent comments are group-committed and each gets its id"""
+    import threading
+
+    post_id = create_post('Busy Post', 'Content', 'Excerpt', None, 'test')
+    ids = []
+    threads = [
+        threading.Thread(target=lambda i=i: ids.append(
+            create_comment(post_id, f'User {i}', 'Hi', '2024-12-15 10:00')
+        ))
+        for i in range(20)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    batcher = batched_comments.get_comment_batcher()
+    assert sorted(ids) == list(range(1, 21))
+    assert batcher.comments == 20
+    assert batcher.batches < 20
+    assert get_post_by_id(post_id)['comment_count'] == 20
+
+def test_batched_comment_errors_reach_their_caller(batched_comments):
+    """Test that one bad comment fails alone and the rest of its batch is saved"""
+    import threading
+
+    post_id = create_post('Post', 'Content', 'Excerpt', None, 'test')
+    errors = []
+
+    def submit(author):
+        try:
+            create_comment(post_id, author, 'Hi', '2024-12-15 10:00')
+        except sqlite3.IntegrityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit, args=(author,)) for author in ('Alice', None, 'Bob')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 1
+    assert sorted(c['author'] for c in get_comments_for_post(post_id)) == ['Alice', 'Bob']
+
+def test_async_reads_match_sync_reads(test_db):
+    """Test that the async read functions return what the sync ones do"""
+    import asyncio
+    import database
+
+    create_post('Async Post', 'Content', 'Excerpt', None, 'test')
+    create_comment(1, 'Alice', 'Comment', '2024-12-15 10:00')
+
+    async def read():
+        return await asyncio.gather(
+            database.get_post_by_id_async(1),
+            database.get_comments_for_post_async(1),
+            database.get_posts_count_async(),
+        )
+
+    post, comments, count = asyncio.run(read())
+    assert post['title'] == 'Async Post'
+    assert [c['author'] for c in comments] == ['Alice']
+    assert count == 1
+    # The executor threads used pooled connections and gave them back
+    assert database.get_pool().stats()['in_use'] == 0
+    database.reset_pool()
+
+@pytest.fixture
+def snapshot_db(test_db):
+    """Run a test with reads served from the in-memory snapshot"""
+    import database
+    database.READ_SNAPSHOT = True
+    yield database
+    database.reset_pool()
+    database.READ_SNAPSHOT = False
+
+def test_snapshot_sees_own_writes(snapshot_db):
+    """Test that reads come from the snapshot and writes show up straight away"""
+    post_id = create_post('Snapshot Post', 'Content', 'Excerpt', None, 'test')
+    assert get_post_by_id(post_id)['title'] == 'Snapshot Post'
+
+    snapshot = snapshot_db.get_snapshot()
+    refreshes = snapshot.refreshes
+    create_comment(post_id, 'Alice', 'Comment', '2024-12-15 10:00')
+    assert [c['author'] for c in get_comments_for_post(post_id)] == ['Alice']
+    assert get_post_by_id(post_id)['comment_count'] == 1
+    assert snapshot.refreshes == refreshes + 1
+
+    # The snapshot is read-only
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.connection().execute('DELETE FROM posts')
+
+def test_snapshot_staleness_is_bounded(snapshot_db):
+    """Test that other processes' writes show up once max_staleness has passed"""
+    create_post('Post 1', 'Content', 'Excerpt', None, 'test')
+    snapshot = snapshot_db.get_snapshot()
+    snapshot.max_staleness = 60
+    get_post_by_id(1)
+
+    # A write from another process (no mark_changed() call)
+    conn = sqlite3.connect(TEST_DATABASE)
+    compression.register(conn)
+    conn.execute("UPDATE posts SET title = 'Changed' WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+    assert get_post_by_id(1)['title'] == 'Post 1'
+    snapshot.max_staleness = 0
+    assert get_post_by_id(1)['title'] == 'Changed'
+    assert snapshot.stats()['memory_bytes'] > 0
+
+def test_records_work_like_rows(test_db):
+    """Test that Post and Comment records support attribute, name and index access"""
+    from database import Post, Comment
+
+    create_post('Record Post', 'Content', 'Excerpt', None, 'test')
+    create_comment(1, 'Alice', 'Comment', '2024-12-15 10:00')
+
+    post = get_post_by_id(1)
+    assert isinstance(post, Post)
+    assert post.title == post['title'] == post[1] == 'Record Post'
+    assert dict(post)['content'] == 'Content'
+    assert list(post.keys())[-1] == 'image_variants'
+    with pytest.raises(IndexError):
+        post['missing']
+
+    comment = get_comments_for_post(1)[0]
+    assert isinstance(comment, Comment)
+    assert comment.author == comment['author'] == 'Alice'
+    assert get_all_posts()[0] == post
+
+def test_comments_page_keyset(test_db):
+    """Test that comment pages follow (date, id) without gaps, even with equal dates"""
+    from database import get_comments_page, encode_comment_cursor, decode_comment_cursor
+
+    create_post('Busy Post', 'Content', 'Excerpt', None, 'test')
+    for i in range(25):
+        # Pairs of comments share a date
+        create_comment(1, f'User {i}', 'Hi', f'2024-12-15 10:{i // 2:02d}')
+
+    first, has_more = get_comments_page(1, limit=10)
+    assert has_more
+    assert [c.author for c in first[:3]] == ['User 24', 'User 23', 'User 22']
+
+    seen = list(first)
+    while has_more:
+        after = decode_comment_cursor(encode_comment_cursor(seen[-1]))
+        page, has_more = get_comments_page(1, limit=10, after=after)
+        seen.extend(page)
+    assert [c.author for c in seen] == [f'User {i}' for i in range(24, -1, -1)]
+    assert decode_comment_cursor('not-a-cursor') is None
+
+@pytest.fixture
+def object_cache(test_db, monkeypatch):
+    """Turn the object cache on for one test"""
+    import database
+    monkeypatch.setattr(database, 'OBJECT_CACHE', True)
+    database._object_cache.clear()
+    yield database._object_cache
+
+def test_object_cache_follows_writes(object_cache):
+    """Test that cached posts and tags are dropped by the writes that change them"""
+    import database
+    from database import get_tag_counts
+
+    post_id = create_post('Cached Post', 'Content', 'Excerpt', None, 'python')
+    assert get_post_by_id(post_id)['title'] == 'Cached Post'
+    assert get_post_by_id(post_id) is get_post_by_id(post_id)
+    assert [tag['name'] for tag in get_tag_counts()] == ['python']
+
+    update_post(post_id, 'Renamed', '2024-01-01', 'Content', 'Excerpt', None, 'python, flask')
+    assert get_post_by_id(post_id)['title'] == 'Renamed'
+    assert get_all_tags() == ['flask', 'python']
+
+    # Checking a post's version doesn't load the post
+    object_cache.clear()
+    version = database.get_post_version(post_id)
+    assert object_cache.stats()['entries'] == 1
+
+    create_comment(post_id, 'Alice', 'Hi', '2024-12-15 10:00')
+    assert get_post_by_id(post_id)['comment_count'] == 1
+    assert database.get_post_version(post_id)[0] > version[0]
+
+    delete_post(post_id)
+    assert get_post_by_id(post_id) is None
+    assert get_all_tags() == []
+
+def test_object_cache_remembers_missing_posts(object_cache):
+    """Test that lookups of missing ids are answered without a query"""
+    import database
+
+    assert get_post_by_id(999) is None
+    assert database.get_post_version(999) is None
+    misses = object_cache.stats()['misses']
+    assert get_post_by_id(999) is None
+    assert database.get_post_version(999) is None
+    assert object_cache.stats()['misses'] == misses
+
+    # Creating the post drops the cached miss
+    conn = get_db_connection()
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('posts', 998)")
+    conn.commit()
+    conn.close()
+    assert create_post('Post 999', 'Content', 'Excerpt', None, 'test') == 999
+    assert get_post_by_id(999)['title'] == 'Post 999'
+
+def test_object_cache_is_bounded():
+    """Test LRU eviction and TTL expiry"""
+    from database import ObjectCache
+
+    cache = ObjectCache(max_size=2, ttl=60)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.get_or_load('a', lambda: 0)      # a is now the most recently used
+    cache.get_or_load('c', lambda: 3)
+    assert cache.get_or_load('a', lambda: 0) == 1
+    assert cache.get_or_load('b', lambda: 0) == 0
+    assert cache.stats()['evictions'] == 2
+
+    cache.ttl = 0
+    cache.get_or_load('d', lambda: 4)
+    assert cache.get_or_load('d', lambda: 5) == 5
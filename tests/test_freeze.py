@@ -0,0 +1,91 @@
+"""
+Tests for the static site export
+Tests which pages are written, their links, and incremental rebuilds
+"""
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import freeze
+from app import app
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def site(tmp_path):
+    """Set up a test database with 8 posts and return an output directory"""
+    database.DATABASE = TEST_DATABASE
+    database.init_db()
+    for i in range(8):
+        database.create_post(f'Post {i}', f'Content {i}', f'Excerpt {i}', None,
+                             'python, flask' if i % 2 else 'python')
+
+    yield str(tmp_path / 'site')
+
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def read(output, path):
+    """Read an exported page"""
+    with open(os.path.join(output, path.strip('/'), 'index.html'), encoding='utf-8') as f:
+        return f.read()
+
+def test_every_public_page_is_exported(site):
+    """Test that home, blog pages in each order, posts, tags and about are written"""
+    stats = freeze.freeze(site)
+
+    # 8 posts + 2 pages x 4 sort orders + /blog + home + 2 tags + about
+    assert stats['rendered'] == 8 + 8 + 1 + 1 + 2 + 1
+    assert stats['failed'] == []
+    assert 'Post 3' in read(site, '/blog/4/')
+    assert 'Post 0' in read(site, '/blog/title_asc/1/')
+    assert 'Post 1' in read(site, '/tag/flask/')
+    assert 'About' in read(site, '/about/')
+    assert os.path.exists(os.path.join(site, 'static', 'style.css'))
+
+    # Links between listing pages point at the exported files
+    blog = read(site, '/blog/')
+    assert 'href="/blog/date_desc/2/"' in blog
+    assert 'value="/blog/title_asc/1/"' in blog
+    assert '?after=' not in blog
+    assert 'href="/blog/date_desc/1/"' in read(site, '/blog/date_desc/2/')
+    # The app itself still uses cursor links
+    assert app.config['STATIC_LINKS'] is False
+
+def test_rebuild_renders_only_changed_pages(site):
+    """Test that edits, comments and deletes re-render just the pages they affect"""
+    freeze.freeze(site)
+    assert freeze.freeze(site)['rendered'] == 0
+
+    # A comment changes the post page and the cards (comment count) showing it
+    database.create_comment(1, 'Alice', 'Nice post', '2024-12-15 10:00')
+    stats = freeze.freeze(site)
+    assert stats['rendered'] < 10
+    assert 'Nice post' in read(site, '/blog/1/')
+
+    database.update_post(2, 'Post 1', '2024-01-01', 'Edited content', 'Excerpt 1', None, 'python, flask')
+    freeze.freeze(site)
+    assert 'Edited content' in read(site, '/blog/2/')
+
+    database.delete_post(8)
+    stats = freeze.freeze(site)
+    assert stats['removed'] == 1
+    assert not os.path.exists(os.path.join(site, 'blog', '8'))
+
+    # --full renders everything again
+    assert freeze.freeze(site, full=True)['unchanged'] == 0
+
+def test_large_rebuilds_use_a_process_pool(site, monkeypatch):
+    """Test that pages rendered by pool processes match the ones rendered here"""
+    freeze.freeze(site)
+    expected = read(site, '/blog/date_desc/2/')
+
+    monkeypatch.setattr(freeze, 'POOL_THRESHOLD', 0)
+    stats = freeze.freeze(site, workers=2, full=True)
+    assert stats['failed'] == []
+    assert read(site, '/blog/date_desc/2/') == expected
@@ -0,0 +1,169 @@
+"""
+Tests for uploaded images
+Tests content-addressed storage with reference counts, srcset output,
+recording and cleanup of the resized copies, and resizing (with Pillow)
+"""
+import hashlib
+import io
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app
+import database
+import images
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Set up a test client that saves uploads to a temporary folder, logged in"""
+    database.DATABASE = TEST_DATABASE
+    app.config['TESTING'] = True
+    app.config['SECRET_KEY'] = 'test-secret-key'
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    # Unused uploads are deleted right away, not after the grace period
+    monkeypatch.setattr(database, 'UPLOAD_GRACE', 0)
+
+    database.init_db()
+    database.create_post('Test Post', 'Test content for testing', 'Test excerpt', None, 'test, flask')
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        yield client
+
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def record_copies(folder):
+    """Store /static/uploads/photo.png with two copies and make it post 1's image"""
+    variants = [(width, fmt, f'/static/uploads/photo-{width}.{ext}')
+                for width in (320, 640) for fmt, ext in (('webp', 'webp'), ('png', 'png'))]
+    for name in ['photo.png'] + [url.split('/')[-1] for _, _, url in variants]:
+        (folder / name).write_bytes(b'image')
+    database.store_upload('0' * 64, '/static/uploads/photo.png', 5, lambda url: None)
+    database.record_image_variants('/static/uploads/photo.png', variants)
+    database.update_post(1, 'Test Post', '2024-12-15', 'Test content for testing', 'Test excerpt',
+                         '/static/uploads/photo.png', 'test, flask')
+
+def upload(client, data, post_id=None):
+    """Create a post (or change post_id's image) with an uploaded file"""
+    form = {
+        'title': 'Uploaded', 'content': 'Post with an uploaded image', 'excerpt': 'Excerpt',
+        'tags': 'test', 'image_option': 'upload', 'image_file': (io.BytesIO(data), 'photo.png')
+    }
+    path = f'/blog/{post_id}/edit' if post_id else '/blog/new'
+    return client.post(path, data=form, content_type='multipart/form-data')
+
+def uploaded_files(folder):
+    """Uploaded originals in folder (not the resized copies)"""
+    return sorted(name for name in os.listdir(folder) if '-' not in name)
+
+def test_srcsets():
+    """Test that recorded copies become WebP and fallback srcsets, in any order"""
+    variants = images.srcsets([(320, 'jpeg', '/a-320.jpg'), (640, 'jpeg', '/a-640.jpg'),
+                               (320, 'webp', '/a-320.webp'), (640, 'webp', '/a-640.webp')])
+    assert variants.webp_srcset == '/a-320.webp 320w, /a-640.webp 640w'
+    assert variants.srcset == '/a-320.jpg 320w, /a-640.jpg 640w'
+    assert variants.src == '/a-640.jpg'
+    assert images.srcsets([]) is None
+
+    column = '640 webp /a-640.webp\n320 jpeg /a-320.jpg\n640 jpeg /a-640.jpg\n320 webp /a-320.webp'
+    assert images.parse_variants(column).srcset == variants.srcset
+    assert images.parse_variants(None) is None
+
+def test_pages_use_recorded_copies(client, tmp_path, monkeypatch):
+    """Test that cards and post pages send srcset once the copies are recorded"""
+    assert b'srcset' not in client.get('/blog').data
+
+    record_copies(tmp_path)
+    # The copies come with the post records, never from a lookup while rendering
+    def not_called(image_url):
+        raise AssertionError('image variants looked up while rendering')
+    monkeypatch.setattr(database, 'get_image_variants', not_called)
+    for path in ('/', '/blog', '/blog/1'):
+        data = client.get(path).data
+        assert b'srcset="/static/uploads/photo-320.webp 320w, /static/uploads/photo-640.webp 640w"' in data
+        assert b'sizes=' in data
+
+def test_deleting_post_removes_copies(client, tmp_path):
+    """Test that deleting a post removes its upload and every copy"""
+    record_copies(tmp_path)
+    client.post('/blog/1/delete')
+    assert os.listdir(tmp_path) == []
+    assert database.get_image_variants('/static/uploads/photo.png') == ()
+
+def test_replacing_image_removes_copies(client, tmp_path):
+    """Test that switching a post to a linked image removes the old upload's copies"""
+    record_copies(tmp_path)
+    client.post('/blog/1/edit', data={
+        'title': 'Test Post', 'content': 'Test content for testing', 'excerpt': 'Test excerpt',
+        'tags': 'test', 'image_option': 'url', 'image_url': 'https://example.com/a.png'
+    })
+    assert os.listdir(tmp_path) == []
+
+def test_upload_is_resized(client, tmp_path):
+    """Test that an upload is written at each width as WebP and JPEG, without metadata"""
+    Image = pytest.importorskip('PIL.Image')
+    upload = io.BytesIO()
+    Image.new('RGB', (1600, 900), 'teal').save(upload, 'PNG')
+    upload.seek(0)
+
+    image_url = None
+    with app.test_request_context():
+        from werkzeug.datastructures import FileStorage
+        from app import save_uploaded_file
+        image_url = save_uploaded_file(FileStorage(upload, 'photo.png'))
+    images._executor.submit(lambda: None).result()   # Wait for the background thread
+
+    variants = database.get_image_variants(image_url)
+    assert image_url == f'/static/uploads/{hashlib.sha256(upload.getvalue()).hexdigest()}.png'
+    assert sorted((width, fmt) for width, fmt, _ in variants) == [
+        (320, 'jpeg'), (320, 'webp'), (640, 'jpeg'), (640, 'webp'), (1280, 'jpeg'), (1280, 'webp')
+    ]
+    for width, fmt, url in variants:
+        with Image.open(tmp_path / url.split('/')[-1]) as copy:
+            assert copy.width == width
+            assert copy.height == round(900 * width / 1600)
+            assert 'exif' not in copy.info
+
+def test_same_content_is_stored_once(client, tmp_path, monkeypatch):
+    """Test that uploads are named by their SHA-256 and re-uploads reuse the file"""
+    data = b'not really a png, but the same bytes twice'
+    upload(client, data)
+    upload(client, data)
+    name = hashlib.sha256(data).hexdigest() + '.png'
+    assert uploaded_files(tmp_path) == [name]
+
+    posts = database.get_post_summaries('date_desc', limit=3)
+    assert [post['image_url'] for post in posts[:2]] == [f'/static/uploads/{name}'] * 2
+
+    # Content-addressed files never change, so they can be cached forever
+    static = tmp_path.parent / f'{tmp_path.name}-static'
+    static.mkdir()
+    (static / 'uploads').symlink_to(tmp_path)
+    monkeypatch.setattr(app, 'static_folder', str(static))
+    response = client.get(f'/static/uploads/{name}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    response.close()
+
+def test_file_deleted_with_its_last_post(client, tmp_path):
+    """Test that a shared upload is only deleted when no post uses it any more"""
+    upload(client, b'shared image')
+    upload(client, b'shared image')
+    first, second = [post['id'] for post in database.get_post_summaries('date_asc', limit=3)[1:]]
+
+    client.post(f'/blog/{first}/delete')
+    assert len(uploaded_files(tmp_path)) == 1
+
+    # Replacing the last post's image deletes the old file and keeps the new one
+    upload(client, b'another image', post_id=second)
+    assert uploaded_files(tmp_path) == [hashlib.sha256(b'another image').hexdigest() + '.png']
+    client.post(f'/blog/{second}/delete')
+    assert uploaded_files(tmp_path) == []
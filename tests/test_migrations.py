@@ -0,0 +1,137 @@
+"""
+Tests for schema migrations and query plans
+Tests upgrading old databases and that hot queries use indexes
+"""
+import pytest
+import sqlite3
+import os
+import sys
+
+# Add parent directory to path so we can import our modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import migrations
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def test_db():
+    """Point the database module at an empty test database"""
+    database.DATABASE = TEST_DATABASE
+    yield
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def test_new_database_gets_every_migration(test_db):
+    """Test that a new database is brought to the latest version"""
+    database.init_db()
+
+    conn = sqlite3.connect(TEST_DATABASE)
+    versions = [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+    conn.close()
+    assert versions == [version for version, _, _ in migrations.MIGRATIONS]
+
+def test_migrations_upgrade_old_database(test_db):
+    """Test upgrading a database created from the original schema.sql"""
+    conn = sqlite3.connect(TEST_DATABASE)
+    with open(migrations.SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.execute(
+        "INSERT INTO posts (title, date, content, excerpt, tags, created_at) "
+        "VALUES ('Old', '2024-01-01', 'C', 'E', 'python, flask', '2024-01-01 10:00:00')"
+    )
+    conn.commit()
+
+    assert migrations.migrate(conn) == [version for version, _, _ in migrations.MIGRATIONS]
+    # Running again does nothing
+    assert migrations.migrate(conn) == []
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    conn.close()
+
+    posts = database.get_posts_by_tag('flask')
+    assert [post['title'] for post in posts] == ['Old']
+
+def test_existing_content_is_compressed(test_db):
+    """Test that upgrading compresses long existing bodies and keeps them searchable"""
+    conn = sqlite3.connect(TEST_DATABASE)
+    with open(migrations.SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.execute(
+        "INSERT INTO posts (title, date, content, excerpt, tags, created_at) "
+        "VALUES ('Old', '2024-01-01', ?, 'E', 'python', '2024-01-01 10:00:00')",
+        ('Sourdough starter notes. ' * 100,)
+    )
+    conn.commit()
+    migrations.migrate(conn)
+    assert conn.execute('SELECT typeof(content) FROM posts').fetchone()[0] == 'blob'
+    conn.close()
+
+    assert database.get_post_by_id(1)['content'] == 'Sourdough starter notes. ' * 100
+    assert [post['title'] for post in database.search_posts('sourdough')[0]] == ['Old']
+
+def test_existing_posts_are_rendered(test_db):
+    """Test that migration 9 fills in the rendered columns of existing posts"""
+    conn = sqlite3.connect(TEST_DATABASE)
+    with open(migrations.SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.execute(
+        "INSERT INTO posts (title, date, content, excerpt, tags, created_at) "
+        "VALUES ('Old', '2024-01-01', '# Intro\n**Bold** text', 'E', 'python', '2024-01-01 10:00:00')"
+    )
+    conn.commit()
+    migrations.migrate(conn)
+    conn.close()
+
+    post = database.get_post_by_id(1)
+    assert post['content_html'] == '<h3 id="intro">Intro</h3>\n<p><strong>Bold</strong> text</p>'
+    assert post['created_display'] == '01 jan 2024 - 10:00'
+    assert database.get_post_summaries()[0]['created_display'] == '01 jan 2024 - 10:00'
+
+def test_existing_uploads_are_counted(test_db):
+    """Test that migration 11 records existing uploads with the posts using them"""
+    conn = sqlite3.connect(TEST_DATABASE)
+    with open(migrations.SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.executemany(
+        "INSERT INTO posts (title, date, content, excerpt, image_url, created_at) "
+        "VALUES ('Old', '2024-01-01', 'C', 'E', ?, '2024-01-01 10:00:00')",
+        [('/static/uploads/a.png',), ('/static/uploads/a.png',), ('https://example.com/b.png',)]
+    )
+    conn.commit()
+    migrations.migrate(conn)
+    assert conn.execute('SELECT url, refs FROM uploads').fetchall() == [('/static/uploads/a.png', 2)]
+
+    # The triggers keep the count up to date
+    conn.execute('DELETE FROM posts WHERE id = 1')
+    conn.execute("UPDATE posts SET image_url = NULL WHERE id = 2")
+    assert conn.execute('SELECT refs FROM uploads').fetchone()[0] == 0
+    conn.close()
+
+def test_failed_migration_is_rolled_back(test_db, monkeypatch):
+    """Test that a migration that fails leaves no partial changes behind"""
+    latest = migrations.LATEST_VERSION
+
+    def broken(conn):
+        conn.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [(99, 'Broken', broken)])
+    monkeypatch.setattr(migrations, 'LATEST_VERSION', 99)
+
+    conn = sqlite3.connect(TEST_DATABASE)
+    with pytest.raises(RuntimeError):
+        migrations.migrate(conn)
+
+    assert migrations.current_version(conn) == latest
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    conn.close()
+
+def test_hot_queries_use_indexes(test_db):
+    """Test that no hot query scans a whole table or sorts in a temp B-tree"""
+    database.init_db()
+    for i in range(50):
+        database.create_post(f'Post {i}', 'Content', 'Excerpt', None, f'python, tag{i % 5}')
+
+    assert database.check_query_plans() == []
@@ -0,0 +1,130 @@
+"""
+Tests for the pre-rendered pages
+Tests serving from disk ahead of Flask, stale marking on writes and the refresh thread
+"""
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as app_module
+import database
+import prerender
+from app import app, prerendered
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Set up a test client with pre-rendered pages written to a temporary directory"""
+    database.DATABASE = TEST_DATABASE
+    app.config['TESTING'] = True
+    app.config['SECRET_KEY'] = 'test-secret-key'
+    monkeypatch.setattr(prerender, 'ENABLED', True)
+    monkeypatch.setattr(prerendered, 'directory', str(tmp_path))
+    monkeypatch.setattr(prerendered, '_ready', False)
+
+    database.init_db()
+    database.create_post('Test Post', 'Test content for testing', 'Test excerpt', None, 'test, flask')
+
+    # A client without a cookie jar, like a first-time visitor
+    with app.test_client(use_cookies=False) as client:
+        yield client
+
+    prerendered.wait_idle()
+    prerendered.clear()
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def test_saved_page_is_sent_without_flask(client, tmp_path, monkeypatch):
+    """Test that the second request for a page is sent from disk, byte for byte"""
+    first = client.get('/blog/1')
+    assert 'X-Prerendered' not in first.headers
+    assert len(os.listdir(prerendered.path)) == 1
+
+    def not_called(*args, **kwargs):
+        raise AssertionError('Flask rendered a pre-rendered page')
+    monkeypatch.setattr(app_module, 'render_template', not_called)
+
+    second = client.get('/blog/1')
+    assert second.headers['X-Prerendered'] == 'HIT'
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert int(second.headers['Content-Length']) == len(first.data)
+
+    # Query parameters that don't change the page share its copy
+    assert client.get('/blog/1?utm_source=feed').headers['X-Prerendered'] == 'HIT'
+    assert client.get('/blog/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+def test_stale_page_served_until_max_stale(client, monkeypatch):
+    """Test that a write marks pages stale, and old copies expire after MAX_STALE"""
+    monkeypatch.setattr(prerendered, 'render', None)   # No refresh thread
+    client.get('/blog/1')
+    client.get('/about')
+
+    database.create_comment(1, 'Alice', 'Fresh comment', '2024-12-15 10:00')
+    response = client.get('/blog/1')
+    assert response.headers['X-Prerendered'] == 'STALE'
+    assert b'Fresh comment' not in response.data
+    # Pages that don't use the post are still current
+    assert client.get('/about').headers['X-Prerendered'] == 'HIT'
+
+    monkeypatch.setattr(prerendered, 'max_stale', 0)
+    response = client.get('/blog/1')
+    assert 'X-Prerendered' not in response.headers
+    assert b'Fresh comment' in response.data
+    assert client.get('/blog/1').headers['X-Prerendered'] == 'HIT'
+
+def test_refresh_thread_renders_stale_pages(client):
+    """Test that stale pages are rendered again in the background"""
+    client.get('/blog/1')
+    client.get('/tag/flask')
+
+    database.update_post(1, 'Edited Title', '2024-12-15', 'New content', 'Test excerpt', None, 'test, flask')
+    prerendered.wait_idle()
+    for path in ('/blog/1', '/tag/flask'):
+        response = client.get(path)
+        assert response.headers['X-Prerendered'] == 'HIT'
+        assert b'Edited Title' in response.data
+    assert prerendered.stats()['refreshes'] == 2
+
+    # A deleted post's page can't be rendered again, so it is dropped
+    database.delete_post(1)
+    prerendered.wait_idle()
+    assert client.get('/blog/1').status_code == 404
+
+def test_sessions_and_forms_go_to_flask(client):
+    """Test that logged-in visitors, flash messages and POSTs are never served from disk"""
+    client.get('/blog/1')
+
+    response = client.get('/blog/1', headers={'Cookie': 'session=anything'})
+    assert 'X-Prerendered' not in response.headers
+    response = client.post('/blog/1', data={'author': 'Alice', 'comment_text': 'Nice post'})
+    assert response.status_code == 302
+
+    # A page that flashed a message is not saved
+    client.get('/blog?after=not-a-cursor')
+    assert 'X-Prerendered' not in client.get('/blog?after=not-a-cursor').headers
+
+def test_store_is_bounded(client, monkeypatch):
+    """Test that the least recently used pages are deleted past max_pages, and junk URLs aren't saved"""
+    monkeypatch.setattr(prerendered, 'max_pages', 2)
+    evictions = prerendered.stats()['evictions']
+    client.get('/blog/1')
+    client.get('/about')
+    client.get('/blog/1')      # /about is now the least recently used
+    client.get('/blog')
+
+    assert prerendered.stats()['pages'] == 2
+    assert prerendered.stats()['evictions'] == evictions + 1
+    assert len(os.listdir(prerendered.path)) == 2
+    assert 'X-Prerendered' not in client.get('/about').headers
+
+    # Unknown sorts and tags without posts are 404s, which are never saved
+    saves = prerendered.stats()['saves']
+    assert client.get('/blog?sort=junk').status_code == 404
+    assert client.get('/tag/no-such-tag').status_code == 404
+    assert prerendered.stats()['saves'] == saves
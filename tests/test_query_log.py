@@ -0,0 +1,73 @@
+"""
+Unit tests for query instrumentation
+Tests query records, the slow query log and the debug response headers
+"""
+import logging
+import sqlite3
+import pytest
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import query_log
+from app import app
+
+TEST_DATABASE = 'test_blog.db'
+
+@pytest.fixture
+def instrumented_db(monkeypatch):
+    """Set up a test database whose connections are instrumented"""
+    monkeypatch.setattr(query_log, 'ENABLED', True)
+    database.DATABASE = TEST_DATABASE
+    database.init_db()
+    database.create_post('Test Post', 'Content', 'Excerpt', None, 'test')
+    yield
+    database.reset_pool()
+    if os.path.exists(TEST_DATABASE):
+        os.remove(TEST_DATABASE)
+
+def test_connections_are_plain_when_disabled():
+    """Test that instrumentation adds nothing when it is turned off"""
+    conn = sqlite3.connect(':memory:')
+    assert query_log.instrument(conn) is conn
+
+def test_slow_queries_are_logged_with_plan(instrumented_db, monkeypatch, caplog):
+    """Test that queries over the threshold are logged with their query plan"""
+    monkeypatch.setattr(query_log, 'SLOW_QUERY_MS', 0)
+    monkeypatch.setattr(query_log, 'EXPLAIN_SLOW_QUERIES', True)
+
+    with caplog.at_level(logging.WARNING, logger='blog.queries'):
+        database.get_post_by_id(1)
+
+    message = caplog.records[-1].getMessage()
+    assert message.startswith('Slow query')
+    assert '1 params, 1 rows' in message
+    assert 'FROM posts' in message
+    assert 'SEARCH posts USING INTEGER PRIMARY KEY' in message
+
+def test_fast_queries_are_not_logged(instrumented_db, caplog):
+    """Test that queries under the threshold stay out of the warning log"""
+    with caplog.at_level(logging.WARNING, logger='blog.queries'):
+        database.get_post_by_id(1)
+        database.get_post_summaries()
+    assert caplog.records == []
+
+def test_query_count_header_in_debug_mode(instrumented_db):
+    """Test that debug responses report how many queries the request ran"""
+    app.config['TESTING'] = True
+    app.debug = True
+    try:
+        with app.test_client() as client:
+            response = client.get('/blog/1')
+    finally:
+        app.debug = False
+
+    # The post's version (for conditional GET), the post and its comments
+    assert response.headers['X-Query-Count'] == '3'
+    assert float(response.headers['X-Query-Time-Ms']) >= 0
+
+    with app.test_client() as client:
+        assert 'X-Query-Count' not in client.get('/blog/1').headers
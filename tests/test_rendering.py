@@ -0,0 +1,93 @@
+"""
+Tests for write-time rendering of posts
+Tests the Markdown subset, tables of contents, reading time and date formats
+"""
+import pytest
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import compression
+from rendering import (
+    render_markdown,
+    render_toc,
+    render_post,
+    reading_time,
+    norwegian_date,
+    norwegian_datetime
+)
+
+def test_plain_text_becomes_paragraphs():
+    """Test that blank lines split paragraphs and single line breaks are kept"""
+    html, headings = render_markdown('First line\nsecond line\n\nNew paragraph')
+    assert html == '<p>First line<br>\nsecond line</p>\n<p>New paragraph</p>'
+    assert headings == []
+
+def test_markdown_blocks_and_inline_formatting():
+    """Test headings, lists, quotes, code and inline styles"""
+    html, headings = render_markdown(
+        '# Getting started\n'
+        'Use **Flask** and *Jinja*, see [the docs](https://flask.palletsprojects.com).\n'
+        '\n'
+        '- one\n'
+        '- two\n'
+        '\n'
+        '1. first\n'
+        '\n'
+        '> A quote\n'
+        '\n'
+        '```\n'
+        'print("<hi>")\n'
+        '```\n'
+        '## Getting started'
+    )
+    assert '<h3 id="getting-started">Getting started</h3>' in html
+    assert '<strong>Flask</strong>' in html
+    assert '<em>Jinja</em>' in html
+    assert '<a href="https://flask.palletsprojects.com">the docs</a>' in html
+    assert '<ul>\n<li>one</li>\n<li>two</li>\n</ul>' in html
+    assert '<ol>\n<li>first</li>\n</ol>' in html
+    assert '<blockquote><p>A quote</p></blockquote>' in html
+    assert '<pre><code>print(&quot;&lt;hi&gt;&quot;)</code></pre>' in html
+    # Repeated headings get unique anchors
+    assert headings == [(3, 'getting-started', 'Getting started'),
+                        (4, 'getting-started-2', 'Getting started')]
+
+def test_html_in_posts_is_escaped():
+    """Test that HTML and unsafe links in post text never reach the page"""
+    html, _ = render_markdown('<script>alert(1)</script> [click](javascript:alert) `<b>`')
+    assert '<script>' not in html
+    assert '&lt;script&gt;' in html
+    assert 'href' not in html
+    assert '<code>&lt;b&gt;</code>' in html
+
+def test_table_of_contents_needs_several_headings():
+    """Test that short posts get no table of contents"""
+    assert render_toc([(3, 'intro', 'Intro')]) == ''
+    toc = render_toc([(3, 'intro', 'Intro'), (4, 'setup', 'Setup & install')])
+    assert toc.startswith('<nav class="post-toc">')
+    assert '<li class="toc-level-1"><a href="#intro">Intro</a></li>' in toc
+    assert '<li class="toc-level-2"><a href="#setup">Setup &amp; install</a></li>' in toc
+
+def test_reading_time():
+    """Test that reading time is rounded and at least one minute"""
+    assert reading_time('') == 1
+    assert reading_time('word ' * 50) == 1
+    assert reading_time('word ' * 1000) == 5
+
+def test_render_post_compresses_long_html():
+    """Test that stored HTML is compressed like post content"""
+    content_html, toc_html, minutes = render_post('A sentence about Flask. ' * 200)
+    assert isinstance(content_html, bytes)
+    assert compression.decompress(content_html).startswith('<p>A sentence about Flask.')
+    assert toc_html == ''
+    assert minutes == 4
+
+def test_norwegian_dates():
+    """Test the Norwegian date formats, and that bad values pass through"""
+    assert norwegian_date('2025-12-17') == '17 des 2025'
+    assert norwegian_datetime('2025-05-03 14:30:00') == '03 mai 2025 - 14:30'
+    assert norwegian_datetime('not a date') == 'not a date'
+    assert norwegian_date(None) is None
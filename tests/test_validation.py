@@ -13,6 +13,7 @@ from validation import (
     validate_comment_data,
     validate_image_url,
     validate_pagination_params,
+    validate_search_query,
     sanitize_tags
 )
 
@@ -231,6 +232,28 @@ class TestValidatePaginationParams:
         assert page == 1
 
 
+class TestValidateSearchQuery:
+    """Tests for search query validation"""
+
+    def test_valid_query(self):
+        """Test that a normal query passes validation"""
+        is_valid, error = validate_search_query("flask sqlite")
+        assert is_valid is True
+        assert error is None
+
+    def test_empty_query(self):
+        """Test that empty or whitespace-only queries fail"""
+        is_valid, error = validate_search_query("   ")
+        assert is_valid is False
+        assert "search for" in error
+
+    def test_query_too_long(self):
+        """Test that queries over 200 characters fail"""
+        is_valid, error = validate_search_query("a" * 201)
+        assert is_valid is False
+        assert "200 characters" in error
+
+
 class TestSanitizeTags:
     """Tests for tag sanitization"""
 
@@ -111,6 +111,23 @@ def validate_pagination_params(page, per_page=6):
         return False, "Invalid page parameter", 1
 
 
+def validate_search_query(query):
+    """
+    Validate a search query from the search box
+
+    Returns:
+        tuple: (is_valid, error_message)
+    """
+    if not query or not query.strip():
+        return False, "Please enter something to search for"
+
+    # Long queries are expensive to match and never useful
+    if len(query) > 200:
+        return False, "Search query must be 200 characters or less"
+
+    return True, None
+
+
 def sanitize_tags(tags):
     """
     Sanitize and normalize tag input